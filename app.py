@@ -1,13 +1,12 @@
-from keras_vggface.utils import preprocess_input
-from keras_vggface.vggface import VGGFace
-from src.utils.all_utils import read_yaml, create_directory
-import pickle
-from sklearn.metrics.pairwise import cosine_similarity
+from src.utils.all_utils import read_yaml
+from src.utils.embedding_store import get_store_dir
+from src.utils.face_detection import FaceDetector, face_array
+from src.utils.inference_backend import load_backend, preprocess_input
+from src.utils.image_io import decode_image, save_upload
+from src.utils.live_index import LiveIndex
 import streamlit as st 
 from PIL import Image
 import os
-import cv2
-from mtcnn import MTCNN
 import numpy as np
 
 # Load configurations and paths
@@ -21,75 +20,65 @@ artifacts_dir = artifacts['artifacts_dir']
 upload_image_dir = artifacts['upload_image_dir']
 uploadn_path = os.path.join(artifacts_dir, upload_image_dir)
 
-# pickle format data
-pickle_format_data_dir = artifacts['pickle_format_data_dir']
-img_pickle_file_name = artifacts['img_pickle_file_name']
+# embedding store
+embedding_store_dir = get_store_dir(config)
+gallery_dir = os.path.join(artifacts_dir, artifacts['gallery_dir'])
 
-raw_local_dir_path = os.path.join(artifacts_dir, pickle_format_data_dir)
-pickle_file = os.path.join(raw_local_dir_path, img_pickle_file_name)
+# search params
+top_k = params['search']['top_k']
+score_threshold = params['search']['score_threshold']
 
-# feature path
-feature_extraction_dir = artifacts['feature_extraction_dir']
-extracted_features_name = artifacts['extracted_features_name']
-
-feature_extraction_path = os.path.join(artifacts_dir, feature_extraction_dir)
-features_name = os.path.join(feature_extraction_path, extracted_features_name)
-
-# model params
-model_name = params['base']['BASE_MODEL']
-include_tops = params['base']['include_top']
-poolings = params['base']['pooling']
+# upload params
+upload = params['upload']
 
 # Load detector and model
-detector = MTCNN()
-model = VGGFace(model=model_name, include_top=include_tops, 
-                input_shape=(224,224,3), pooling=poolings)
-
-# Load stored features and filenames
-feature_list = pickle.load(open(features_name,'rb'))
-filenames = pickle.load(open(pickle_file,'rb'))
+detector = FaceDetector(params['detection'])
+model = load_backend(config, params)
+
+# Load stored features and filenames once per server; the watcher swaps in
+# rebuilt or appended indexes and every script run uses the newest one
+@st.experimental_singleton
+def get_live_index():
+    live_index = LiveIndex(config, params, embedding_store_dir, gallery_dir,
+                           poll_seconds=params['reload']['poll_seconds'])
+    live_index.load()
+    if params['reload']['enabled']:
+        live_index.start()
+    return live_index
+
+snapshot = get_live_index().current
+filenames = snapshot.filenames
+search_index = snapshot.search_index
 
 # Function to save uploaded image
 def save_uploaded_image(uploaded_image):
     try:
-        create_directory(dirs=[uploadn_path])
-        with open(os.path.join(uploadn_path, uploaded_image.name), 'wb') as f:
-            f.write(uploaded_image.getbuffer())
+        save_upload(uploaded_image.getvalue(), uploadn_path, uploaded_image.name)
         return True
     except:
         return False
 
 # Feature extraction from face image
-def extract_features(img_path, model, detector):
-    img = cv2.imread(img_path)
-    results = detector.detect_faces(img)
+def extract_features(image, model, detector):
+    img = decode_image(image, max_bytes=upload['max_bytes'], max_side=upload['max_side'])
+    results = detector.detect(img)
 
     if len(results) == 0:
         return None
 
-    x, y, width, height = results[0]['box']
-    face = img[y:y + height, x:x + width]
-
-    image = Image.fromarray(face)
-    image = image.resize((224, 224))
-
-    face_array = np.asarray(image).astype('float32')
-    expanded_img = np.expand_dims(face_array, axis=0)
+    box, _ = results[0]
+    expanded_img = np.expand_dims(face_array(img, box), axis=0)
     preprocessed_img = preprocess_input(expanded_img)
 
     result = model.predict(preprocessed_img).flatten()
     return result
 
 # Recommend most similar face with score
-def recommend(feature_list, features):
-    similarity = []
-    for i in range(len(feature_list)):
-        sim = cosine_similarity(features.reshape(1, -1), feature_list[i].reshape(1, -1))[0][0]
-        similarity.append(sim)
-
-    sorted_list = sorted(list(enumerate(similarity)), reverse=True, key=lambda x: x[1])
-    index_pos, best_score = sorted_list[0]
-    return index_pos, best_score
+def recommend(search_index, features):
+    matches = search_index.search(features, k=top_k, threshold=score_threshold)
+    if not matches:
+        return -1, 0.0
+    return matches[0]
 
 # Streamlit interface
 logo_path = "college_logo.png"
@@ -114,13 +103,16 @@ if option == "Use Webcam":
 
     if camera_image is not None:
         image = Image.open(camera_image).convert("RGB")
-        create_directory([uploadn_path])
-        temp_path = os.path.join(uploadn_path, "captured_image.jpg")
-        image.save(temp_path)
-
-        features = extract_features(temp_path, model, detector)
+        if upload['persist']:
+            save_uploaded_image(camera_image)
+
+        try:
+            features = extract_features(camera_image.getvalue(), model, detector)
+        except ValueError as e:
+            st.error(str(e))
+            st.stop()
         if features is not None:
-            index_pos, score = recommend(feature_list, features)
+            index_pos, score = recommend(search_index, features)
             percentage = round(score * 100, 2)
 
             if 0 <= index_pos < len(filenames):
@@ -136,20 +128,24 @@ if option == "Use Webcam":
                 st.image(image)
             with col2:
                 st.header(f"Seems like {predicted_actor} ({percentage}% match)")
-                st.image(filenames[index_pos], width=300)
+                if 0 <= index_pos < len(filenames):
+                    st.image(filenames[index_pos], width=300)
         else:
             st.warning("No face detected. Try again with better lighting.")
 
 elif option == "Upload Image":
     uploaded_image = st.file_uploader("Upload an image")
     if uploaded_image is not None:
-        if save_uploaded_image(uploaded_image):
+        if not upload['persist'] or save_uploaded_image(uploaded_image):
             display_image = Image.open(uploaded_image)
-            image_path = os.path.join(uploadn_path, uploaded_image.name)
 
-            features = extract_features(image_path, model, detector)
+            try:
+                features = extract_features(uploaded_image.getvalue(), model, detector)
+            except ValueError as e:
+                st.error(str(e))
+                st.stop()
             if features is not None:
-                index_pos, score = recommend(feature_list, features)
+                index_pos, score = recommend(search_index, features)
                 percentage = round(score * 100, 2)
 
                 if 0 <= index_pos < len(filenames):
@@ -165,7 +161,8 @@ elif option == "Upload Image":
                     st.image(display_image)
                 with col2:
                     st.header(f"Seems like {predicted_actor} ({percentage}% match)")
-                    st.image(filenames[index_pos], width=300)
+                    if 0 <= index_pos < len(filenames):
+                        st.image(filenames[index_pos], width=300)
             else:
                 st.warning("No face detected in uploaded image.")
 
@@ -0,0 +1,78 @@
+'''
+Recall vs. latency report for the IVF index against exact search.
+
+Runs on the real embedding store when --store is given, otherwise on a
+synthetic clustered gallery (identities with several noisy images each).
+
+    python -m benchmarks.bench_ann --rows 200000 --nprobe 1 4 16 64
+    python -m benchmarks.bench_ann --store artifacts/extracted_features/embedding_store
+'''
+import argparse
+import time
+import numpy as np
+from src.utils.ann_index import IVFIndex
+from src.utils.embedding_store import EmbeddingStore
+from src.utils.search import SimilaritySearch, normalize_rows
+
+
+def synthetic_gallery(rows, dim, images_per_identity=20, noise=0.6, seed=0):
+    rng = np.random.default_rng(seed)
+    identities = rng.standard_normal((max(rows // images_per_identity, 1), dim), dtype=np.float32)
+    members = rng.integers(0, identities.shape[0], rows)
+    gallery = identities[members] + noise * rng.standard_normal((rows, dim), dtype=np.float32)
+    return normalize_rows(gallery)
+
+
+def make_queries(matrix, n_queries, noise=0.3, seed=1):
+    rng = np.random.default_rng(seed)
+    picked = np.asarray(matrix[rng.choice(matrix.shape[0], n_queries, replace=False)])
+    return normalize_rows(picked + noise * rng.standard_normal(picked.shape, dtype=np.float32) / np.sqrt(picked.shape[1]))
+
+
+def timed_search(index, queries, k, **kwargs):
+    results, timings = [], []
+    for query in queries:
+        start = time.perf_counter()
+        results.append([i for i, _ in index.search(query, k=k, **kwargs)])
+        timings.append(time.perf_counter() - start)
+    return results, np.array(timings) * 1000
+
+
+def recall(truth, approx, k):
+    return float(np.mean([len(set(t[:k]) & set(a[:k])) / len(t[:k]) for t, a in zip(truth, approx)]))
+
+
+def run(matrix, nlist, nprobes, n_queries, k=10):
+    queries = make_queries(matrix, n_queries)
+    exact = SimilaritySearch(matrix, normalized=True)
+    truth, exact_ms = timed_search(exact, queries, k)
+
+    start = time.perf_counter()
+    ivf = IVFIndex.build(matrix, nlist=nlist, train_sample=100_000)
+    build_s = time.perf_counter() - start
+
+    print(f"rows={matrix.shape[0]} dim={matrix.shape[1]} nlist={nlist} build={build_s:.1f}s")
+    print(f"{'search':>12} {'recall@1':>10} {'recall@10':>10} {'p50 ms':>8} {'p95 ms':>8}")
+    print(f"{'exact':>12} {1.0:>10.3f} {1.0:>10.3f} "
+          f"{np.percentile(exact_ms, 50):>8.2f} {np.percentile(exact_ms, 95):>8.2f}")
+    for nprobe in nprobes:
+        approx, ivf_ms = timed_search(ivf, queries, k, nprobe=nprobe)
+        print(f"{'nprobe=' + str(nprobe):>12} {recall(truth, approx, 1):>10.3f} {recall(truth, approx, 10):>10.3f} "
+              f"{np.percentile(ivf_ms, 50):>8.2f} {np.percentile(ivf_ms, 95):>8.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store', default=None, help='Embedding store directory to benchmark on')
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--dim', type=int, default=2048)
+    parser.add_argument('--nlist', type=int, default=1024)
+    parser.add_argument('--nprobe', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--queries', type=int, default=200)
+    args = parser.parse_args()
+
+    if args.store:
+        matrix = EmbeddingStore.open(args.store).matrix
+    else:
+        matrix = synthetic_gallery(args.rows, args.dim)
+    run(matrix, args.nlist, args.nprobe, args.queries)
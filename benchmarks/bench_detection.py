@@ -0,0 +1,77 @@
+'''
+Per-detector latency and face recall on the sample images in
+artifacts/upload/. Full-resolution MTCNN is the reference: a reference
+face counts as found when a detector box overlaps it with IoU >= 0.5.
+
+    python -m benchmarks.bench_detection
+    python -m benchmarks.bench_detection --backends mtcnn haar --max-sides 0 320 640
+'''
+import argparse
+import glob
+import os
+import time
+import numpy as np
+from src.utils.all_utils import read_yaml
+from src.utils.face_detection import FaceDetector, box_iou
+from src.utils.image_io import decode_image
+
+
+def load_images(image_dir):
+    images = {}
+    for path in sorted(glob.glob(os.path.join(image_dir, '*'))):
+        try:
+            with open(path, 'rb') as f:
+                images[path] = decode_image(f.read())
+        except ValueError:
+            continue
+    return images
+
+
+def run_detector(detector, images, repeats):
+    boxes, timings = {}, []
+    for path, img in images.items():
+        for _ in range(repeats):
+            start = time.perf_counter()
+            faces = detector.detect(img)
+            timings.append(time.perf_counter() - start)
+        boxes[path] = [box for box, _ in faces]
+    return boxes, np.array(timings) * 1000
+
+
+def recall(reference, boxes):
+    found = total = 0
+    for path, ref_boxes in reference.items():
+        for ref in ref_boxes:
+            total += 1
+            found += any(box_iou(ref, box) >= 0.5 for box in boxes.get(path, []))
+    return found / total if total else float('nan')
+
+
+def run(detection, backends, max_sides, image_dir, repeats):
+    images = load_images(image_dir)
+    reference_detector = FaceDetector(dict(detection, backend='mtcnn', detect_max_side=None))
+    reference, _ = run_detector(reference_detector, images, 1)
+    print(f"{len(images)} images, {sum(map(len, reference.values()))} reference faces")
+    print(f"{'detector':>12} {'max_side':>9} {'p50 ms':>8} {'p95 ms':>8} {'recall':>7}")
+    for backend in backends:
+        for max_side in max_sides:
+            try:
+                detector = FaceDetector(dict(detection, backend=backend, detect_max_side=max_side or None))
+            except Exception as e:
+                print(f"{backend:>12} unavailable: {e}")
+                break
+            boxes, ms = run_detector(detector, images, repeats)
+            print(f"{backend:>12} {max_side or 'full':>9} {np.percentile(ms, 50):>8.1f} "
+                  f"{np.percentile(ms, 95):>8.1f} {recall(reference, boxes):>7.2f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--params', '--p', default='params.yaml')
+    parser.add_argument('--images', default='artifacts/upload')
+    parser.add_argument('--backends', nargs='+', default=['mtcnn', 'opencv_dnn', 'haar'])
+    parser.add_argument('--max-sides', type=int, nargs='+', default=[0, 640, 320],
+                        help='Detection resolutions to try, 0 for full resolution')
+    parser.add_argument('--repeats', type=int, default=3)
+    args = parser.parse_args()
+    run(read_yaml(args.params)['detection'], args.backends, args.max_sides, args.images, args.repeats)
@@ -0,0 +1,327 @@
+'''
+Stage-level benchmark of the matching pipeline, CPU only and offline.
+
+Times decode, detect, preprocess, predict and search separately (the
+steps of extract_features/recommend), plus stages 01, 01b and 02 end to end
+on a small data directory built from the sample images in
+artifacts/upload/. Search runs on a synthetic gallery of each requested
+size. Results are written as JSON with p50/p95/p99 latency and
+throughput per (stage, batch size, gallery size); --compare flags
+entries whose p50 regressed against a stored baseline and exits non-zero.
+The keras backend needs its VGGFace weights cached locally; stages that
+cannot run here are recorded with their error instead of failing the run.
+
+    python -m benchmarks.bench_pipeline --output bench_baseline.json
+    python -m benchmarks.bench_pipeline --gallery-sizes 10000 100000 --batch-sizes 1 8 32
+    python -m benchmarks.bench_pipeline --stages search --compare bench_baseline.json
+'''
+import argparse
+import glob
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import numpy as np
+import yaml
+from benchmarks.bench_ann import make_queries, synthetic_gallery
+from src.utils.all_utils import read_yaml
+from src.utils.ann_index import IVFIndex
+from src.utils.face_detection import face_array
+from src.utils.image_io import decode_image
+from src.utils.search import SimilaritySearch
+
+STAGES = ('decode', 'detect', 'preprocess', 'predict', 'search', 'stage01', 'stage01b', 'stage02')
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def summarize(name, timings, items_per_call=1, **params):
+    ms = np.asarray(timings) * 1000
+    return {
+        'name': name,
+        'params': params,
+        'calls': len(ms),
+        'p50_ms': round(float(np.percentile(ms, 50)), 3),
+        'p95_ms': round(float(np.percentile(ms, 95)), 3),
+        'p99_ms': round(float(np.percentile(ms, 99)), 3),
+        'mean_ms': round(float(ms.mean()), 3),
+        'throughput_per_s': round(items_per_call * 1000 / float(ms.mean()), 2) if ms.mean() else None,
+    }
+
+
+def result_key(result):
+    return result['name'] + ''.join(f"/{k}={v}" for k, v in sorted(result['params'].items()))
+
+
+def time_calls(fn, repeats, warmup=1):
+    for _ in range(warmup):
+        fn()
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def load_sample_bytes(image_dir):
+    samples = []
+    for path in sorted(glob.glob(os.path.join(image_dir, '*'))):
+        with open(path, 'rb') as f:
+            samples.append(f.read())
+    if not samples:
+        raise FileNotFoundError(f"No sample images in {image_dir}")
+    return samples
+
+
+def face_crops(params, images):
+    '''
+    One 224x224 face crop per sample image, cut like the API does (the
+    detected face, or the whole image when detection is unavailable or
+    finds nothing)
+    '''
+    try:
+        from src.utils.face_detection import FaceDetector
+        detector = FaceDetector(params['detection'])
+    except Exception:
+        detector = None
+    crops = []
+    for img in images:
+        results = detector.detect(img) if detector is not None else []
+        box = results[0][0] if results else (0, 0, img.shape[1], img.shape[0])
+        crops.append(face_array(img, box))
+    return crops
+
+
+def tile_batch(crops, batch_size):
+    return np.stack([crops[i % len(crops)] for i in range(batch_size)])
+
+
+def bench_decode(samples, params, repeats):
+    upload = params['upload']
+    results = []
+    for max_side in (upload['max_side'], None):
+        timings = []
+        for data in samples:
+            timings += time_calls(lambda: decode_image(data, max_bytes=upload['max_bytes'], max_side=max_side),
+                                  repeats)
+        results.append(summarize('decode', timings, max_side=max_side or 'full'))
+    return results
+
+
+def bench_detect(images, params, repeats):
+    from src.utils.face_detection import FaceDetector
+    detector = FaceDetector(params['detection'])
+    timings = []
+    for img in images:
+        timings += time_calls(lambda: detector.detect(img), repeats)
+    return [summarize('detect', timings, backend=detector.name)]
+
+
+def bench_preprocess(crops, batch_sizes, repeats):
+    from src.utils.inference_backend import preprocess_input
+    results = []
+    for batch_size in batch_sizes:
+        batch = tile_batch(crops, batch_size)
+        timings = time_calls(lambda: preprocess_input(batch.copy()), repeats)
+        results.append(summarize('preprocess', timings, batch_size, batch_size=batch_size))
+    return results
+
+
+def bench_predict(crops, config, params, backend, batch_sizes, repeats):
+    from src.utils.inference_backend import load_backend, preprocess_input
+    model = load_backend(config, params, backend=backend)
+    results = []
+    for batch_size in batch_sizes:
+        batch = preprocess_input(tile_batch(crops, batch_size))
+        timings = time_calls(lambda: model.predict(batch), repeats)
+        results.append(summarize('predict', timings, batch_size, batch_size=batch_size,
+                                 backend=backend or params['inference']['backend']))
+    return results
+
+
+def bench_search(gallery_sizes, dim, batch_sizes, params, repeats):
+    results = []
+    for gallery_size in gallery_sizes:
+        matrix = synthetic_gallery(gallery_size, dim)
+        queries = make_queries(matrix, max(batch_sizes))
+        indexes = {'exact': SimilaritySearch(matrix, normalized=True)}
+        nlist = min(params['ann']['nlist'], max(gallery_size // 40, 1))
+        indexes['ivf'] = IVFIndex.build(matrix, nlist=nlist, nprobe=params['ann']['nprobe'],
+                                        train_sample=params['ann']['train_sample'])
+        for index_name, index in indexes.items():
+            for batch_size in batch_sizes:
+                if batch_size == 1:
+                    timings = time_calls(lambda: index.search(queries[0], k=10), repeats)
+                else:
+                    timings = time_calls(lambda: index.search_batch(queries[:batch_size], k=10), repeats)
+                results.append(summarize('search', timings, batch_size, index=index_name,
+                                         gallery_size=gallery_size, dim=dim, batch_size=batch_size))
+    return results
+
+
+def make_stage_workspace(workspace, image_dir, stage_images, images_per_identity=10):
+    '''
+    data/<identity>/<image> tree of copies of the sample images, with a
+    config and params pointing every artifact into the workspace
+    '''
+    samples = sorted(glob.glob(os.path.join(image_dir, '*')))
+    data_dir = os.path.join(workspace, 'data')
+    for i in range(stage_images):
+        identity_dir = os.path.join(data_dir, f"identity_{i // images_per_identity:04d}")
+        os.makedirs(identity_dir, exist_ok=True)
+        source = samples[i % len(samples)]
+        shutil.copyfile(source, os.path.join(identity_dir, f"{i:06d}{os.path.splitext(source)[1]}"))
+
+    config = read_yaml(os.path.join(REPO_DIR, 'config', 'config.yaml'))
+    config['artifacts']['artifacts_dir'] = os.path.join(workspace, 'artifacts')
+    params = read_yaml(os.path.join(REPO_DIR, 'params.yaml'))
+    params['base']['data_path'] = data_dir
+    params['extraction']['workers'] = 1
+    paths = {}
+    for name, content in (('config', config), ('params', params)):
+        paths[name] = os.path.join(workspace, f"{name}.yaml")
+        with open(paths[name], 'w') as f:
+            yaml.safe_dump(content, f)
+    return paths
+
+
+def run_stage(script, paths):
+    env = dict(os.environ, PYTHONPATH=REPO_DIR + os.pathsep + os.environ.get('PYTHONPATH', ''))
+    start = time.perf_counter()
+    completed = subprocess.run([sys.executable, os.path.join(REPO_DIR, 'src', script),
+                                '--config', paths['config'], '--params', paths['params']],
+                               cwd=REPO_DIR, env=env, capture_output=True, text=True)
+    if completed.returncode != 0:
+        last_line = (completed.stderr.strip().splitlines() or ['no output'])[-1]
+        raise RuntimeError(f"{script} failed: {last_line}")
+    return time.perf_counter() - start
+
+
+def bench_stages(stages, image_dir, stage_images, repeats):
+    results = []
+    with tempfile.TemporaryDirectory() as workspace:
+        paths = make_stage_workspace(workspace, image_dir, stage_images)
+        for stage, script in (('stage01', '01_generate_img_pkl.py'), ('stage01b', '01b_detect_faces.py'),
+                              ('stage02', '02_feature_extractor.py')):
+            if stage not in stages:
+                continue
+            timings = []
+            try:
+                for _ in range(repeats):
+                    # Every stage 01b/02 run starts from empty face and feature caches
+                    shutil.rmtree(os.path.join(workspace, 'artifacts', 'extracted_features'), ignore_errors=True)
+                    if stage in ('stage01b', 'stage02'):
+                        run_stage('01_generate_img_pkl.py', paths)
+                    if stage == 'stage02':
+                        run_stage('01b_detect_faces.py', paths)
+                    timings.append(run_stage(script, paths))
+            except Exception as e:
+                results.append({'name': stage, 'params': {}, 'error': f"{type(e).__name__}: {e}"})
+                continue
+            results.append(summarize(stage, timings, stage_images, images=stage_images))
+    return results
+
+
+def compare(results, baseline, tolerance):
+    '''
+    Entries of results whose p50 is more than tolerance slower than the
+    same entry in baseline
+    '''
+    previous = {result_key(r): r for r in baseline['results'] if 'p50_ms' in r}
+    regressions = []
+    for result in results:
+        key = result_key(result)
+        if 'p50_ms' not in result or key not in previous:
+            continue
+        ratio = result['p50_ms'] / previous[key]['p50_ms'] if previous[key]['p50_ms'] else 1.0
+        if ratio > 1 + tolerance:
+            regressions.append({'key': key, 'baseline_p50_ms': previous[key]['p50_ms'],
+                                'p50_ms': result['p50_ms'], 'ratio': round(ratio, 3)})
+    return regressions
+
+
+def run(args):
+    config = read_yaml(args.config)
+    params = read_yaml(args.params)
+    samples = load_sample_bytes(args.images)
+    images = [decode_image(data, max_side=params['upload']['max_side']) for data in samples]
+    crops = face_crops(params, images) if {'preprocess', 'predict'} & set(args.stages) else []
+
+    groups = {
+        'decode': lambda: bench_decode(samples, params, args.repeats),
+        'detect': lambda: bench_detect(images, params, args.repeats),
+        'preprocess': lambda: bench_preprocess(crops, args.batch_sizes, args.repeats),
+        'predict': lambda: bench_predict(crops, config, params, args.backend, args.batch_sizes, args.repeats),
+        'search': lambda: bench_search(args.gallery_sizes, args.dim, args.batch_sizes, params, args.repeats),
+    }
+    results = []
+    for stage in args.stages:
+        if stage not in groups:
+            continue
+        try:
+            stage_results = groups[stage]()
+        except Exception as e:
+            stage_results = [{'name': stage, 'params': {}, 'error': f"{type(e).__name__}: {e}"}]
+        results += stage_results
+        for result in stage_results:
+            print(f"{result_key(result):<60} " + (
+                f"p50={result['p50_ms']:.2f}ms p95={result['p95_ms']:.2f}ms "
+                f"p99={result['p99_ms']:.2f}ms {result['throughput_per_s']}/s"
+                if 'error' not in result else f"unavailable: {result['error']}"))
+
+    stages = {'stage01', 'stage01b', 'stage02'} & set(args.stages)
+    if stages:
+        stage_results = bench_stages(stages, args.images, args.stage_images, args.stage_repeats)
+        results += stage_results
+        for result in stage_results:
+            print(f"{result_key(result):<60} " + (
+                f"p50={result['p50_ms'] / 1000:.2f}s {result['throughput_per_s']} images/s"
+                if 'error' not in result else f"unavailable: {result['error']}"))
+
+    report = {
+        'meta': {'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                 'python': platform.python_version(), 'numpy': np.__version__,
+                 'machine': platform.machine(), 'cpu_count': os.cpu_count(),
+                 'args': vars(args)},
+        'results': results,
+    }
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump(report, f, indent=2)
+        print(f"results written to {args.output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            regressions = compare(results, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"REGRESSION {regression['key']}: {regression['baseline_p50_ms']:.2f}ms -> "
+                  f"{regression['p50_ms']:.2f}ms (x{regression['ratio']})")
+        print(f"{len(regressions)} regressions against {args.compare} (tolerance {args.tolerance:.0%})")
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--config', '--c', default='config/config.yaml')
+    parser.add_argument('--params', '--p', default='params.yaml')
+    parser.add_argument('--images', default='artifacts/upload')
+    parser.add_argument('--stages', nargs='+', choices=STAGES, default=list(STAGES))
+    parser.add_argument('--backend', default=None, help='Inference backend, defaults to inference.backend')
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 8, 32])
+    parser.add_argument('--gallery-sizes', type=int, nargs='+', default=[10_000, 100_000])
+    parser.add_argument('--dim', type=int, default=2048)
+    parser.add_argument('--repeats', type=int, default=20)
+    parser.add_argument('--stage-images', type=int, default=40,
+                        help='Images in the synthetic data directory for stages 01/02')
+    parser.add_argument('--stage-repeats', type=int, default=1)
+    parser.add_argument('--output', default='artifacts/benchmarks/pipeline.json')
+    parser.add_argument('--compare', default=None, help='Baseline results JSON to check for regressions')
+    parser.add_argument('--tolerance', type=float, default=0.10,
+                        help='Allowed p50 slowdown before an entry counts as a regression')
+    sys.exit(run(parser.parse_args()))
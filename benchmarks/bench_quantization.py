@@ -0,0 +1,57 @@
+'''
+Memory, QPS and top-1 agreement of compressed embeddings against the
+uncompressed float32 baseline, with and without exact rerank.
+
+    python -m benchmarks.bench_quantization --rows 200000
+    python -m benchmarks.bench_quantization --store artifacts/extracted_features/embedding_store
+'''
+import argparse
+import time
+import numpy as np
+from benchmarks.bench_ann import make_queries, synthetic_gallery
+from src.utils.embedding_store import EmbeddingStore
+from src.utils.quantization import make_codec, CompressedSearch
+from src.utils.search import SimilaritySearch
+
+
+def measure(index, queries):
+    start = time.perf_counter()
+    top1 = [index.search(query, k=1)[0][0] for query in queries]
+    return top1, len(queries) / (time.perf_counter() - start)
+
+
+def run(matrix, queries, pq_subspaces, rerank):
+    exact = SimilaritySearch(matrix, normalized=True)
+    truth, exact_qps = measure(exact, queries)
+    float_bytes = matrix.shape[1] * 4
+
+    print(f"rows={matrix.shape[0]} dim={matrix.shape[1]} queries={len(queries)}")
+    print(f"{'method':>16} {'bytes/row':>10} {'QPS':>8} {'top-1 agree':>12}")
+    print(f"{'float32':>16} {float_bytes:>10} {exact_qps:>8.1f} {1.0:>12.3f}")
+    for method in ('float16', 'int8', 'pq'):
+        codec = make_codec({'method': method, 'pq_subspaces': pq_subspaces, 'pq_train_sample': 50_000})
+        codes = codec.train(matrix).encode(matrix)
+        bytes_per_row = codes.nbytes // codes.shape[0]
+        for rerank_k in (0, rerank):
+            index = CompressedSearch(codes, codec, matrix, rerank=rerank_k)
+            top1, qps = measure(index, queries)
+            agreement = float(np.mean(np.array(top1) == np.array(truth)))
+            label = method if not rerank_k else f"{method}+rerank{rerank_k}"
+            print(f"{label:>16} {bytes_per_row:>10} {qps:>8.1f} {agreement:>12.3f}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--store', default=None, help='Embedding store directory to benchmark on')
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--dim', type=int, default=2048)
+    parser.add_argument('--queries', type=int, default=100)
+    parser.add_argument('--pq-subspaces', type=int, default=64)
+    parser.add_argument('--rerank', type=int, default=50)
+    args = parser.parse_args()
+
+    if args.store:
+        matrix = EmbeddingStore.open(args.store).matrix
+    else:
+        matrix = synthetic_gallery(args.rows, args.dim)
+    run(matrix, make_queries(matrix, args.queries), args.pq_subspaces, args.rerank)
@@ -0,0 +1,67 @@
+'''
+Microbenchmark for the gallery similarity search.
+
+Compares the original per-row cosine_similarity loop from recommend()
+with the vectorized SimilaritySearch on synthetic galleries.
+
+    python -m benchmarks.bench_search --sizes 10000 100000 1000000
+'''
+import argparse
+import time
+import numpy as np
+from src.utils.search import SimilaritySearch
+
+
+def loop_recommend(feature_list, features):
+    '''
+    The recommend() implementation this benchmark is measured against.
+    '''
+    from sklearn.metrics.pairwise import cosine_similarity
+
+    similarity = []
+    for i in range(len(feature_list)):
+        sim = cosine_similarity(features.reshape(1, -1), feature_list[i].reshape(1, -1))[0][0]
+        similarity.append(sim)
+    sorted_list = sorted(list(enumerate(similarity)), reverse=True, key=lambda x: x[1])
+    return sorted_list[0]
+
+
+def time_call(fn, repeats):
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings))
+
+
+def run(sizes, dim, k, repeats, loop_limit, seed=0):
+    rng = np.random.default_rng(seed)
+    print(f"{'rows':>10} {'loop (s)':>12} {'vectorized (s)':>16} {'speedup':>10}")
+    for size in sizes:
+        gallery = rng.random((size, dim), dtype=np.float32)
+        query = rng.random(dim, dtype=np.float32)
+
+        index = SimilaritySearch(gallery)
+        vec_time = time_call(lambda: index.search(query, k=k), repeats)
+
+        if size <= loop_limit:
+            feature_list = list(gallery)
+            loop_time = time_call(lambda: loop_recommend(feature_list, query), 1)
+            expected = loop_recommend(feature_list, query)[0]
+            assert index.search(query, k=1)[0][0] == expected, "vectorized top-1 disagrees with loop"
+            print(f"{size:>10} {loop_time:>12.4f} {vec_time:>16.5f} {loop_time / vec_time:>9.1f}x")
+        else:
+            print(f"{size:>10} {'skipped':>12} {vec_time:>16.5f} {'-':>10}")
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10_000, 100_000, 1_000_000])
+    parser.add_argument('--dim', type=int, default=2048)
+    parser.add_argument('--k', type=int, default=5)
+    parser.add_argument('--repeats', type=int, default=5)
+    parser.add_argument('--loop-limit', type=int, default=100_000,
+                        help='Largest gallery to run the slow per-row loop on')
+    args = parser.parse_args()
+    run(args.sizes, args.dim, args.k, args.repeats, args.loop_limit)
@@ -0,0 +1,121 @@
+'''
+Scaling of scatter-gather search with the number of shards.
+
+Writes a synthetic gallery to a temporary embedding store, serves it
+from 1..8 local shard processes and reports single-query and batch
+latency and throughput against in-process exact search. Every shard
+searches its rows in its own process, so single-query latency should
+drop with the shard count until the per-shard scan no longer dominates
+the HTTP round trip. With as many shards as cores, run with
+OPENBLAS_NUM_THREADS=1 so the shards do not oversubscribe the CPU.
+
+    python -m benchmarks.bench_sharding --rows 500000 --shards 1 2 4 8
+'''
+import argparse
+import multiprocessing
+import socket
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from benchmarks.bench_ann import make_queries, synthetic_gallery
+from src.utils.embedding_store import EmbeddingStore, write_embedding_store
+from src.utils.search import SimilaritySearch
+from src.utils.sharding import ShardedSearch, run_shard_server
+
+
+def free_port_block(count, start=18100):
+    port = start
+    while True:
+        try:
+            sockets = []
+            for offset in range(count):
+                sock = socket.socket()
+                sockets.append(sock)
+                sock.bind(('127.0.0.1', port + offset))
+            return port
+        except OSError:
+            port += count
+        finally:
+            for sock in sockets:
+                sock.close()
+
+
+def wait_for_port(port, timeout=60):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"shard on port {port} did not start")
+
+
+def measure(index, queries, batch_size, k, concurrency):
+    batches = [queries[i:i + batch_size] for i in range(0, len(queries) - batch_size + 1, batch_size)]
+    index.search_batch(batches[0], k=k)
+
+    def timed(batch):
+        start = time.perf_counter()
+        index.search_batch(batch, k=k)
+        return time.perf_counter() - start
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        timings = np.array(list(pool.map(timed, batches))) * 1000
+    elapsed = time.perf_counter() - start
+    return np.percentile(timings, 50), np.percentile(timings, 95), len(batches) * batch_size / elapsed
+
+
+def report(name, index, queries, batch_sizes, k, concurrency):
+    for batch_size in batch_sizes:
+        p50, p95, qps = measure(index, queries, batch_size, k, concurrency)
+        print(f"{name:>10} {batch_size:>6} {p50:>8.2f} {p95:>8.2f} {qps:>10.0f}")
+
+
+def run(rows, dim, shard_counts, batch_sizes, n_queries, k, concurrency):
+    matrix = synthetic_gallery(rows, dim)
+    queries = make_queries(matrix, n_queries)
+    ctx = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as store_dir:
+        write_embedding_store(store_dir, matrix, [f"synthetic/{i // 20}/{i}.jpg" for i in range(rows)],
+                              model_name='synthetic', pooling='none')
+        store = EmbeddingStore.open(store_dir)
+        del matrix
+
+        print(f"rows={rows} dim={dim} queries={n_queries} k={k} concurrency={concurrency}")
+        print(f"{'index':>10} {'batch':>6} {'p50 ms':>8} {'p95 ms':>8} {'queries/s':>10}")
+        report('exact', SimilaritySearch(store.matrix, normalized=True), queries, batch_sizes, k, concurrency)
+
+        for num_shards in shard_counts:
+            base_port = free_port_block(num_shards)
+            processes = [ctx.Process(target=run_shard_server, daemon=True,
+                                     args=(store_dir, shard_id, num_shards, '127.0.0.1', base_port + shard_id))
+                         for shard_id in range(num_shards)]
+            for process in processes:
+                process.start()
+            try:
+                for shard_id in range(num_shards):
+                    wait_for_port(base_port + shard_id)
+                index = ShardedSearch([f"http://127.0.0.1:{base_port + i}" for i in range(num_shards)],
+                                      store.version, timeout_ms=10_000, min_shards=num_shards)
+                report(f"shards={num_shards}", index, queries, batch_sizes, k, concurrency)
+            finally:
+                for process in processes:
+                    process.terminate()
+                    process.join()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--rows', type=int, default=200_000)
+    parser.add_argument('--dim', type=int, default=2048)
+    parser.add_argument('--shards', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--batch-sizes', type=int, nargs='+', default=[1, 16])
+    parser.add_argument('--queries', type=int, default=256)
+    parser.add_argument('--k', type=int, default=10)
+    parser.add_argument('--concurrency', type=int, default=1,
+                        help='Query batches in flight at once')
+    args = parser.parse_args()
+    run(args.rows, args.dim, args.shards, args.batch_sizes, args.queries, args.k, args.concurrency)
@@ -1,18 +1,31 @@
-from fastapi import FastAPI, File, UploadFile
-from fastapi.responses import JSONResponse
-from fastapi.staticfiles import StaticFiles
-from keras_vggface.utils import preprocess_input
-from keras_vggface.vggface import VGGFace
-from src.utils.all_utils import read_yaml, create_directory
-from sklearn.metrics.pairwise import cosine_similarity
-from PIL import Image
-from mtcnn import MTCNN
+from src.utils.process_stats import memory_usage, startup_report
+from fastapi import FastAPI, File, Form, Request, UploadFile
+from fastapi.responses import FileResponse, JSONResponse, PlainTextResponse, Response, StreamingResponse
+from src.utils.all_utils import read_yaml
+from src.utils.embedding_store import get_store_dir
+from src.utils.batching import InferenceBatcher
+from src.utils.face_detection import FaceDetector, face_array
+from src.utils.inference_backend import load_backend, preprocess_input
+from src.utils.instrumentation import (REGISTRY, SlowRequestProfiler, log_timings, merge_timings, server_timing,
+                                      stage_timer)
+from src.utils.image_io import UploadTooLargeError, decode_image, iter_archive_images, save_upload
+from src.utils.live_index import LiveIndex
+from src.utils.result_cache import image_key, make_result_cache
+from src.utils.sharding import ShardsUnavailableError
+from src.utils.thumbnails import thumbnail_path
 import numpy as np
-import pickle
-import os
 import cv2
-import shutil
+import os
+import re
+import secrets
+import json
+import asyncio
+import logging
+import time
 import uuid
+from itertools import islice
+from typing import List, Optional
+from concurrent.futures import ThreadPoolExecutor
 from fastapi.middleware.cors import CORSMiddleware
 
 
@@ -29,58 +42,141 @@ artifacts_dir = artifacts['artifacts_dir']
 upload_image_dir = artifacts['upload_image_dir']
 uploadn_path = os.path.join(artifacts_dir, upload_image_dir)
 
-# Pickle data
-pickle_format_data_dir = artifacts['pickle_format_data_dir']
-img_pickle_file_name = artifacts['img_pickle_file_name']
-raw_local_dir_path = os.path.join(artifacts_dir, pickle_format_data_dir)
-pickle_file = os.path.join(raw_local_dir_path, img_pickle_file_name)
+# Embedding store
+embedding_store_dir = get_store_dir(config)
 
-# Feature path
-feature_extraction_dir = artifacts['feature_extraction_dir']
-extracted_features_name = artifacts['extracted_features_name']
-feature_extraction_path = os.path.join(artifacts_dir, feature_extraction_dir)
-features_name = os.path.join(feature_extraction_path, extracted_features_name)
+# Gallery thumbnails
+gallery_dir = os.path.join(artifacts_dir, artifacts['gallery_dir'])
+thumbnail_sizes = params['thumbnails']['sizes']
 
-# Model params
-model_name = params['base']['BASE_MODEL']
-include_tops = params['base']['include_top']
-poolings = params['base']['pooling']
+# Search params
+top_k = params['search']['top_k']
+score_threshold = params['search']['score_threshold']
+
+# Serving params
+serving = params['serving']
+upload = params['upload']
+batch = params['batch']
+instrumentation = params['instrumentation']
+reload = params['reload']
+data_path = params['base']['data_path']
 
 # --------------------
 # Load model & data
 # --------------------
-detector = MTCNN()
-model = VGGFace(model=model_name, include_top=include_tops,
-                input_shape=(224, 224, 3), pooling=poolings)
+# Nothing heavy happens at import. The gallery is fork-safe, so a preforking
+# parent (serve.py) loads it once and every worker shares its pages; the
+# detector, model and result cache are created inside each worker at startup.
+# Requests read live_index.current once and use that snapshot throughout, so
+# a rebuilt or appended index can be swapped in while they are in flight.
+logger = logging.getLogger("uvicorn.error")
+
+detector = None
+model = None
+result_cache = None
+ready = False
+startup_info = {}
+
+def invalidate_results(snapshot):
+    if result_cache is not None:
+        result_cache.set_version(snapshot.version)
+
+live_index = LiveIndex(config, params, embedding_store_dir, gallery_dir,
+                       poll_seconds=reload['poll_seconds'], on_swap=invalidate_results)
+
+def load_gallery():
+    if live_index.current is None:
+        live_index.load()
+
+def load_model():
+    global model
+    if model is None:
+        model = load_backend(config, params)
 
-feature_list = pickle.load(open(features_name, 'rb'))
-filenames = pickle.load(open(pickle_file, 'rb'))
+def load_worker():
+    global detector, result_cache
+    load_gallery()
+    load_model()
+    detector = FaceDetector(params['detection'])
+    result_cache = make_result_cache(params['result_cache'],
+                                     os.path.join(artifacts_dir, artifacts['result_cache_name']),
+                                     version=live_index.current.version)
+
+def warm_up():
+    # Blank inputs at the batch sizes the batcher produces, so graph building
+    # and lazy allocations happen before the worker reports ready
+    detector.detect(np.zeros((224, 224, 3), dtype=np.uint8))
+    for size in sorted({1, serving['max_batch_size']}):
+        embed_faces(preprocess_input(np.zeros((size, 224, 224, 3), dtype=np.float32)))
+    snapshot = live_index.current
+    snapshot.search_index.search(np.ones(snapshot.store.matrix.shape[1], dtype=np.float32), k=1)
 
 # --------------------
 # Helper functions
 # --------------------
-def extract_features(img_path):
-    img = cv2.imread(img_path)
-    results = detector.detect_faces(img)
+def decode_upload(data):
+    img = decode_image(data, max_bytes=upload['max_bytes'], max_side=upload['max_side'])
+    return img, image_key(img)
+
+def preprocess_faces(image, max_faces=1, timings=None):
+    if isinstance(image, np.ndarray):
+        img = image
+    else:
+        with stage_timer('decode', timings):
+            img = decode_image(image, max_bytes=upload['max_bytes'], max_side=upload['max_side'])
+    with stage_timer('detect', timings):
+        results = detector.detect(img)[:max_faces]
     if len(results) == 0:
+        return [], None
+    with stage_timer('preprocess', timings):
+        boxes, faces = [], []
+        for box, _ in results:
+            faces.append(face_array(img, box))
+            boxes.append([int(v) for v in box])
+        return boxes, preprocess_input(np.stack(faces))
+
+def embed_faces(faces):
+    return model.predict(faces)
+
+def extract_features(image):
+    _, faces = preprocess_faces(image)
+    if faces is None:
         return None
-    x, y, width, height = results[0]['box']
-    face = img[y:y + height, x:x + width]
-    image = Image.fromarray(face).resize((224, 224))
-    face_array = np.asarray(image).astype('float32')
-    expanded_img = np.expand_dims(face_array, axis=0)
-    preprocessed_img = preprocess_input(expanded_img)
-    result = model.predict(preprocessed_img).flatten()
-    return result
-
-def recommend(features):
-    similarity = []
-    for i in range(len(feature_list)):
-        sim = cosine_similarity(features.reshape(1, -1), feature_list[i].reshape(1, -1))[0][0]
-        similarity.append(sim)
-    sorted_list = sorted(list(enumerate(similarity)), reverse=True, key=lambda x: x[1])
-    index_pos, best_score = sorted_list[0]
-    return index_pos, best_score
+    return embed_faces(faces)[0]
+
+# Detection runs off the event loop; embedding goes through the micro-batcher
+detection_pool = ThreadPoolExecutor(max_workers=serving['detector_threads'])
+batcher = InferenceBatcher(embed_faces,
+                           max_batch_size=serving['max_batch_size'],
+                           max_wait_ms=serving['max_wait_ms'])
+
+def recommend_batch(snapshot, features, k=top_k, timings=None):
+    with stage_timer('search', timings):
+        matches = snapshot.search_index.search_batch(features, k=k, threshold=score_threshold)
+    # Sharded search lists the shards that did not answer in time
+    for shard in getattr(matches, 'missing_shards', []):
+        SHARD_MISSES.inc(shard=shard)
+    return matches
+
+# --------------------
+# Metrics
+# --------------------
+REQUESTS_TOTAL = REGISTRY.counter('celeblookalike_requests_total', 'HTTP requests by handler and status',
+                                  ('handler', 'status'))
+REQUEST_SECONDS = REGISTRY.histogram('celeblookalike_request_seconds', 'HTTP request latency by handler',
+                                     ('handler',))
+SHARD_MISSES = REGISTRY.counter('celeblookalike_shard_misses_total',
+                                'Searches a shard failed or timed out on', ('shard',))
+ERRORS_TOTAL = REGISTRY.counter('celeblookalike_errors_total', 'Unexpected errors by exception type',
+                                ('error',))
+REGISTRY.gauge('celeblookalike_batcher_queue_depth', 'Inputs waiting for the inference batcher',
+               fn=lambda: batcher.queue_depth)
+REGISTRY.gauge('celeblookalike_result_cache_hits', 'Result cache hits in this worker',
+               fn=lambda: result_cache.hits if result_cache is not None else 0)
+REGISTRY.gauge('celeblookalike_result_cache_misses', 'Result cache misses in this worker',
+               fn=lambda: result_cache.misses if result_cache is not None else 0)
+profiler = SlowRequestProfiler(instrumentation['profile_slowest'], instrumentation['profile_interval_ms']) \
+    if instrumentation['profile_slowest'] else None
 
 # --------------------
 # FastAPI App
@@ -97,45 +193,380 @@ app.add_middleware(
 )
 
 
-# Static folder mount
-STATIC_DIR = "static"
-os.makedirs(STATIC_DIR, exist_ok=True)
-app.mount("/static", StaticFiles(directory=STATIC_DIR), name="static")
+@app.on_event("startup")
+async def start_worker():
+    global ready, startup_info
+    started = time.perf_counter()
+    loop = asyncio.get_running_loop()
+    await loop.run_in_executor(None, load_worker)
+    await loop.run_in_executor(None, warm_up)
+    batcher.start()
+    if profiler is not None:
+        profiler.start()
+    if reload['enabled']:
+        live_index.start()
+    startup_info = {**startup_report(), "worker_start_s": round(time.perf_counter() - started, 3)}
+    ready = True
+    logger.info(f"Worker ready: {startup_info}")
+
+@app.on_event("shutdown")
+async def stop_batcher():
+    await batcher.stop()
+    detection_pool.shutdown(wait=False)
+    if profiler is not None:
+        profiler.stop()
+    live_index.stop()
+
+@app.middleware("http")
+async def instrument_request(request: Request, call_next):
+    request_id = request.headers.get("x-request-id") or uuid.uuid4().hex
+    request.state.request_id = request_id
+    request.state.timings = {}
+    request.state.streamed = False
+    if profiler is not None:
+        profiler.begin(request_id)
+    start = time.perf_counter()
+
+    def finish(status):
+        elapsed = time.perf_counter() - start
+        # Label by handler name, not path, so gallery IDs do not explode the series
+        handler = getattr(request.scope.get("endpoint"), "__name__", "unmatched")
+        REQUESTS_TOTAL.inc(handler=handler, status=status)
+        REQUEST_SECONDS.observe(elapsed, handler=handler)
+        timings = {**request.state.timings, "total": elapsed}
+        if profiler is not None:
+            profiler.end(request_id, elapsed, timings, handler=handler, status=status)
+        if instrumentation['log_requests'] and handler not in ("metrics", "health_live", "health_ready"):
+            log_timings(logger, "request", timings, request_id=request_id, handler=handler, status=status)
+        return timings
+
+    try:
+        response = await call_next(request)
+    except Exception:
+        finish(500)
+        raise
+    response.headers["X-Request-ID"] = request_id
+    if request.state.streamed:
+        # The work of a streamed response happens while its body is sent, so it
+        # is timed and logged after the last line; its headers are already gone
+        # by then, so it carries no Server-Timing header
+        body = response.body_iterator
+
+        async def finish_after_body():
+            try:
+                async for chunk in body:
+                    yield chunk
+            finally:
+                finish(response.status_code)
+
+        response.body_iterator = finish_after_body()
+        return response
+    timings = finish(response.status_code)
+    if instrumentation['timing_header']:
+        response.headers["Server-Timing"] = server_timing(timings)
+    return response
+
+@app.get("/metrics")
+async def metrics():
+    return PlainTextResponse(REGISTRY.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/debug/slow_requests")
+async def slow_requests():
+    if profiler is None:
+        return JSONResponse(content={"error": "Set instrumentation.profile_slowest to enable"}, status_code=404)
+    return profiler.report()
+
+@app.get("/health/live")
+async def health_live():
+    return {"status": "ok"}
+
+@app.get("/health/ready")
+async def health_ready():
+    # Load balancers only route here once the warm-up inference has run
+    if not ready:
+        return JSONResponse(content={"ready": False}, status_code=503)
+    return {"ready": True, **startup_info, "memory": memory_usage()}
+
+@app.get("/stats/batching")
+async def batching_stats():
+    return batcher.stats()
+
+@app.get("/stats/cache")
+async def cache_stats():
+    return result_cache.stats() if result_cache is not None else {"enabled": False}
+
+@app.get("/gallery/{image_id}", name="gallery_image")
+async def gallery_image(image_id: str, request: Request, size: int = thumbnail_sizes[-1]):
+    # Only IDs from gallery_ids.txt are served, which also rules out path traversal
+    if image_id not in live_index.current.gallery_id_set or size not in thumbnail_sizes:
+        return JSONResponse(content={"error": "Unknown gallery image"}, status_code=404)
+
+    # IDs are content hashes, so a URL's bytes never change
+    etag = f'"{image_id}-{size}"'
+    headers = {"ETag": etag, "Cache-Control": "public, max-age=31536000, immutable"}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=304, headers=headers)
+    path = thumbnail_path(gallery_dir, image_id, size)
+    # Stage 04 may have failed on this image even though its ID is listed
+    if not os.path.exists(path):
+        return JSONResponse(content={"error": "Thumbnail not available"}, status_code=404)
+    return FileResponse(path, media_type="image/webp", headers=headers)
+
+def gallery_url(request, snapshot, index_pos):
+    image_id = snapshot.gallery_id(index_pos)
+    if image_id is None:
+        return None
+    if serving['public_base_url']:
+        return f"{serving['public_base_url'].rstrip('/')}/gallery/{image_id}"
+    return str(request.url_for("gallery_image", image_id=image_id))
+
+def describe_match(request, snapshot, index_pos, score):
+    folder_name = os.path.basename(os.path.dirname(snapshot.filenames[index_pos]))
+    return {
+        "name": folder_name.replace('_', ' '),
+        "match_percentage": round(score * 100, 2),
+        # Matched image is served by its stable gallery ID
+        "matched_image_url": gallery_url(request, snapshot, index_pos)
+    }
 
 @app.post("/predict")
-async def predict_face(file: UploadFile = File(...)):
+async def predict_face(request: Request, file: UploadFile = File(...),
+                       max_faces: int = 1, top_k: int = top_k):
     try:
-        # Save uploaded image
-        create_directory([uploadn_path])
-        image_path = os.path.join(uploadn_path, file.filename)
-        with open(image_path, "wb") as f:
-            f.write(await file.read())
-
-        # Extract features
-        features = extract_features(image_path)
-        if features is None:
-            return JSONResponse(content={"error": "No face detected"}, status_code=400)
-
-        # Recommend
-        index_pos, score = recommend(features)
-        percentage = round(score * 100, 2)
-        folder_name = os.path.basename(os.path.dirname(filenames[index_pos]))
-        predicted_actor = folder_name.replace('_', ' ')
-
-        # Copy matched image to static folder with unique name
-        ext = os.path.splitext(filenames[index_pos])[1]
-        unique_filename = f"{uuid.uuid4()}{ext}"
-        static_path = os.path.join(STATIC_DIR, unique_filename)
-        shutil.copy(filenames[index_pos], static_path)
-
-        # Generate URLs
-        matched_image_url = f"http://127.0.0.1:8000/static/{unique_filename}"
-
-        return {
-            "name": predicted_actor,
-            "match_percentage": percentage,
-            "matched_image_url": matched_image_url
-        }
+        max_faces = max(1, min(max_faces, serving['max_faces_limit']))
+        top_k = max(1, min(top_k, serving['top_k_limit']))
+
+        timings = request.state.timings
+        snapshot = live_index.current
+
+        # Read the upload into memory, one byte past the cap to detect oversize files
+        with stage_timer('read_upload', timings):
+            data = await file.read(upload['max_bytes'] + 1)
+
+        # Decode off the event loop and look the pixels up in the result cache
+        loop = asyncio.get_running_loop()
+        with stage_timer('decode', timings):
+            img, pixel_key = await loop.run_in_executor(detection_pool, decode_upload, data)
+        # Only uploads that passed the size cap and decoded are written to disk
+        if upload['persist']:
+            with stage_timer('persist_upload', timings):
+                await loop.run_in_executor(None, save_upload, data, uploadn_path, file.filename)
+        # Cached row indices are only valid for the snapshot they were searched on
+        cache_key = f"{snapshot.version}:{pixel_key}:{max_faces}:{top_k}"
+        with stage_timer('cache_lookup', timings):
+            # The sqlite cache does disk I/O, so it stays off the event loop
+            results = (await loop.run_in_executor(None, result_cache.get, cache_key)
+                       if result_cache is not None else None)
+        missing_shards = []
+
+        if results is None:
+            # Detect faces off the event loop, then embed them in a shared batch
+            boxes, faces = await loop.run_in_executor(detection_pool, preprocess_faces, img, max_faces, timings)
+            if faces is None:
+                return JSONResponse(content={"error": "No face detected"}, status_code=400)
+            with stage_timer('embed', timings):
+                features = await asyncio.gather(*[batcher.submit(face) for face in faces])
+
+            # Search every face at once
+            matches = await loop.run_in_executor(None, recommend_batch, snapshot, np.stack(features),
+                                                 top_k, timings)
+            results = [{"box": box, "matches": [[int(i), float(score)] for i, score in face_matches]}
+                       for box, face_matches in zip(boxes, matches)]
+            missing_shards = getattr(matches, 'missing_shards', [])
+            # Partial results and results of a snapshot swapped out meanwhile are not cached
+            if result_cache is not None and not missing_shards and snapshot is live_index.current:
+                await loop.run_in_executor(None, result_cache.put, cache_key, results)
 
+        face_results = [{"box": face["box"],
+                         "matches": [describe_match(request, snapshot, i, score) for i, score in face["matches"]]}
+                        for face in results]
+        partial = {"missing_shards": missing_shards} if missing_shards else {}
+        if not face_results[0]["matches"]:
+            return JSONResponse(content={"error": "No matching face found", "faces": face_results, **partial},
+                                status_code=404)
+
+        # Top-level fields keep describing the best match of the most confident face
+        return {**face_results[0]["matches"][0], "faces": face_results, **partial}
+
+    except UploadTooLargeError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=413)
+    except ShardsUnavailableError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=503)
+    except ValueError as e:
+        return JSONResponse(content={"error": str(e)}, status_code=400)
     except Exception as e:
-        return JSONResponse(content={"error": str(e)}, status_code=500)
+        ERRORS_TOTAL.inc(error=type(e).__name__)
+        logger.exception(f"Request {request.state.request_id} failed")
+        return JSONResponse(content={"error": f"{type(e).__name__}: {e}",
+                                     "request_id": request.state.request_id}, status_code=500)
+
+
+def iter_batch_inputs(files, archive):
+    for upload_file in files or []:
+        yield upload_file.filename, upload_file.file.read(upload['max_bytes'] + 1)
+    if archive is not None:
+        yield from iter_archive_images(archive.file, max_bytes=upload['max_bytes'])
+
+def detect_for_batch(data, max_faces, timings=None):
+    if isinstance(data, Exception):
+        raise data
+    return preprocess_faces(data, max_faces, timings)
+
+def embed_in_batches(faces, timings=None):
+    size = batch['embed_batch_size']
+    with stage_timer('embed', timings):
+        return np.concatenate([embed_faces(faces[i:i + size]) for i in range(0, len(faces), size)])
+
+async def predict_chunk(request, chunk, max_faces, top_k):
+    loop = asyncio.get_running_loop()
+    timings = request.state.timings
+    snapshot = live_index.current
+
+    # Decode and detect every image of the chunk in parallel, each thread
+    # timing into its own dict that is merged once they are all done
+    thread_timings = [{} for _ in chunk]
+    detections = await asyncio.gather(
+        *[loop.run_in_executor(detection_pool, detect_for_batch, data, max_faces, image_timings)
+          for (_, data), image_timings in zip(chunk, thread_timings)],
+        return_exceptions=True)
+    merge_timings(timings, *thread_timings)
+
+    # Embed all faces of the chunk in one large batch and search them together
+    face_arrays = [result[1] for result in detections
+                   if not isinstance(result, Exception) and result[1] is not None]
+    matches, search_error = [], None
+    if face_arrays:
+        all_faces = np.concatenate(face_arrays)
+        features = await loop.run_in_executor(None, embed_in_batches, all_faces, timings)
+        try:
+            matches = await loop.run_in_executor(None, recommend_batch, snapshot, features, top_k, timings)
+        except ShardsUnavailableError as e:
+            # Fail this chunk's images only, the stream goes on with the next chunk
+            search_error = str(e)
+
+    lines, offset = [], 0
+    for (name, _), result in zip(chunk, detections):
+        if isinstance(result, Exception):
+            line = {"file": name, "error": str(result)}
+        elif result[1] is None:
+            line = {"file": name, "error": "No face detected"}
+        elif search_error is not None:
+            line = {"file": name, "error": search_error}
+        else:
+            boxes = result[0]
+            line = {"file": name, "faces": [
+                {"box": box, "matches": [describe_match(request, snapshot, i, score) for i, score in face_matches]}
+                for box, face_matches in zip(boxes, matches[offset:offset + len(boxes)])]}
+            if getattr(matches, 'missing_shards', None):
+                line["missing_shards"] = matches.missing_shards
+            offset += len(boxes)
+        lines.append(json.dumps(line) + "\n")
+    return lines
+
+@app.post("/predict/batch")
+async def predict_batch(request: Request, files: Optional[List[UploadFile]] = File(None),
+                        archive: Optional[UploadFile] = File(None),
+                        max_faces: int = 1, top_k: int = top_k):
+    if not files and archive is None:
+        return JSONResponse(content={"error": "Send images as files or a zip/tar archive"}, status_code=400)
+    max_faces = max(1, min(max_faces, serving['max_faces_limit']))
+    top_k = max(1, min(top_k, serving['top_k_limit']))
+    inputs = iter_batch_inputs(files, archive)
+    request.state.streamed = True
+
+    async def stream_results():
+        # One chunk of images in memory at a time, streamed out as soon as it is matched
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                chunk = await loop.run_in_executor(None, lambda: list(islice(inputs, batch['chunk_size'])))
+            except Exception as e:
+                yield json.dumps({"error": f"Could not read archive: {e}"}) + "\n"
+                return
+            if not chunk:
+                return
+            for line in await predict_chunk(request, chunk, max_faces, top_k):
+                yield line
+
+    return StreamingResponse(stream_results(), media_type="application/x-ndjson")
+
+
+# --------------------
+# Admin API
+# --------------------
+def is_admin(request):
+    # Disabled unless the token environment variable is set
+    token = os.environ.get(reload['admin_token_env'])
+    return bool(token) and secrets.compare_digest(request.headers.get("x-admin-token", ""), token)
+
+def save_identity_face(data, identity_dir):
+    # Returns (path, face box), or (None, reason) for a skipped photo.
+    # The whole (size-capped) photo is saved, not a crop, so stage 01b finds the
+    # same face in it on the next rebuild. The face is detected again on the
+    # saved file, exactly as 01b will read it, and the image is skipped when
+    # stage 02 would leave it out of the index.
+    img = decode_image(data, max_bytes=upload['max_bytes'], max_side=upload['max_side'])
+    if not detector.detect(img):
+        return None, "No face detected"
+    ok, encoded = cv2.imencode('.jpg', img)
+    if not ok:
+        raise ValueError("Could not encode uploaded image")
+    path = save_upload(encoded.tobytes(), identity_dir, 'face.jpg')
+    results = detector.detect(cv2.imread(path))
+    if not results or (len(results) > 1 and params['gallery_faces']['exclude_multiple']):
+        os.remove(path)
+        return None, "No face detected" if not results else "Several faces detected"
+    return path, results[0][0]
+
+def embed_gallery_images(paths, boxes):
+    # Same decoding and face crop as stage 02, so appended rows match what a rebuild produces
+    from keras_preprocessing.image import img_to_array, load_img
+    if params['gallery_faces']['enabled']:
+        images = np.stack([face_array(cv2.imread(path), box) for path, box in zip(paths, boxes)])
+    else:
+        images = np.stack([img_to_array(load_img(path, target_size=(224, 224))) for path in paths])
+    return embed_in_batches(preprocess_input(images))
+
+@app.get("/admin/index")
+async def index_info(request: Request):
+    if not is_admin(request):
+        return JSONResponse(content={"error": "Forbidden"}, status_code=403)
+    snapshot = live_index.current
+    return {"version": snapshot.version, "rows": len(snapshot.filenames),
+            "delta_rows": snapshot.delta_count, "swaps": live_index.swaps}
+
+@app.post("/admin/identities")
+async def add_identity(request: Request, name: str = Form(...), files: List[UploadFile] = File(...)):
+    # Appends a new identity's faces to the live index without a rebuild. The
+    # photos are saved under data/<name>/ so the next run.py rebuild embeds
+    # them as well and supersedes the appended rows.
+    if not is_admin(request):
+        return JSONResponse(content={"error": "Forbidden"}, status_code=403)
+    folder_name = re.sub(r'[^\w-]+', '_', name.strip()).strip('_')
+    if not folder_name:
+        return JSONResponse(content={"error": "Invalid identity name"}, status_code=400)
+    identity_dir = os.path.join(data_path, folder_name)
+
+    loop = asyncio.get_running_loop()
+    paths, boxes, skipped = [], [], []
+    for upload_file in files:
+        data = await upload_file.read(upload['max_bytes'] + 1)
+        try:
+            path, box = await loop.run_in_executor(detection_pool, save_identity_face, data, identity_dir)
+        except ValueError as e:
+            skipped.append({"file": upload_file.filename, "error": str(e)})
+            continue
+        if path is None:
+            skipped.append({"file": upload_file.filename, "error": box})
+        else:
+            paths.append(path)
+            boxes.append(box)
+    if not paths:
+        return JSONResponse(content={"error": "No usable faces", "skipped": skipped}, status_code=400)
+
+    features = await loop.run_in_executor(None, embed_gallery_images, paths, boxes)
+    start = time.perf_counter()
+    snapshot = await loop.run_in_executor(None, live_index.append, features, paths)
+    logger.info(f"Appended {len(paths)} images of {folder_name} in {time.perf_counter() - start:.2f}s")
+    return {"name": folder_name.replace('_', ' '), "added": len(paths), "skipped": skipped,
+            "version": snapshot.version, "rows": len(snapshot.filenames)}
@@ -1,16 +1,110 @@
+import argparse
+import importlib
+import json
+import logging
 import os
+from src.utils.all_utils import read_yaml
+from src.utils.ann_index import get_ann_index_path
+from src.utils.embedding_store import HEADER_FILE, get_store_dir, store_version
+from src.utils.face_cache import get_face_cache_dir
+from src.utils.gallery_scan import get_manifest_path
+from src.utils.live_index import write_release
+from src.utils.pipeline import PipelineRunner, Stage
 
-def execute_system():
+logging_str = "[%(asctime)s: %(levelname)s : %(module)s] : %(message)s"
+log_dir= 'logs'
+os.makedirs(log_dir, exist_ok= True)
+logging.basicConfig(filename=os.path.join(log_dir, "running_log.log"), level= logging.INFO,
+format= logging_str, filemode= 'a')
+
+
+def stage_module(name):
+    # Imported on first use, so TensorFlow only loads when stage 02 actually runs
+    return importlib.import_module(f"src.{name}")
+
+
+def build_stages(config_path, params_path):
     '''
-    Function to train the model
-    Will re-run the create feature portion
+    The training pipeline with the files, directories and params.yaml
+    sections every stage reads and writes. Stages 01b and 02 stream the
+    gallery manifest written by stage 01, stage 02 crops the faces found
+    by 01b, and later stages read the memory-mapped store.
+    These stages hand over through those files and ignore results: a
+    skipped stage has no in-memory result to pass on, every stage also
+    runs as a script on its own, and the manifest is streamed so the
+    gallery's file list is never held in memory.
     '''
-    bash1 = 'python src/01_generate_img_pkl.py'
-    bash2 = 'python src/02_feature_extractor.py'
+    config = read_yaml(config_path)
+    params = read_yaml(params_path)
+    artifacts = config['artifacts']
+    artifacts_dir = artifacts['artifacts_dir']
+
+    data_path = params['base']['data_path']
+    manifest_path = get_manifest_path(config)
+    face_cache_dir = get_face_cache_dir(config, params)
+    store_dir = get_store_dir(config)
+    # Every build rewrites the header, which names that build's matrix and manifest
+    store_files = [os.path.join(store_dir, HEADER_FILE)]
+    gallery_dir = os.path.join(artifacts_dir, artifacts['gallery_dir'])
 
-    os.system(bash1)
-    os.system(bash2)
+    return [
+        Stage('01', lambda results: stage_module('01_generate_img_pkl').generate_gallery_manifest(
+                  config_path, params_path),
+              inputs=[data_path, 'src/01_generate_img_pkl.py'],
+              outputs=[manifest_path], params=['base', 'scan']),
+        Stage('01b', lambda results: stage_module('01b_detect_faces').detect_gallery_faces(
+                  config_path, params_path),
+              inputs=[manifest_path, data_path, 'src/01b_detect_faces.py'],
+              outputs=[face_cache_dir], params=['detection', 'gallery_faces']),
+        Stage('02', lambda results: stage_module('02_feature_extractor').feature_extractor(
+                  config_path, params_path),
+              inputs=[manifest_path, face_cache_dir, data_path, 'src/02_feature_extractor.py'],
+              outputs=[store_dir], params=['base', 'inference', 'compression', 'detection', 'gallery_faces']),
+        Stage('03', lambda results: stage_module('03_build_ann_index').build_ann_index(
+                  config_path, params_path),
+              inputs=store_files + ['src/03_build_ann_index.py'],
+              outputs=[get_ann_index_path(config)], params=['ann']),
+        Stage('04', lambda results: stage_module('04_build_thumbnails').generate_thumbnails(
+                  config_path, params_path),
+              inputs=store_files + ['src/04_build_thumbnails.py'],
+              outputs=[gallery_dir], params=['thumbnails']),
+    ]
+
+
+def execute_system(config_path='config/config.yaml', params_path='params.yaml', force=False, stages=None):
+    '''
+    Function to train the model
+    Runs every stage in this process and skips the ones whose inputs,
+    params and outputs are unchanged since their last run. Stops at the
+    first failing stage; the per-stage timing and artifact-size report
+    is written to artifacts/pipeline_report.json either way. Only a run
+    where every selected stage succeeded publishes artifacts/release.json,
+    the marker the servers swap on.
+    '''
+    config = read_yaml(config_path)
+    artifacts = config['artifacts']
+    runner = PipelineRunner(build_stages(config_path, params_path), read_yaml(params_path),
+                            state_path=os.path.join(artifacts['artifacts_dir'], artifacts['pipeline_state_name']),
+                            report_path=os.path.join(artifacts['artifacts_dir'], artifacts['pipeline_report_name']))
+    try:
+        runner.run(force=force, only=stages)
+        header_path = os.path.join(get_store_dir(config), HEADER_FILE)
+        if os.path.exists(header_path):
+            with open(header_path) as f:
+                write_release(config, store_version(json.load(f)))
+    finally:
+        for entry in runner.report:
+            size = sum(entry.get('output_bytes', {}).values())
+            print(f"stage {entry['stage']}: {entry['status']:<12} {entry['seconds']:>9.1f}s "
+                  f"{size / 2 ** 20:>10.1f} MB")
     print('Executed successfully!! Now run app.py')
 
+
 if __name__ == '__main__':
-    execute_system()
\ No newline at end of file
+    args = argparse.ArgumentParser()
+    args.add_argument('--config', '--c', default='config/config.yaml')
+    args.add_argument('--params', '--p', default='params.yaml')
+    args.add_argument('--force', action='store_true', help='rerun stages even if their inputs are unchanged')
+    args.add_argument('--stages', nargs='+', default=None, help='only consider these stages, e.g. 03 04')
+    parsed_args = args.parse_args()
+    execute_system(parsed_args.config, parsed_args.params, force=parsed_args.force, stages=parsed_args.stages)
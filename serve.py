@@ -0,0 +1,140 @@
+from src.utils.process_stats import reset_process_started, startup_report
+import argparse
+import gc
+import logging
+import os
+import signal
+import socket
+import time
+import uvicorn
+from src.utils.all_utils import read_yaml
+
+logging_str = "[%(asctime)s: %(levelname)s : %(module)s] : %(message)s"
+logging.basicConfig(level=logging.INFO, format=logging_str)
+
+# Backends whose runtimes survive a fork; TensorFlow's thread pools do not,
+# and the tflite backends load their interpreter from the full TensorFlow package
+FORK_SAFE_BACKENDS = ('onnx', 'onnx_int8')
+
+# Restart backoff for crashing workers: doubles per crash up to the cap, and a
+# worker that ran longer than STABLE_SECONDS starts over from the initial delay
+RESTART_DELAY = 1.0
+MAX_RESTART_DELAY = 60.0
+STABLE_SECONDS = 60.0
+MAX_RESTARTS = 10
+
+
+def run_worker(app, sock, worker_id):
+    reset_process_started()
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    logging.info(f"worker {worker_id} started with pid {os.getpid()}")
+    uvicorn.Server(uvicorn.Config(app, log_level="info")).run(sockets=[sock])
+
+
+def serve(host, port, workers, preload_model, params_path='params.yaml'):
+    '''
+    Preforking launcher for main.py.
+    The parent loads the gallery (memmapped store, ANN/identity index,
+    gallery ids) once, then forks the workers, which share those pages
+    copy-on-write instead of each loading its own copy. With an onnx
+    backend the model can be preloaded the same way; Keras and TFLite
+    models are always loaded per worker since TensorFlow is not fork-safe.
+    Each worker warms up and logs its cold start time and memory at startup.
+    Input : host, port - address to listen on
+            workers - number of worker processes
+            preload_model - load the model in the parent as well
+    Output : None, returns when every worker has exited
+    '''
+
+    params = read_yaml(params_path)
+    import main
+
+    main.load_gallery()
+    backend = params['inference']['backend']
+    if preload_model and backend in FORK_SAFE_BACKENDS:
+        main.load_model()
+    elif preload_model:
+        logging.warning(f"backend {backend} is not fork-safe, loading the model per worker")
+    logging.info(f"parent preloaded: {startup_report()}")
+
+    # Keep the garbage collector from touching (and so copying) shared pages
+    gc.collect()
+    gc.freeze()
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    children = {}
+    started = {}
+    restarts = {}
+    stopping = False
+
+    def spawn(worker_id):
+        pid = os.fork()
+        if pid == 0:
+            try:
+                run_worker(main.app, sock, worker_id)
+            finally:
+                os._exit(0)
+        children[pid] = worker_id
+        started[worker_id] = time.monotonic()
+
+    def shutdown(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in children:
+            os.kill(pid, signal.SIGTERM)
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+
+    for worker_id in range(workers):
+        spawn(worker_id)
+
+    # Replace workers that die unexpectedly until asked to stop, backing off
+    # when one keeps crashing and giving up on it after MAX_RESTARTS in a row
+    while children:
+        try:
+            pid, status = os.wait()
+        except ChildProcessError:
+            break
+        worker_id = children.pop(pid, None)
+        if stopping or worker_id is None:
+            continue
+        if time.monotonic() - started[worker_id] >= STABLE_SECONDS:
+            restarts[worker_id] = 0
+        attempt = restarts.get(worker_id, 0)
+        if attempt >= MAX_RESTARTS:
+            logging.error(f"worker {worker_id} (pid {pid}) exited with status {status} after "
+                          f"{attempt} quick restarts, not restarting it")
+            continue
+        delay = min(RESTART_DELAY * 2 ** attempt, MAX_RESTART_DELAY)
+        logging.warning(f"worker {worker_id} (pid {pid}) exited with status {status}, "
+                        f"restarting in {delay:.0f}s")
+        time.sleep(delay)
+        if stopping:
+            continue
+        restarts[worker_id] = attempt + 1
+        spawn(worker_id)
+    sock.close()
+
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser()
+    args.add_argument('--params', '-p', default='params.yaml')
+    args.add_argument('--host', default='0.0.0.0')
+    args.add_argument('--port', type=int, default=8000)
+    args.add_argument('--workers', '-w', type=int, default=None,
+                      help='worker processes, defaults to serving.workers')
+    args.add_argument('--preload-model', action='store_true', default=None,
+                      help='load the model before forking, defaults to serving.preload_model')
+    parsed_args = args.parse_args()
+
+    serving = read_yaml(parsed_args.params)['serving']
+    workers = parsed_args.workers or serving['workers']
+    preload_model = parsed_args.preload_model if parsed_args.preload_model is not None else serving['preload_model']
+    serve(parsed_args.host, parsed_args.port, workers, preload_model, parsed_args.params)
@@ -0,0 +1,54 @@
+import argparse
+import logging
+import multiprocessing
+import signal
+from src.utils.all_utils import read_yaml
+from src.utils.embedding_store import get_store_dir
+from src.utils.sharding import run_shard_server
+
+logging_str = "[%(asctime)s: %(levelname)s : %(module)s] : %(message)s"
+logging.basicConfig(level=logging.INFO, format=logging_str)
+
+
+def serve_shards(store_dir, num_shards, host, base_port, shard_ids=None, poll_seconds=5.0):
+    '''
+    Start one search process per gallery shard, listening on base_port + shard id.
+    Stand-ins for search nodes when every shard runs on this host; on a
+    real node pass --shard-id to serve only that node's shards.
+    Input : store_dir - embedding store written by stage 02
+            num_shards - total number of shards the gallery is split into
+            shard_ids - shards to serve here, all of them by default
+    Output : None, returns when every shard process has exited
+    '''
+
+    shard_ids = range(num_shards) if shard_ids is None else shard_ids
+    processes = [multiprocessing.Process(target=run_shard_server, name=f"shard-{shard_id}",
+                                         args=(store_dir, shard_id, num_shards, host,
+                                               base_port + shard_id, poll_seconds))
+                 for shard_id in shard_ids]
+    for process in processes:
+        process.start()
+
+    def shutdown(signum, frame):
+        for process in processes:
+            process.terminate()
+
+    signal.signal(signal.SIGINT, shutdown)
+    signal.signal(signal.SIGTERM, shutdown)
+    for process in processes:
+        process.join()
+
+
+if __name__ == '__main__':
+    args = argparse.ArgumentParser()
+    args.add_argument('--config', '--c', default='config/config.yaml')
+    args.add_argument('--params', '--p', default='params.yaml')
+    args.add_argument('--shard-id', type=int, nargs='+', default=None,
+                      help='shards to serve on this node, defaults to all of them')
+    parsed_args = args.parse_args()
+
+    config = read_yaml(parsed_args.config)
+    params = read_yaml(parsed_args.params)
+    sharding = params['sharding']
+    serve_shards(get_store_dir(config), sharding['num_shards'], sharding['host'], sharding['base_port'],
+                 shard_ids=parsed_args.shard_id, poll_seconds=params['reload']['poll_seconds'])
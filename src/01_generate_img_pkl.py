@@ -1,8 +1,9 @@
 import argparse
 import os
 import logging
-import pickle
 from src.utils.all_utils import read_yaml, create_directory
+from src.utils.gallery_scan import get_manifest_path, scan_gallery, write_manifest
+from src.utils.instrumentation import REGISTRY, get_metrics_path, log_timings, stage_timer
 
 logging_str = "[%(asctime)s: %(levelname)s : %(module)s] : %(message)s"
 log_dir= 'logs'
@@ -10,14 +11,17 @@ os.makedirs(log_dir, exist_ok= True)
 logging.basicConfig(filename=os.path.join(log_dir, "running_log.log"), level= logging.INFO,
 format= logging_str, filemode= 'a')
 
-def generate_data_pickle_file(config_path, params_path) :
-    ''''
-    This function will generate a pickle file containing
-    the list of file paths for all the images in the configuration.
+def generate_gallery_manifest(config_path, params_path) :
+    '''
+    This function will scan the gallery and write a JSON-lines manifest
+    with one record per image in the configuration: path, identity
+    label, size, mtime and the width/height read from the image header.
+    Identity folders are scanned in parallel and records are streamed to
+    disk, so the full list of files is never held in memory. Files whose
+    extension or magic bytes are not an allowed image format are skipped.
     Input : config_path - file storing configuration
             params path - parameters path
-    Output : Create a pickle dump of the list of file paths 
-            for all the images 
+    Output : Path of the manifest, which stage 02 reads lazily
     '''
 
     config = read_yaml(config_path)
@@ -26,26 +30,39 @@ def generate_data_pickle_file(config_path, params_path) :
     artifacts  = config['artifacts']
     artifacts_dir = artifacts['artifacts_dir']
     pickle_format_data_dir = artifacts['pickle_format_data_dir']
-    img_pickle_file_name = artifacts['img_pickle_file_name']
 
     raw_local_dir_path= os.path.join(artifacts_dir, pickle_format_data_dir)
     create_directory(dirs= [raw_local_dir_path])
 
-    pickle_file = os.path.join(raw_local_dir_path, img_pickle_file_name )
+    manifest_path = get_manifest_path(config)
 
     data_path = params['base']['data_path']
+    scan = params['scan']
+
+    identities = set()
+    skipped = {}
 
-    actors = os.listdir(data_path)
-    
-    filenames = []
-    for actor in actors:
-        for filename in os.listdir(os.path.join(data_path, actor)):
-            filenames.append(os.path.join(data_path, actor, filename))
+    def records():
+        for record, counts in scan_gallery(data_path, scan['extensions'], num_workers=scan['num_workers']):
+            if record is None:
+                skipped.update(counts)
+                continue
+            identities.add(record['label'])
+            yield record
 
-    logging.info(f"Total Actor/Actress are : {len(actors)}")
-    logging.info(f"Total Images of Actor/Actress are : {len(filenames)}")
+    # Scanning and writing are streamed together, so they are timed as one stage
+    timings = {}
+    with stage_timer('scan', timings):
+        total = write_manifest(records(), manifest_path)
 
-    pickle.dump(filenames, open(pickle_file, 'wb'))
+    logging.info(f"Total Actor/Actress are : {len(identities)}")
+    logging.info(f"Total Images of Actor/Actress are : {total}")
+    if skipped:
+        logging.info(f"Skipped files : {skipped}")
+    log_timings(logging.getLogger(), 'stage_01', timings, images=total, identities=len(identities),
+                skipped=sum(skipped.values()))
+    REGISTRY.write_textfile(get_metrics_path(config, 'stage_01'))
+    return manifest_path
 
 
 if __name__ == '__main__' :
@@ -56,8 +73,8 @@ if __name__ == '__main__' :
 
     try :
         logging.info(">>>>> stage_01 started")
-        generate_data_pickle_file(config_path= parsed_args.config, 
-                                params_path= parsed_args.params )
+        generate_gallery_manifest(config_path= parsed_args.config,
+                                  params_path= parsed_args.params )
         logging.info("state_01 completed >>>>>")
 
     except Exception as e: 
@@ -0,0 +1,157 @@
+import argparse
+import os
+import logging
+import multiprocessing
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+import cv2
+from src.utils.all_utils import read_yaml
+from src.utils.face_cache import (STATUS_MULTIPLE, STATUS_NAMES, STATUS_NO_FACE, STATUS_OK,
+                                  STATUS_UNREADABLE, FaceCache, get_face_cache_dir)
+from src.utils.face_detection import FaceDetector
+from src.utils.gallery_scan import load_gallery_paths
+from src.utils.instrumentation import REGISTRY, STAGE_SECONDS, get_metrics_path, log_timings, stage_timer
+
+logging_str = "[%(asctime)s: %(levelname)s : %(module)s] : %(message)s"
+log_dir= 'logs'
+os.makedirs(log_dir, exist_ok= True)
+logging.basicConfig(filename=os.path.join(log_dir, "running_log.log"), level= logging.INFO,
+format= logging_str, filemode= 'a')
+
+detector = None
+
+
+def init_detector(detection):
+    '''
+    Create this process's face detector, once per worker
+    '''
+    global detector
+    detector = FaceDetector(detection)
+
+
+def detect_file(img_path):
+    '''
+    Input : img_path - gallery image
+    Output : (status, num_faces, box, confidence, landmarks) of the most
+             confident face, as stored in the face cache
+    '''
+    img = cv2.imread(img_path)
+    if img is None:
+        return STATUS_UNREADABLE, 0, None, 0.0, None
+    faces = detector.detect_landmarks(img)
+    if not faces:
+        return STATUS_NO_FACE, 0, None, 0.0, None
+    box, confidence, landmarks = faces[0]
+    status = STATUS_OK if len(faces) == 1 else STATUS_MULTIPLE
+    return status, len(faces), box, confidence, landmarks
+
+
+def detect_chunk(chunk):
+    '''
+    Detect faces in a list of (content_hash, img_path) pairs
+    '''
+    results = []
+    for content_hash, img_path in chunk:
+        try:
+            results.append((content_hash, *detect_file(img_path)))
+        except Exception as e:
+            logging.warning(f"Face detection failed for {img_path}: {str(e)}")
+            results.append((content_hash, STATUS_UNREADABLE, 0, None, 0.0, None))
+    return results
+
+
+def detect_gallery_faces(config_path, params_path, workers=None) :
+    '''
+    This function will run face detection once over every gallery image
+    and cache the box and landmarks of its most confident face by image
+    content hash. Only images whose content is not cached yet are
+    detected, on gallery_faces.workers processes with their own
+    detector. Images with no face or several faces are recorded too,
+    so stage 02 can embed face crops like the queries and leave those
+    images out of the index.
+    Input : config_path - file storing configuration
+            params path - parameters path
+            workers - detection processes, overrides params.yaml when set
+    Output : detection checkpoint shards under the face cache directory
+    '''
+
+    config = read_yaml(config_path)
+    params = read_yaml(params_path)
+    gallery_faces = params['gallery_faces']
+    if not gallery_faces['enabled']:
+        logging.info("gallery_faces.enabled is off, stage 02 embeds whole images")
+        return
+
+    cache = FaceCache(get_face_cache_dir(config, params))
+    filenames, stats = load_gallery_paths(config)
+    timings = {}
+    with stage_timer('hash', timings):
+        hashes = cache.hash_files(filenames, stats)
+
+    # One detection per distinct image content
+    todo = {}
+    for file, content_hash in zip(filenames, hashes):
+        if content_hash is not None and content_hash not in cache:
+            todo.setdefault(content_hash, file)
+    logging.info(f"{len(filenames) - len(todo)} images already detected, {len(todo)} to detect")
+
+    if todo:
+        items = list(todo.items())
+        chunk_size = gallery_faces['chunk_size']
+        chunks = [items[i:i + chunk_size] for i in range(0, len(items), chunk_size)]
+        workers = max(1, min(workers or gallery_faces['workers'], len(chunks)))
+
+        start = time.perf_counter()
+        if workers == 1:
+            init_detector(params['detection'])
+            results = map(detect_chunk, chunks)
+            pool = None
+        else:
+            logging.info(f"Starting {workers} face detection workers")
+            pool = ProcessPoolExecutor(max_workers=workers, initializer=init_detector,
+                                       initargs=(params['detection'],),
+                                       mp_context=multiprocessing.get_context('spawn'))
+            results = pool.map(detect_chunk, chunks)
+        try:
+            for chunk_results in results:
+                for content_hash, status, num_faces, box, confidence, landmarks in chunk_results:
+                    cache.add(content_hash, status, num_faces, box, confidence, landmarks)
+                if cache.pending >= gallery_faces['checkpoint_every']:
+                    with stage_timer('checkpoint', timings):
+                        cache.checkpoint()
+        finally:
+            if pool is not None:
+                pool.shutdown()
+            with stage_timer('checkpoint', timings):
+                cache.checkpoint()
+        elapsed = time.perf_counter() - start
+        timings['detect'] = elapsed
+        STAGE_SECONDS.observe(elapsed, stage='detect')
+        logging.info(f"Detected faces in {len(todo)} images in {elapsed:.1f}s "
+                     f"({len(todo) / max(elapsed, 1e-9):.1f} images/sec, workers={workers})")
+
+    statuses = Counter(STATUS_NAMES[cache.get(content_hash)[0]] for content_hash in hashes
+                       if content_hash is not None)
+    logging.info(f"Gallery face detection : {dict(statuses)}")
+    log_timings(logging.getLogger(), 'stage_01b', timings, images=len(filenames), detected=len(todo))
+    REGISTRY.write_textfile(get_metrics_path(config, 'stage_01b'))
+
+
+if __name__ == '__main__' :
+    args = argparse.ArgumentParser()
+    args.add_argument('--config', '--c', default='config/config.yaml')
+    args.add_argument('--params', '--p', default='params.yaml')
+    args.add_argument('--workers', '--w', type=int, default=None)
+    parsed_args = args.parse_args()
+
+    try :
+        logging.info(">>>>> stage_01b started")
+        detect_gallery_faces(config_path= parsed_args.config,
+                             params_path= parsed_args.params,
+                             workers= parsed_args.workers )
+        logging.info("stage_01b completed >>>>>")
+
+    except Exception as e:
+        logging.exception(e)
+        raise e
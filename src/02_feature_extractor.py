@@ -1,13 +1,25 @@
 import argparse
 import os
 import logging
-import pickle
+import time
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import cv2
 import numpy as np
 from tqdm import tqdm
 from keras_preprocessing.image import load_img, img_to_array
-from keras_vggface.utils import preprocess_input
-from keras_vggface.vggface import VGGFace
 from src.utils.all_utils import read_yaml, create_directory
+from src.utils.embedding_store import EmbeddingStore, get_store_dir, write_embedding_store
+from src.utils.face_cache import (STATUS_MULTIPLE, STATUS_NAMES, STATUS_OK, FaceCache,
+                                  detector_tag, get_face_cache_dir)
+from src.utils.face_detection import face_array
+from src.utils.feature_cache import FeatureCache
+from src.utils.gallery_scan import get_manifest_path, load_gallery_paths
+from src.utils.identity_index import write_identity_centroids
+from src.utils.inference_backend import load_backend, model_tag, preprocess_input
+from src.utils.instrumentation import REGISTRY, STAGE_SECONDS, get_metrics_path, log_timings, stage_timer
+from src.utils.quantization import write_compressed
 
 # Configure logging 
 logging_str = "[%(asctime)s: %(levelname)s: %(module)s]: %(message)s"
@@ -20,38 +32,240 @@ logging.basicConfig(
     filemode='a'
 )
 
-def extractor(img_path, model):
+def load_image(img_path):
     """
-    Convert image to feature vector using the specified model
+    Decode and resize one gallery image to the model input size
     
     Args:
         img_path (str): Path to image file
-        model (VGGFace): Pretrained VGGFace model
         
     Returns:
-        np.array: Extracted features as flattened array
+        np.array: (224, 224, 3) float32 image array
     """
-    try:
-        # Load and preprocess image
-        img = load_img(img_path, target_size=(224, 224))
-        img_array = img_to_array(img)
-        expanded_img = np.expand_dims(img_array, axis=0)
-        preprocessed_img = preprocess_input(expanded_img)
-        
-        # Extract features
-        result = model.predict(preprocessed_img).flatten()
-        return result
-    except Exception as e:
-        logging.error(f"Error processing image {img_path}: {str(e)}")
-        raise
+    img = load_img(img_path, target_size=(224, 224))
+    return img_to_array(img)
+
+def load_face(img_path, box):
+    """
+    Decode one gallery image and crop its cached face box exactly like
+    a query face is cropped in main.py
+
+    Args:
+        img_path (str): Path to image file
+        box (tuple): (x, y, width, height) from the face cache
+
+    Returns:
+        np.array: (224, 224, 3) float32 face array
+    """
+    img = cv2.imread(img_path)
+    if img is None:
+        raise ValueError(f"Could not decode {img_path}")
+    return face_array(img, box)
+
+def embedding_cache_name(params):
+    """
+    Feature cache namespace: the model tag, plus the detector when the
+    gallery is embedded as face crops, since other boxes give other embeddings
+    """
+    if params['gallery_faces']['enabled']:
+        return f"{model_tag(params)}-{detector_tag(params['detection'])}"
+    return model_tag(params)
+
+def iter_image_batches(filenames, batch_size, num_workers, prefetch_batches=2, boxes=None):
+    """
+    Decode images on a thread pool ahead of the model and group them
+    into fixed-size batches. At most prefetch_batches batches worth of
+    images are in flight, so memory stays bounded for any gallery size.
+    
+    Args:
+        filenames (list): Image paths in gallery order
+        batch_size (int): Images per yielded batch
+        num_workers (int): Decoder threads
+        prefetch_batches (int): Batches to decode ahead of the consumer
+        boxes (dict): Face box per path; whole images are loaded when None
+        
+    Yields:
+        tuple: (batch_files, batch_array, failed_files) where failed_files
+            lists the paths that could not be decoded since the last batch
+    """
+    max_in_flight = max(batch_size * prefetch_batches, 1)
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        pending = deque()
+        file_iter = iter(filenames)
+        batch_files, batch_images, failed = [], [], []
 
-def feature_extractor(config_path, params_path):
+        def refill():
+            for file in file_iter:
+                if boxes is None:
+                    pending.append((file, pool.submit(load_image, file)))
+                else:
+                    pending.append((file, pool.submit(load_face, file, boxes[file])))
+                if len(pending) >= max_in_flight:
+                    break
+
+        refill()
+        while pending:
+            file, future = pending.popleft()
+            try:
+                batch_images.append(future.result())
+                batch_files.append(file)
+            except Exception as e:
+                failed.append(file)
+                logging.warning(f"Skipped {file}: {str(e)}")
+            refill()
+
+            if len(batch_files) == batch_size:
+                yield batch_files, np.stack(batch_images), failed
+                batch_files, batch_images, failed = [], [], []
+
+        if batch_files or failed:
+            images = np.stack(batch_images) if batch_images else None
+            yield batch_files, images, failed
+
+def extract_batch(images, model):
+    """
+    Run one forward pass over a batch of decoded images
+    
+    Args:
+        images (np.array): (N, 224, 224, 3) image batch
+        model: Inference backend from load_backend
+        
+    Returns:
+        np.array: (N, dim) feature matrix
+    """
+    preprocessed_img = preprocess_input(images.astype('float32'))
+    return model.predict(preprocessed_img)
+
+def split_shards(filenames, num_shards):
+    """
+    Split the filename list into num_shards contiguous, near-equal shards
+    
+    Args:
+        filenames (list): Image paths in gallery order
+        num_shards (int): Number of shards
+        
+    Returns:
+        list: List of filename lists
+    """
+    size, extra = divmod(len(filenames), num_shards)
+    shards, start = [], 0
+    for i in range(num_shards):
+        end = start + size + (1 if i < extra else 0)
+        shards.append(filenames[start:end])
+        start = end
+    return shards
+
+def select_faces(config, params, base_dir, filenames, hashes):
+    """
+    Split the gallery into images with a cached face box and images to
+    leave out of the index, using the detections of stage 01b
+
+    Args:
+        filenames (list): Image paths in gallery order
+        hashes (dict): Content hash per path, None for missing files
+
+    Returns:
+        tuple: (kept_files, boxes, excluded) where boxes maps each kept
+            path to its face box and excluded lists (path, reason) pairs
+    """
+    face_cache = FaceCache(get_face_cache_dir(config, params, base_dir))
+    allowed = {STATUS_OK} if params['gallery_faces']['exclude_multiple'] else {STATUS_OK, STATUS_MULTIPLE}
+    kept, boxes, excluded, missing = [], {}, [], 0
+    for file in filenames:
+        if hashes[file] is None:
+            kept.append(file)
+            continue
+        detection = face_cache.get(hashes[file])
+        if detection is None:
+            missing += 1
+        elif detection[0] in allowed:
+            kept.append(file)
+            boxes[file] = detection[2]
+        else:
+            excluded.append((file, STATUS_NAMES[detection[0]]))
+    if missing:
+        raise ValueError(f"{missing} gallery images have no cached face detection, "
+                         f"run src/01b_detect_faces.py first")
+    return kept, boxes, excluded
+
+def shard_boxes(boxes, filenames):
+    return None if boxes is None else [boxes[file] for file in filenames]
+
+def extraction_worker(worker_id, filenames, content_hashes, cache_root, config, params, num_threads,
+                      boxes=None):
+    """
+    Embed one shard of the gallery into the feature cache. Runs either
+    in-process or as a spawned worker process with its own model.
+    
+    Args:
+        worker_id (int): Shard number, also the cache writer id
+        filenames (list): Image paths of this shard
+        content_hashes (list): Content hash of each image path
+        cache_root (str): Feature cache directory
+        config (dict): Loaded config.yaml
+        params (dict): Loaded params.yaml
+        num_threads (int): Intra-op threads for this worker
+        boxes (list): Face box of each image path, None to embed whole images
+        
+    Returns:
+        tuple: (worker_id, failed_files, embedded_count, elapsed_seconds, timings)
+            where timings holds the seconds spent per step of the loop
+    """
+    extraction = params['extraction']
+    batch_size = extraction['batch_size']
+    cache = FeatureCache(cache_root, model_name=embedding_cache_name(params),
+                         pooling=params['base']['pooling'], writer_id=worker_id)
+    base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    model = load_backend(config, params, num_threads=num_threads, base_dir=base_dir)
+    hashes = dict(zip(filenames, content_hashes))
+    if boxes is not None:
+        boxes = dict(zip(filenames, boxes))
+    failed_files = []
+    embedded = 0
+    timings = {}
+    
+    start = time.perf_counter()
+    batches = iter_image_batches(filenames, batch_size,
+                                 num_workers=extraction['num_workers'],
+                                 prefetch_batches=extraction['prefetch_batches'],
+                                 boxes=boxes)
+    with tqdm(total=len(filenames), desc=f"Extracting features [{worker_id}]",
+              position=worker_id) as progress:
+        while True:
+            # Time blocked on the decoder threads, i.e. not hidden by prefetching
+            with stage_timer('decode_wait', timings):
+                batch = next(batches, None)
+            if batch is None:
+                break
+            batch_files, images, failed = batch
+            failed_files.extend(failed)
+            if batch_files:
+                try:
+                    with stage_timer('predict', timings):
+                        features = extract_batch(images, model)
+                    cache.add([hashes[file] for file in batch_files], features)
+                    embedded += len(batch_files)
+                except Exception as e:
+                    failed_files.extend(batch_files)
+                    logging.warning(f"Skipped batch of {len(batch_files)} files: {str(e)}")
+            if cache.pending >= extraction['checkpoint_every']:
+                with stage_timer('checkpoint', timings):
+                    cache.checkpoint()
+            progress.update(len(batch_files) + len(failed))
+    with stage_timer('checkpoint', timings):
+        cache.checkpoint()
+    return worker_id, failed_files, embedded, time.perf_counter() - start, timings
+
+def feature_extractor(config_path, params_path, workers=None, filenames=None):
     """
     Main feature extraction pipeline
     
     Args:
         config_path (str): Path to config YAML file
         params_path (str): Path to params YAML file
+        workers (int): Extraction processes, overrides params.yaml when set
+        filenames (iterable): Image paths in gallery order; streamed from
+            the stage 01 manifest when not given
     """
     try:
         # Load configuration
@@ -62,36 +276,15 @@ def feature_extractor(config_path, params_path):
         artifacts = config['artifacts']
         base_dir = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
         
-        # Input pickle file paths
-        pickle_format_data_dir = artifacts['pickle_format_data_dir']
-        img_pickle_file_name = artifacts['img_pickle_file_name']
-        img_pickle_file = os.path.join(
-            base_dir,
-            artifacts['artifacts_dir'],
-            pickle_format_data_dir,
-            img_pickle_file_name
-        )
-        
-        # Validate input pickle
-        if not os.path.exists(img_pickle_file):
-            raise FileNotFoundError(f"Image pickle file not found at {img_pickle_file}")
-        if os.path.getsize(img_pickle_file) == 0:
-            raise ValueError(f"Image pickle file is empty: {img_pickle_file}")
-            
-        # Load image paths
-        with open(img_pickle_file, 'rb') as f:
-            filenames = pickle.load(f)
+        stats = None
+        if filenames is None:
+            # Paths and stat info from the stage 01 manifest; the whole
+            # ordered list is needed for face selection, sharding and the store
+            filenames, stats = load_gallery_paths(config, base_dir)
+            if not filenames:
+                raise ValueError(f"Gallery manifest is empty: {get_manifest_path(config, base_dir)}")
         logging.info(f"Successfully loaded {len(filenames)} image paths")
         
-        # Initialize model
-        model = VGGFace(
-            model=params['base']['BASE_MODEL'],
-            include_top=params['base']['include_top'],
-            pooling=params['base']['pooling'],
-            input_shape=(224, 224, 3)
-        )
-        logging.info(f"Initialized {params['base']['BASE_MODEL']} model")
-        
         # Setup output directory
         feature_extraction_path = os.path.join(
             base_dir,
@@ -100,34 +293,115 @@ def feature_extractor(config_path, params_path):
         )
         create_directory(dirs=[feature_extraction_path])
         
-        # Extract features
-        features = []
-        failed_files = []
+        timings = {}
         
-        for file in tqdm(filenames, desc="Extracting features"):
-            try:
-                features.append(extractor(file, model))
-            except Exception as e:
-                failed_files.append(file)
-                logging.warning(f"Skipped {file}: {str(e)}")
-                continue
+        # Only embed images whose content is not already cached
+        model_name = model_tag(params)
+        pooling = params['base']['pooling']
+        cache = FeatureCache(
+            os.path.join(feature_extraction_path, artifacts['feature_cache_dir']),
+            model_name=embedding_cache_name(params),
+            pooling=pooling
+        )
+        with stage_timer('hash', timings):
+            hashes = dict(zip(filenames, cache.hash_files(filenames, stats)))
+
+        # Embed the cached face crops and leave out images without exactly one usable face
+        boxes = None
+        if params['gallery_faces']['enabled']:
+            filenames, boxes, excluded = select_faces(config, params, base_dir, filenames, hashes)
+            if excluded:
+                logging.warning(f"Excluded {len(excluded)} images without a single clear face")
+                with open(os.path.join(feature_extraction_path, 'excluded_files.txt'), 'w') as f:
+                    f.write('\n'.join(f"{file}\t{reason}" for file, reason in excluded))
+            if not filenames:
+                raise ValueError("No gallery image has a usable face")
+        
+        failed_files = [file for file in filenames if hashes[file] is None]
+        to_embed = [file for file in filenames
+                    if hashes[file] is not None and hashes[file] not in cache]
+        logging.info(f"{len(filenames) - len(to_embed) - len(failed_files)} images cached, "
+                     f"{len(to_embed)} to embed")
+        
+        if to_embed:
+            extraction = params['extraction']
+            workers = max(1, min(workers or extraction['workers'], len(to_embed)))
+            threads = extraction['threads_per_worker']
+            if threads is None and workers > 1:
+                threads = max(1, (os.cpu_count() or 1) // workers)
+            cache_root = os.path.join(feature_extraction_path, artifacts['feature_cache_dir'])
+            shards = split_shards(to_embed, workers)
+            
+            start = time.perf_counter()
+            if workers == 1:
+                results = [extraction_worker(0, to_embed, [hashes[file] for file in to_embed],
+                                             cache_root, config, params, threads,
+                                             shard_boxes(boxes, to_embed))]
+            else:
+                logging.info(f"Starting {workers} extraction workers with {threads} threads each")
+                with ProcessPoolExecutor(max_workers=workers,
+                                         mp_context=multiprocessing.get_context('spawn')) as pool:
+                    futures = [pool.submit(extraction_worker, worker_id, shard,
+                                           [hashes[file] for file in shard],
+                                           cache_root, config, params, threads,
+                                           shard_boxes(boxes, shard))
+                               for worker_id, shard in enumerate(shards)]
+                    results = [future.result() for future in futures]
+            elapsed = time.perf_counter() - start
+            timings['embed'] = elapsed
+            STAGE_SECONDS.observe(elapsed, stage='embed')
+            
+            # Merge in worker order so failed_files.txt is deterministic
+            embedded = 0
+            for worker_id, worker_failed, worker_embedded, worker_elapsed, worker_timings in results:
+                failed_files.extend(worker_failed)
+                embedded += worker_embedded
+                logging.info(f"Worker {worker_id}: {worker_embedded} images in {worker_elapsed:.1f}s "
+                             f"({worker_embedded / max(worker_elapsed, 1e-9):.1f} images/sec)")
+                log_timings(logging.getLogger(), 'stage_02_worker', worker_timings, worker_id=worker_id)
+            logging.info(f"Extracted {embedded} images in {elapsed:.1f}s "
+                         f"({embedded / max(elapsed, 1e-9):.1f} images/sec, workers={workers}, "
+                         f"threads_per_worker={threads}, batch_size={extraction['batch_size']})")
+            
+            # Pick up the shards the workers checkpointed
+            cache = FeatureCache(cache_root, model_name=embedding_cache_name(params), pooling=pooling)
+        
+        # Assemble the gallery in filename order and drop deleted images from the cache
+        extracted_files = [file for file in filenames
+                           if hashes[file] is not None and hashes[file] in cache]
+        live_hashes = [hashes[file] for file in extracted_files]
+        with stage_timer('gather', timings):
+            cache.prune(live_hashes)
+            features = cache.gather(live_hashes) if live_hashes else []
         
         # Validate extracted features
-        if not features:
+        if not len(features):
             raise ValueError("No features were extracted successfully")
         if len(features) != len(filenames) - len(failed_files):
             raise ValueError("Mismatch between processed files and extracted features")
         
-        # Save features
-        feature_name = os.path.join(
-            feature_extraction_path,
-            artifacts['extracted_features_name']
-        )
+        # Save features with a manifest of the files that produced them
+        store_dir = get_store_dir(config, base_dir)
+        with stage_timer('write_store', timings):
+            write_embedding_store(
+                store_dir,
+                features,
+                extracted_files,
+                model_name=model_name,
+                pooling=params['base']['pooling']
+            )
+        
+        logging.info(f"Successfully saved {len(features)} features to {store_dir}")
         
-        with open(feature_name, 'wb') as f:
-            pickle.dump(features, f)
+        # Identity centroids and compressed codes are derived from the normalized store
+        store = EmbeddingStore.open(store_dir)
+        with stage_timer('identity_centroids', timings):
+            write_identity_centroids(store_dir, store.matrix, store.labels, store.version)
+        with stage_timer('compress', timings):
+            write_compressed(store_dir, store.matrix, params['compression'], store.version)
         
-        logging.info(f"Successfully saved {len(features)} features to {feature_name}")
+        log_timings(logging.getLogger(), 'stage_02', timings, images=len(filenames), embedded=len(to_embed))
+        REGISTRY.write_textfile(get_metrics_path(config, 'stage_02', base_dir))
         
         if failed_files:
             logging.warning(f"Failed to process {len(failed_files)} files")
@@ -137,10 +411,6 @@ def feature_extractor(config_path, params_path):
     except Exception as e:
         logging.error(f"Feature extraction failed: {str(e)}")
         raise
-    finally:
-        # Clean up
-        if 'model' in locals():
-            del model
 
 if __name__ == '__main__':
     # Argument parsing
@@ -149,11 +419,14 @@ if __name__ == '__main__':
                        help='Path to config file')
     parser.add_argument('--params', '-p', default='params.yaml',
                        help='Path to params file')
+    parser.add_argument('--workers', '-w', type=int, default=None,
+                       help='Number of extraction processes (default: params.yaml)')
     args = parser.parse_args()
     
     try:
         logging.info(">>>>> Stage 02 feature extraction started")
-        feature_extractor(config_path=args.config, params_path=args.params)
+        feature_extractor(config_path=args.config, params_path=args.params,
+                          workers=args.workers)
         logging.info("<<<<< Stage 02 completed successfully")
     except Exception as e:
         logging.exception(f"Stage 02 failed: {str(e)}")
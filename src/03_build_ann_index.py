@@ -0,0 +1,64 @@
+import argparse
+import os
+import logging
+from src.utils.all_utils import read_yaml
+from src.utils.ann_index import IVFIndex, get_ann_index_path
+from src.utils.embedding_store import EmbeddingStore, get_store_dir
+from src.utils.instrumentation import REGISTRY, get_metrics_path, log_timings, stage_timer
+
+logging_str = "[%(asctime)s: %(levelname)s : %(module)s] : %(message)s"
+log_dir= 'logs'
+os.makedirs(log_dir, exist_ok= True)
+logging.basicConfig(filename=os.path.join(log_dir, "running_log.log"), level= logging.INFO,
+format= logging_str, filemode= 'a')
+
+def build_ann_index(config_path, params_path) :
+    '''
+    This function will build the IVF approximate nearest-neighbour
+    index over the embedding store written by stage 02.
+    Galleries smaller than ann.min_gallery_size are left to exact
+    search and any stale index is removed.
+    Input : config_path - file storing configuration
+            params path - parameters path
+    Output : Save the IVF index next to the embedding store
+    '''
+
+    config = read_yaml(config_path)
+    params = read_yaml(params_path)
+    ann = params['ann']
+
+    store = EmbeddingStore.open(get_store_dir(config))
+    ann_index_path = get_ann_index_path(config)
+
+    if not ann['enabled'] or len(store) < ann['min_gallery_size']:
+        logging.info(f"Skipping ANN index for {len(store)} rows, exact search will be used")
+        if os.path.exists(ann_index_path):
+            os.remove(ann_index_path)
+        return
+
+    timings = {}
+    with stage_timer('ivf_build', timings):
+        index = IVFIndex.build(store.matrix, nlist=ann['nlist'], n_iter=ann['kmeans_iters'],
+                               train_sample=ann['train_sample'], nprobe=ann['nprobe'])
+    with stage_timer('ivf_save', timings):
+        index.save(ann_index_path, store.version)
+    logging.info(f"Saved ANN index to {ann_index_path}")
+    log_timings(logging.getLogger(), 'stage_03', timings, rows=len(store))
+    REGISTRY.write_textfile(get_metrics_path(config, 'stage_03'))
+
+
+if __name__ == '__main__' :
+    args = argparse.ArgumentParser()
+    args.add_argument('--config', '--c', default='config/config.yaml')
+    args.add_argument('--params', '--p', default='params.yaml')
+    parsed_args = args.parse_args()
+
+    try :
+        logging.info(">>>>> stage_03 started")
+        build_ann_index(config_path= parsed_args.config,
+                        params_path= parsed_args.params )
+        logging.info("stage_03 completed >>>>>")
+
+    except Exception as e:
+        logging.exception(e)
+        raise e
@@ -0,0 +1,66 @@
+import argparse
+import os
+import logging
+from src.utils.all_utils import read_yaml, create_directory
+from src.utils.embedding_store import EmbeddingStore, get_store_dir
+from src.utils.feature_cache import hash_files
+from src.utils.instrumentation import REGISTRY, get_metrics_path, log_timings, stage_timer
+from src.utils.thumbnails import build_thumbnails
+
+logging_str = "[%(asctime)s: %(levelname)s : %(module)s] : %(message)s"
+log_dir= 'logs'
+os.makedirs(log_dir, exist_ok= True)
+logging.basicConfig(filename=os.path.join(log_dir, "running_log.log"), level= logging.INFO,
+format= logging_str, filemode= 'a')
+
+def generate_thumbnails(config_path, params_path) :
+    '''
+    This function will give every image in the embedding store a
+    stable content-addressed ID and precompute its WebP thumbnails,
+    so the API can serve matches without copying gallery files.
+    Input : config_path - file storing configuration
+            params path - parameters path
+    Output : Thumbnails and gallery_ids.txt under artifacts/gallery
+    '''
+
+    config = read_yaml(config_path)
+    params = read_yaml(params_path)
+    thumbnails = params['thumbnails']
+
+    artifacts = config['artifacts']
+    gallery_dir = os.path.join(artifacts['artifacts_dir'], artifacts['gallery_dir'])
+    create_directory(dirs= [gallery_dir])
+
+    store = EmbeddingStore.open(get_store_dir(config))
+    hash_index_path = os.path.join(artifacts['artifacts_dir'], artifacts['feature_extraction_dir'],
+                                   artifacts['feature_cache_dir'], 'file_hashes.json')
+    timings = {}
+    with stage_timer('hash', timings):
+        # Stage 02 owns this index; only refresh the store's entries in it
+        content_hashes = hash_files(store.filenames, hash_index_path, merge=True)
+    if None in content_hashes:
+        raise FileNotFoundError("Some gallery images in the embedding store no longer exist, rerun stage 02")
+
+    with stage_timer('thumbnails', timings):
+        build_thumbnails(store.filenames, content_hashes, gallery_dir,
+                         sizes=thumbnails['sizes'], store_version=store.version,
+                         quality=thumbnails['quality'], num_workers=thumbnails['num_workers'])
+    log_timings(logging.getLogger(), 'stage_04', timings, images=len(store))
+    REGISTRY.write_textfile(get_metrics_path(config, 'stage_04'))
+
+
+if __name__ == '__main__' :
+    args = argparse.ArgumentParser()
+    args.add_argument('--config', '--c', default='config/config.yaml')
+    args.add_argument('--params', '--p', default='params.yaml')
+    parsed_args = args.parse_args()
+
+    try :
+        logging.info(">>>>> stage_04 started")
+        generate_thumbnails(config_path= parsed_args.config,
+                            params_path= parsed_args.params )
+        logging.info("stage_04 completed >>>>>")
+
+    except Exception as e:
+        logging.exception(e)
+        raise e
@@ -0,0 +1,194 @@
+import argparse
+import json
+import os
+import logging
+import random
+import time
+import cv2
+import numpy as np
+from keras_preprocessing.image import load_img, img_to_array
+from src.utils.all_utils import read_yaml, create_directory
+from src.utils.ann_index import load_search_index
+from src.utils.embedding_store import EmbeddingStore, get_store_dir
+from src.utils.face_cache import STATUS_OK, FaceCache, get_face_cache_dir
+from src.utils.face_detection import face_array
+from src.utils.gallery_scan import load_gallery_paths
+from src.utils.inference_backend import KerasBackend, export_path, load_backend, preprocess_input
+
+logging_str = "[%(asctime)s: %(levelname)s : %(module)s] : %(message)s"
+log_dir= 'logs'
+os.makedirs(log_dir, exist_ok= True)
+logging.basicConfig(filename=os.path.join(log_dir, "running_log.log"), level= logging.INFO,
+format= logging_str, filemode= 'a')
+
+def gallery_inputs(config, params) :
+    '''
+    Gallery images stage 02 embeds and the cached face box of each, or
+    None for the boxes when gallery_faces is off and whole images are embedded
+    '''
+    filenames, stats = load_gallery_paths(config)
+    if not params['gallery_faces']['enabled']:
+        return filenames, None
+    face_cache = FaceCache(get_face_cache_dir(config, params))
+    boxes = {}
+    for path, content_hash in zip(filenames, face_cache.hash_files(filenames, stats)):
+        detection = face_cache.get(content_hash) if content_hash is not None else None
+        if detection is not None and detection[0] == STATUS_OK:
+            boxes[path] = detection[2]
+    if not boxes:
+        raise ValueError("No gallery image has a cached face, run src/01b_detect_faces.py first")
+    return [path for path in filenames if path in boxes], boxes
+
+
+def load_sample(filenames, boxes, count, seed=0) :
+    '''
+    Random sample of gallery inputs, preprocessed exactly like stage 02:
+    the cached face crops, or whole images when boxes is None
+    '''
+    sample = random.Random(seed).sample(filenames, min(count, len(filenames)))
+    images = []
+    for path in sample:
+        try:
+            if boxes is None:
+                images.append(img_to_array(load_img(path, target_size=(224, 224))))
+                continue
+            img = cv2.imread(path)
+            if img is None:
+                raise ValueError(f"Could not decode {path}")
+            images.append(face_array(img, boxes[path]))
+        except Exception as e:
+            logging.warning(f"Skipped {path}: {str(e)}")
+    return preprocess_input(np.stack(images).astype('float32'))
+
+
+def export_onnx(keras_model, path, calibration) :
+    import tensorflow as tf
+    import tf2onnx
+    from onnxruntime.quantization import CalibrationDataReader, QuantFormat, QuantType, quantize_static
+
+    spec = (tf.TensorSpec((None, 224, 224, 3), tf.float32, name='input'),)
+    tf2onnx.convert.from_keras(keras_model, input_signature=spec, opset=13, output_path=path)
+    logging.info(f"Exported ONNX model to {path}")
+
+    class Reader(CalibrationDataReader):
+        def __init__(self):
+            self.batches = iter([{'input': calibration[i:i + 8]} for i in range(0, len(calibration), 8)])
+
+        def get_next(self):
+            return next(self.batches, None)
+
+    int8_path = path.replace('.onnx', '_int8.onnx')
+    quantize_static(path, int8_path, Reader(), quant_format=QuantFormat.QDQ,
+                    activation_type=QuantType.QUInt8, weight_type=QuantType.QInt8)
+    logging.info(f"Exported int8 ONNX model to {int8_path}")
+
+
+def export_tflite(keras_model, path, calibration) :
+    import tensorflow as tf
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    with open(path, 'wb') as f:
+        f.write(converter.convert())
+    logging.info(f"Exported TFLite model to {path}")
+
+    def representative_dataset():
+        for image in calibration:
+            yield [image[None]]
+
+    converter = tf.lite.TFLiteConverter.from_keras_model(keras_model)
+    converter.optimizations = [tf.lite.Optimize.DEFAULT]
+    converter.representative_dataset = representative_dataset
+    int8_path = path.replace('.tflite', '_int8.tflite')
+    with open(int8_path, 'wb') as f:
+        f.write(converter.convert())
+    logging.info(f"Exported int8 TFLite model to {int8_path}")
+
+
+def parity_report(reference, backend, images, search_index) :
+    '''
+    Cosine agreement with the Keras embeddings, top-1 gallery agreement
+    and per-image latency of one backend on the parity sample
+    '''
+    start = time.perf_counter()
+    embeddings = np.concatenate([backend.predict(images[i:i + 1]) for i in range(len(images))])
+    latency_ms = (time.perf_counter() - start) * 1000 / len(images)
+
+    a = reference / np.linalg.norm(reference, axis=1, keepdims=True)
+    b = embeddings / np.linalg.norm(embeddings, axis=1, keepdims=True)
+    cosine = np.einsum('ij,ij->i', a, b)
+    report = {'cosine_mean': float(cosine.mean()), 'cosine_min': float(cosine.min()),
+              'latency_ms_per_image': latency_ms}
+    if search_index is not None:
+        expected = [m[0][0] for m in search_index.search_batch(reference, k=1)]
+        actual = [m[0][0] for m in search_index.search_batch(embeddings, k=1)]
+        report['top1_agreement'] = float(np.mean(np.array(expected) == np.array(actual)))
+    return report
+
+
+def export_model(config_path, params_path) :
+    '''
+    This function will export the configured VGGFace model to ONNX
+    and/or TFLite, plus int8 variants calibrated on a sample of the
+    gallery's face crops (the inputs stage 02 embeds), and check every
+    variant against the Keras embeddings on another sample.
+    Input : config_path - file storing configuration
+            params path - parameters path
+    Output : Exported models and parity_report.json under artifacts/models
+    '''
+
+    config = read_yaml(config_path)
+    params = read_yaml(params_path)
+    inference = params['inference']
+
+    artifacts = config['artifacts']
+    create_directory(dirs= [os.path.join(artifacts['artifacts_dir'], artifacts['model_export_dir'])])
+    filenames, boxes = gallery_inputs(config, params)
+
+    keras_backend = KerasBackend(params)
+    calibration = load_sample(filenames, boxes, inference['calibration_images'], seed=0)
+    for fmt in inference['export_formats']:
+        path = export_path(config, params, fmt)
+        if fmt == 'onnx':
+            export_onnx(keras_backend.model, path, calibration)
+        elif fmt == 'tflite':
+            export_tflite(keras_backend.model, path, calibration)
+        else:
+            raise ValueError(f"Unknown export format {fmt!r}")
+
+    # Parity on a different sample than the one used for calibration
+    images = load_sample(filenames, boxes, inference['parity_images'], seed=1)
+    store_dir = get_store_dir(config)
+    search_index = None
+    if os.path.exists(store_dir):
+        store = EmbeddingStore.open(store_dir)
+        search_index = load_search_index(store, config, params)
+    reference = keras_backend.predict(images)
+
+    report = {'keras': parity_report(reference, keras_backend, images, search_index)}
+    for fmt in inference['export_formats']:
+        for backend_name in (fmt, f"{fmt}_int8"):
+            backend = load_backend(config, params, backend=backend_name)
+            report[backend_name] = parity_report(reference, backend, images, search_index)
+            logging.info(f"Parity for {backend_name}: {report[backend_name]}")
+
+    report_path = os.path.join(artifacts['artifacts_dir'], artifacts['model_export_dir'], 'parity_report.json')
+    with open(report_path, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__' :
+    args = argparse.ArgumentParser()
+    args.add_argument('--config', '--c', default='config/config.yaml')
+    args.add_argument('--params', '--p', default='params.yaml')
+    parsed_args = args.parse_args()
+
+    try :
+        logging.info(">>>>> stage_05 started")
+        export_model(config_path= parsed_args.config,
+                     params_path= parsed_args.params )
+        logging.info("stage_05 completed >>>>>")
+
+    except Exception as e:
+        logging.exception(e)
+        raise e
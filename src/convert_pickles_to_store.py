@@ -0,0 +1,69 @@
+import argparse
+import os
+import logging
+import pickle
+from src.utils.all_utils import read_yaml
+from src.utils.embedding_store import get_store_dir, write_embedding_store
+
+logging_str = "[%(asctime)s: %(levelname)s : %(module)s] : %(message)s"
+log_dir= 'logs'
+os.makedirs(log_dir, exist_ok= True)
+logging.basicConfig(filename=os.path.join(log_dir, "running_log.log"), level= logging.INFO,
+format= logging_str, filemode= 'a')
+
+def convert_pickles(config_path, params_path) :
+    '''
+    One-shot conversion of embedding.pkl and img_pickle_file.pkl
+    into the memory-mapped embedding store.
+    Files listed in failed_files.txt are dropped from the filename list
+    so the manifest lines up row-for-row with the stored embeddings.
+    Input : config_path - file storing configuration
+            params path - parameters path
+    Output : Embedding store written next to embedding.pkl
+    '''
+
+    config = read_yaml(config_path)
+    params = read_yaml(params_path)
+
+    artifacts = config['artifacts']
+    artifacts_dir = artifacts['artifacts_dir']
+    pickle_file = os.path.join(artifacts_dir, artifacts['pickle_format_data_dir'],
+                               artifacts['img_pickle_file_name'])
+    feature_extraction_path = os.path.join(artifacts_dir, artifacts['feature_extraction_dir'])
+    features_name = os.path.join(feature_extraction_path, artifacts['extracted_features_name'])
+    failed_files_path = os.path.join(feature_extraction_path, 'failed_files.txt')
+
+    with open(features_name, 'rb') as f:
+        features = pickle.load(f)
+    with open(pickle_file, 'rb') as f:
+        filenames = pickle.load(f)
+
+    if len(features) != len(filenames) and os.path.exists(failed_files_path):
+        with open(failed_files_path) as f:
+            failed_files = set(f.read().splitlines())
+        filenames = [name for name in filenames if name not in failed_files]
+        logging.info(f"Dropped {len(failed_files)} failed files from the filename list")
+
+    if len(features) != len(filenames):
+        raise ValueError(f"Cannot align {len(features)} embeddings with {len(filenames)} filenames")
+
+    write_embedding_store(get_store_dir(config), features, filenames,
+                          model_name=params['base']['BASE_MODEL'],
+                          pooling=params['base']['pooling'])
+
+
+if __name__ == '__main__' :
+    args = argparse.ArgumentParser()
+    args.add_argument('--config', '--c', default='config/config.yaml')
+    args.add_argument('--params', '--p', default='params.yaml')
+    parsed_args = args.parse_args()
+
+    try :
+        logging.info(">>>>> pickle to embedding store conversion started")
+        convert_pickles(config_path= parsed_args.config,
+                        params_path= parsed_args.params )
+        logging.info("pickle to embedding store conversion completed >>>>>")
+
+    except Exception as e:
+        logging.exception(e)
+        raise e
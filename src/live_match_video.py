@@ -0,0 +1,91 @@
+import argparse
+import os
+import logging
+import time
+import cv2
+from src.utils.all_utils import read_yaml
+from src.utils.live_matching import build_live_matcher
+
+logging_str = "[%(asctime)s: %(levelname)s : %(module)s] : %(message)s"
+log_dir= 'logs'
+os.makedirs(log_dir, exist_ok= True)
+logging.basicConfig(filename=os.path.join(log_dir, "running_log.log"), level= logging.INFO,
+format= logging_str, filemode= 'a')
+
+def match_video(config_path, params_path, video_path, output_path=None, realtime=True) :
+    '''
+    Run live lookalike matching against a recorded video instead of a
+    camera. Frames are fed at the video's own frame rate (or as fast as
+    possible without realtime) and every frame is annotated with the
+    latest available results, exactly as the webcam path does.
+    Input : video_path - recorded video file
+            output_path - optional annotated video to write
+            realtime - pace frames at the source FPS
+    Output : dict with display FPS, inference rate and embeddings run
+    '''
+
+    config = read_yaml(config_path)
+    params = read_yaml(params_path)
+
+    capture = cv2.VideoCapture(video_path)
+    if not capture.isOpened():
+        raise FileNotFoundError(f"Could not open video {video_path}")
+    fps = capture.get(cv2.CAP_PROP_FPS) or 30.0
+
+    matcher = build_live_matcher(config, params).start()
+    writer = None
+    frames = 0
+    start = time.perf_counter()
+    try:
+        while True:
+            ok, frame = capture.read()
+            if not ok:
+                break
+            matcher.submit_frame(frame)
+            annotated = matcher.annotate(frame)
+            frames += 1
+
+            if output_path:
+                if writer is None:
+                    height, width = annotated.shape[:2]
+                    writer = cv2.VideoWriter(output_path, cv2.VideoWriter_fourcc(*'mp4v'), fps, (width, height))
+                writer.write(annotated)
+            if realtime:
+                delay = start + frames / fps - time.perf_counter()
+                if delay > 0:
+                    time.sleep(delay)
+    finally:
+        matcher.stop()
+        capture.release()
+        if writer is not None:
+            writer.release()
+
+    elapsed = time.perf_counter() - start
+    report = {
+        'frames': frames,
+        'display_fps': frames / elapsed,
+        'inference_fps': matcher.frames_processed / elapsed,
+        'frames_dropped': matcher.frames_submitted - matcher.frames_processed,
+        'embeddings_run': matcher.embeddings_run,
+    }
+    logging.info(f"Live matching report for {video_path}: {report}")
+    return report
+
+
+if __name__ == '__main__' :
+    args = argparse.ArgumentParser()
+    args.add_argument('video')
+    args.add_argument('--config', '--c', default='config/config.yaml')
+    args.add_argument('--params', '--p', default='params.yaml')
+    args.add_argument('--output', '--o', default=None)
+    args.add_argument('--fast', action='store_true', help='Feed frames as fast as possible')
+    parsed_args = args.parse_args()
+
+    try :
+        report = match_video(parsed_args.config, parsed_args.params, parsed_args.video,
+                             output_path=parsed_args.output, realtime=not parsed_args.fast)
+        print(report)
+
+    except Exception as e:
+        logging.exception(e)
+        raise e
@@ -0,0 +1,197 @@
+import logging
+import os
+import numpy as np
+from src.utils.quantization import CompressedSearch
+from src.utils.search import SimilaritySearch, normalize_rows, top_k_indices
+
+
+def assign_to_centroids(matrix, centroids, chunk_size=65536):
+    '''
+    Index of the most similar centroid for every row, computed in chunks
+    so memory stays bounded for memory-mapped galleries.
+    '''
+    assignments = np.empty(matrix.shape[0], dtype=np.int32)
+    for start in range(0, matrix.shape[0], chunk_size):
+        chunk = np.asarray(matrix[start:start + chunk_size], dtype=np.float32)
+        assignments[start:start + chunk_size] = np.argmax(chunk @ centroids.T, axis=1)
+    return assignments
+
+
+def cluster_sums(rows, assignments, n_clusters):
+    '''
+    Sum of the rows assigned to each cluster: the rows are sorted by
+    cluster and every run summed at once with np.add.reduceat, which is
+    far faster than the unbuffered np.add.at on large (n, dim) samples.
+    '''
+    sums = np.zeros((n_clusters, rows.shape[1]), dtype=np.float32)
+    if len(assignments) == 0:
+        return sums
+    order = np.argsort(assignments, kind='stable')
+    ids, run_starts = np.unique(assignments[order], return_index=True)
+    sums[ids] = np.add.reduceat(np.asarray(rows, dtype=np.float32)[order], run_starts, axis=0)
+    return sums
+
+
+def spherical_kmeans(matrix, n_clusters, n_iter=20, train_sample=None, seed=0):
+    '''
+    k-means on the unit sphere (cosine similarity), trained on a random
+    sample of the normalized gallery rows.
+    Input : matrix - normalized float32 rows
+            n_clusters - number of centroids
+            n_iter - Lloyd iterations
+            train_sample - rows to train on, None for all of them
+    Output : (n_clusters, dim) normalized centroid matrix
+    '''
+    rng = np.random.default_rng(seed)
+    n_rows = matrix.shape[0]
+    if train_sample and train_sample < n_rows:
+        sample = np.asarray(matrix[np.sort(rng.choice(n_rows, train_sample, replace=False))])
+    else:
+        sample = np.asarray(matrix)
+    n_clusters = min(n_clusters, sample.shape[0])
+
+    centroids = sample[rng.choice(sample.shape[0], n_clusters, replace=False)].copy()
+    for iteration in range(n_iter):
+        assignments = assign_to_centroids(sample, centroids)
+        sums = cluster_sums(sample, assignments, n_clusters)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        empty = counts == 0
+        if empty.any():
+            # Re-seed empty clusters from random rows
+            sums[empty] = sample[rng.choice(sample.shape[0], int(empty.sum()), replace=False)]
+        centroids = normalize_rows(sums)
+    logging.info(f"Trained {n_clusters} centroids on {sample.shape[0]} rows in {n_iter} iterations")
+    return centroids
+
+
+class IVFIndex:
+    '''
+    Inverted-file index over the gallery embeddings. Rows are bucketed by
+    their nearest k-means centroid; a query scans only the nprobe buckets
+    whose centroids are closest to it and reranks those rows exactly.
+    Exposes the same search() interface as SimilaritySearch.
+    '''
+
+    def __init__(self, matrix, centroids, list_offsets, list_ids, nprobe=16):
+        self.matrix = matrix
+        self.centroids = centroids
+        self.list_offsets = list_offsets
+        self.list_ids = list_ids
+        self.nprobe = nprobe
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    @classmethod
+    def build(cls, matrix, nlist, n_iter=20, train_sample=None, nprobe=16, seed=0):
+        centroids = spherical_kmeans(matrix, nlist, n_iter=n_iter,
+                                     train_sample=train_sample, seed=seed)
+        assignments = assign_to_centroids(matrix, centroids)
+        list_ids = np.argsort(assignments, kind='stable').astype(np.int64)
+        counts = np.bincount(assignments, minlength=centroids.shape[0])
+        list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+        logging.info(f"Built IVF index with {centroids.shape[0]} lists over {matrix.shape[0]} rows "
+                     f"(largest list {counts.max()})")
+        return cls(matrix, centroids, list_offsets, list_ids, nprobe=nprobe)
+
+    def save(self, path, store_version):
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, centroids=self.centroids, list_offsets=self.list_offsets,
+                     list_ids=self.list_ids, count=self.matrix.shape[0],
+                     store_version=np.array(store_version))
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path, matrix, store_version, nprobe=16):
+        '''
+        Load a saved index over the given gallery matrix. Raises
+        ValueError when the index was built for a different build of the
+        embedding store, even one with the same number of rows.
+        '''
+        with np.load(path) as data:
+            if 'store_version' not in data.files or str(data['store_version']) != store_version:
+                raise ValueError(f"ANN index at {path} was built for another embedding store version")
+            if int(data['count']) != matrix.shape[0] or data['centroids'].shape[1] != matrix.shape[1]:
+                raise ValueError(f"ANN index at {path} does not match the embedding store")
+            return cls(matrix, data['centroids'], data['list_offsets'], data['list_ids'], nprobe=nprobe)
+
+    def candidates(self, query, nprobe):
+        probe = top_k_indices(self.centroids @ query, nprobe)
+        return np.concatenate([self.list_ids[self.list_offsets[c]:self.list_offsets[c + 1]]
+                               for c in probe])
+
+    def search(self, features, k=1, threshold=None, nprobe=None):
+        '''
+        Approximate top-k search.
+        Input : features - 1-D query embedding
+                k - number of matches to return
+                threshold - drop matches scoring below this cosine similarity
+                nprobe - lists to scan, defaults to the configured value
+        Output : list of (index_pos, score) tuples, best first
+        '''
+        query = normalize_rows(np.reshape(features, (1, -1)))[0]
+        ids = np.sort(self.candidates(query, nprobe or self.nprobe))
+        scores = np.asarray(self.matrix[ids], dtype=np.float32) @ query
+        order = top_k_indices(scores, k)
+        matches = [(int(ids[i]), float(scores[i])) for i in order]
+        if threshold is not None:
+            matches = [m for m in matches if m[1] >= threshold]
+        return matches
+
+    def search_batch(self, queries, k=1, threshold=None):
+        # Each query probes its own lists, so candidates are scored per query
+        return [self.search(query, k=k, threshold=threshold) for query in queries]
+
+
+def get_ann_index_path(config : dict, base_dir : str = '') -> str :
+    '''
+    Location of the ANN index described by config.yaml
+    '''
+    artifacts = config['artifacts']
+    return os.path.join(base_dir, artifacts['artifacts_dir'],
+                        artifacts['feature_extraction_dir'],
+                        artifacts['ann_index_name'])
+
+
+def load_search_index(store, config, params):
+    '''
+    Search index for the servers: shard servers when sharding is enabled,
+    the IVF index when it is enabled in params.yaml and present on disk,
+    then identity centroids, then compressed codes when the store has
+    them, exact search otherwise
+    '''
+    from src.utils.identity_index import IdentityIndex
+    from src.utils.sharding import ShardedSearch, shard_endpoints
+    sharding = params['sharding']
+    if sharding['enabled']:
+        endpoints = shard_endpoints(sharding)
+        logging.info(f"Using {len(endpoints)} search shards (timeout={sharding['timeout_ms']}ms)")
+        return ShardedSearch(endpoints, store.version, timeout_ms=sharding['timeout_ms'],
+                             min_shards=sharding['min_shards'])
+    ann = params['ann']
+    ann_index_path = get_ann_index_path(config)
+    if ann['enabled'] and os.path.exists(ann_index_path):
+        try:
+            index = IVFIndex.load(ann_index_path, store.matrix, store.version, nprobe=ann['nprobe'])
+            logging.info(f"Using IVF index from {ann_index_path} (nprobe={ann['nprobe']})")
+            return index
+        except ValueError as e:
+            logging.warning(f"{e}; falling back to exact search")
+    identity = params['identity']
+    if identity['enabled']:
+        try:
+            index = IdentityIndex.load(store.store_dir, store.matrix, store.version,
+                                       top_m=identity['top_m'], centroid_only=identity['centroid_only'])
+            logging.info(f"Using identity centroid search (top_m={identity['top_m']}, "
+                         f"centroid_only={identity['centroid_only']})")
+            if store.codes is not None:
+                logging.warning(f"Identity search overrides {store.codec.method} compressed search; "
+                                f"set identity.enabled to False to search the compressed codes")
+            return index
+        except (FileNotFoundError, ValueError) as e:
+            logging.warning(f"Identity centroids unavailable: {e}")
+    if store.codes is not None:
+        rerank = params['compression']['rerank']
+        logging.info(f"Using {store.codec.method} compressed search (rerank={rerank})")
+        return CompressedSearch(store.codes, store.codec, store.matrix, rerank=rerank)
+    return SimilaritySearch(store.matrix, normalized=True)
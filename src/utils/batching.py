@@ -0,0 +1,88 @@
+import asyncio
+import logging
+import time
+from collections import Counter
+import numpy as np
+
+
+class InferenceBatcher:
+    '''
+    Dynamic micro-batching for model inference in an asyncio server.
+    Requests submit single preprocessed inputs; a background task gathers
+    them until max_batch_size is reached or max_wait_ms has passed since
+    the first one arrived, runs one predict call for the whole batch in
+    a worker thread and resolves every request's future with its row.
+    '''
+
+    def __init__(self, predict_fn, max_batch_size=16, max_wait_ms=5):
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.batch_sizes = Counter()
+        self.batches_run = 0
+        self._queue = None
+        self._task = None
+
+    def start(self):
+        self._queue = asyncio.Queue()
+        self._task = asyncio.get_running_loop().create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    @property
+    def queue_depth(self):
+        return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self):
+        return {
+            'queue_depth': self.queue_depth,
+            'batches_run': self.batches_run,
+            'batch_size_distribution': dict(sorted(self.batch_sizes.items())),
+        }
+
+    async def submit(self, item):
+        '''
+        Queue one model input (without a batch axis) and wait for its output row
+        '''
+        future = asyncio.get_running_loop().create_future()
+        await self._queue.put((item, future))
+        return await future
+
+    async def _collect(self):
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect()
+            items = np.stack([item for item, _ in batch])
+            self.batch_sizes[len(batch)] += 1
+            self.batches_run += 1
+            try:
+                outputs = await loop.run_in_executor(None, self.predict_fn, items)
+            except Exception as e:
+                logging.exception("Batched inference failed")
+                for _, future in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for (_, future), output in zip(batch, outputs):
+                if not future.done():
+                    future.set_result(output)
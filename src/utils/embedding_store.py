@@ -0,0 +1,173 @@
+import json
+import logging
+import os
+import time
+import numpy as np
+from src.utils.quantization import load_compressed
+from src.utils.search import normalize_rows
+
+EMBEDDINGS_FILE = 'embeddings.npy'
+HEADER_FILE = 'header.json'
+MANIFEST_FILE = 'manifest.tsv'
+BUILD_PATTERN = ('embeddings_{}.npy', 'manifest_{}.tsv')
+FORMAT_VERSION = 1
+
+
+def label_from_path(path : str) -> str :
+    '''
+    Celebrity label for a gallery image, taken from its parent folder
+    '''
+    return os.path.basename(os.path.dirname(path)).replace('_', ' ')
+
+
+def store_version(header : dict) -> str :
+    '''
+    Identifies one build of a store; every artifact derived from the
+    store records it so a mismatched pair is never served together
+    '''
+    return f"{header['model_name']}/{header['pooling']}/{header.get('built_at', 0)}"
+
+
+def get_store_dir(config : dict, base_dir : str = '') -> str :
+    '''
+    Location of the embedding store described by config.yaml
+    '''
+    artifacts = config['artifacts']
+    return os.path.join(base_dir, artifacts['artifacts_dir'],
+                        artifacts['feature_extraction_dir'],
+                        artifacts['embedding_store_dir'])
+
+
+def write_embedding_store(store_dir, features, filenames, model_name, pooling):
+    '''
+    Write gallery embeddings as one contiguous float32 .npy matrix plus
+    a header and a filename/label manifest aligned row-for-row.
+    Rows are L2-normalized on write so readers can memory-map them
+    and search without making a private copy.
+    Input : store_dir - directory to write the store into
+            features - 2-D array or list of 1-D embeddings
+            filenames - gallery image paths, one per embedding
+            model_name, pooling - VGGFace settings that produced the embeddings
+    Output : header dict that was written
+    '''
+    if len(features) != len(filenames):
+        raise ValueError(f"Got {len(features)} embeddings for {len(filenames)} filenames")
+    if isinstance(features, np.ndarray):
+        matrix = features.reshape(len(features), -1)
+    else:
+        matrix = np.vstack([np.ravel(f) for f in features])
+    matrix = normalize_rows(matrix)
+
+    # Every build writes its matrix and manifest under new names and the
+    # header, replaced last, points at them. Readers always see a header
+    # and data files of the same build, whenever they look.
+    os.makedirs(store_dir, exist_ok=True)
+    built_at = time.time()
+    build_id = f"{time.time_ns():x}"
+    embeddings_file, manifest_file = (name.format(build_id) for name in BUILD_PATTERN)
+    embeddings_path = os.path.join(store_dir, embeddings_file)
+    manifest_path = os.path.join(store_dir, manifest_file)
+    header_path = os.path.join(store_dir, HEADER_FILE)
+
+    np.save(embeddings_path + '.tmp.npy', matrix)
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        for filename in filenames:
+            f.write(f"{filename}\t{label_from_path(filename)}\n")
+    os.replace(embeddings_path + '.tmp.npy', embeddings_path)
+    os.replace(manifest_path + '.tmp', manifest_path)
+
+    header = {
+        'format_version': FORMAT_VERSION,
+        'count': int(matrix.shape[0]),
+        'dim': int(matrix.shape[1]),
+        'dtype': str(matrix.dtype),
+        'normalized': True,
+        'model_name': model_name,
+        'pooling': pooling,
+        'built_at': built_at,
+        'embeddings_file': embeddings_file,
+        'manifest_file': manifest_file,
+    }
+    previous = _data_files(store_dir)
+    with open(header_path + '.tmp', 'w') as f:
+        json.dump(header, f, indent=2)
+    os.replace(header_path + '.tmp', header_path)
+
+    # Keep the previous build's files for readers that read its header just
+    # before the swap; anything older is unreachable
+    keep = {embeddings_file, manifest_file, *previous}
+    for name in os.listdir(store_dir):
+        stale = name in (EMBEDDINGS_FILE, MANIFEST_FILE) or (
+            name.startswith(('embeddings_', 'manifest_')) and name.endswith(('.npy', '.tsv')))
+        if stale and name not in keep:
+            os.remove(os.path.join(store_dir, name))
+    logging.info(f"Wrote {header['count']} embeddings of dim {header['dim']} to {store_dir}")
+    return header
+
+
+def _data_files(store_dir : str) -> tuple :
+    '''
+    Matrix and manifest file names of the build the header in store_dir
+    points at, the fixed names for stores written before builds had their own
+    '''
+    try:
+        with open(os.path.join(store_dir, HEADER_FILE)) as f:
+            header = json.load(f)
+    except (OSError, ValueError):
+        return ()
+    return header.get('embeddings_file', EMBEDDINGS_FILE), header.get('manifest_file', MANIFEST_FILE)
+
+
+class EmbeddingStore:
+    '''
+    Read-only view of an embedding store written by write_embedding_store.
+    The matrix is memory-mapped, so opening is near instant and the
+    OS page cache is shared between every process that opens it.
+    Stores written with compression also expose their codes and codec.
+    '''
+
+    def __init__(self, matrix, filenames, labels, header, codes=None, codec=None, store_dir=None):
+        self.store_dir = store_dir
+        self.matrix = matrix
+        self.filenames = filenames
+        self.labels = labels
+        self.header = header
+        self.codes = codes
+        self.codec = codec
+
+    def __len__(self):
+        return len(self.filenames)
+
+    @property
+    def version(self):
+        '''
+        Identifies this build of the store, for invalidating derived caches
+        '''
+        return store_version(self.header)
+
+    @classmethod
+    def open(cls, store_dir, mmap_mode='r'):
+        header_path = os.path.join(store_dir, HEADER_FILE)
+        if not os.path.exists(header_path):
+            raise FileNotFoundError(f"No embedding store found at {store_dir}")
+        with open(header_path) as f:
+            header = json.load(f)
+
+        embeddings_file = header.get('embeddings_file', EMBEDDINGS_FILE)
+        manifest_file = header.get('manifest_file', MANIFEST_FILE)
+        matrix = np.load(os.path.join(store_dir, embeddings_file), mmap_mode=mmap_mode)
+        filenames, labels = [], []
+        with open(os.path.join(store_dir, manifest_file), encoding='utf-8') as f:
+            for line in f:
+                filename, label = line.rstrip('\n').split('\t')
+                filenames.append(filename)
+                labels.append(label)
+
+        if matrix.shape != (header['count'], header['dim']) or len(filenames) != header['count']:
+            raise ValueError(f"Embedding store at {store_dir} is inconsistent with its header")
+        codes, codec = load_compressed(store_dir, store_version(header), mmap_mode=mmap_mode)
+        if codes is not None and codes.shape[0] != header['count']:
+            logging.warning(f"Ignoring stale compressed codes in {store_dir}")
+            codes, codec = None, None
+        logging.info(f"Opened embedding store with {len(filenames)} rows from {store_dir}")
+        return cls(matrix, filenames, labels, header, codes=codes, codec=codec, store_dir=store_dir)
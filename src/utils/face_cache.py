@@ -0,0 +1,128 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import numpy as np
+from src.utils.feature_cache import HASH_INDEX_FILE, hash_files
+
+SHARD_PATTERN = 'detections_{:06d}.npz'
+STATUS_NAMES = ('ok', 'no_face', 'multiple_faces', 'unreadable')
+STATUS_OK, STATUS_NO_FACE, STATUS_MULTIPLE, STATUS_UNREADABLE = range(len(STATUS_NAMES))
+
+
+def detector_tag(detection : dict) -> str :
+    '''
+    Name of the cache namespace for a detection section of params.yaml;
+    any setting that can move a box gets its own namespace
+    '''
+    digest = hashlib.sha1(json.dumps(detection, sort_keys=True, default=str).encode()).hexdigest()
+    return f"faces_{detection['backend']}_{digest[:10]}"
+
+
+def get_face_cache_dir(config : dict, params : dict, base_dir : str = '') -> str :
+    '''
+    Location of the face detections for the detector configured in params.yaml.
+    It lives in the feature cache root, so both share one file hash index.
+    '''
+    artifacts = config['artifacts']
+    return os.path.join(base_dir, artifacts['artifacts_dir'], artifacts['feature_extraction_dir'],
+                        artifacts['feature_cache_dir'], detector_tag(params['detection']))
+
+
+class FaceCache:
+    '''
+    Face detections for gallery images keyed by image content hash, so a
+    new model, pooling or compression re-embeds the crops without
+    running the detector again. Each image has one row in a compact
+    checkpoint shard (.npz): status (see STATUS_NAMES), number of faces
+    found, and the box (x, y, width, height), confidence and (5, 2)
+    landmarks of the most confident face. Landmarks are NaN for detectors
+    without them. Every checkpoint writes only the new rows as a new
+    shard, so an interrupted run resumes from the last completed shard.
+    Images with no face or several faces are kept with their status so
+    stage 02 can leave them out of the index.
+    '''
+
+    def __init__(self, cache_dir):
+        self.cache_dir = cache_dir
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.hash_index_path = os.path.join(os.path.dirname(cache_dir), HASH_INDEX_FILE)
+        self._shards = []
+        self._rows = {}
+        self._next_shard = 0
+        for shard_path in sorted(glob.glob(os.path.join(self.cache_dir, 'detections_*.npz'))):
+            try:
+                seq = int(os.path.basename(shard_path)[len('detections_'):-len('.npz')])
+            except ValueError:
+                logging.warning(f"Ignoring unexpected file {shard_path} in the face cache")
+                continue
+            with np.load(shard_path) as shard:
+                arrays = {name: shard[name] for name in shard.files}
+            for row, content_hash in enumerate(arrays['hashes']):
+                self._rows[content_hash.decode()] = (len(self._shards), row)
+            self._shards.append(arrays)
+            self._next_shard = max(self._next_shard, seq + 1)
+        self._pending = []
+        logging.info(f"Face cache at {self.cache_dir} holds {len(self._rows)} images")
+
+    def __contains__(self, content_hash):
+        return content_hash in self._rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def hash_files(self, filenames, stats=None):
+        return hash_files(filenames, self.hash_index_path, stats=stats)
+
+    def get(self, content_hash):
+        '''
+        Output : (status, num_faces, box, confidence, landmarks) or None
+        '''
+        location = self._rows.get(content_hash)
+        if location is None:
+            return None
+        shard, row = location
+        if shard is None:
+            return self._pending[row][1:]
+        arrays = self._shards[shard]
+        return (int(arrays['status'][row]), int(arrays['num_faces'][row]),
+                tuple(int(v) for v in arrays['boxes'][row]), float(arrays['confidence'][row]),
+                arrays['landmarks'][row])
+
+    def add(self, content_hash, status, num_faces=0, box=None, confidence=0.0, landmarks=None):
+        '''
+        Queue the detection result of one image for the next checkpoint
+        '''
+        if content_hash in self._rows:
+            return
+        self._rows[content_hash] = (None, len(self._pending))
+        self._pending.append((content_hash, status, num_faces, box or (0, 0, 0, 0), confidence,
+                              np.full((5, 2), np.nan, dtype=np.float32) if landmarks is None else landmarks))
+
+    @property
+    def pending(self):
+        return len(self._pending)
+
+    def checkpoint(self):
+        '''
+        Atomically write the queued results as a new shard
+        '''
+        if not self._pending:
+            return
+        hashes, status, num_faces, boxes, confidence, landmarks = zip(*self._pending)
+        arrays = {'hashes': np.array(hashes, dtype='S40'), 'status': np.array(status, dtype=np.uint8),
+                  'num_faces': np.array(num_faces, dtype=np.uint16),
+                  'boxes': np.array(boxes, dtype=np.int32).reshape(-1, 4),
+                  'confidence': np.array(confidence, dtype=np.float32),
+                  'landmarks': np.stack(landmarks).astype(np.float32)}
+        shard_path = os.path.join(self.cache_dir, SHARD_PATTERN.format(self._next_shard))
+        tmp_path = shard_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(tmp_path, shard_path)
+        for row, content_hash in enumerate(hashes):
+            self._rows[content_hash] = (len(self._shards), row)
+        self._shards.append(arrays)
+        self._next_shard += 1
+        self._pending = []
@@ -0,0 +1,153 @@
+import logging
+import threading
+import cv2
+import numpy as np
+from PIL import Image
+
+LANDMARK_NAMES = ('left_eye', 'right_eye', 'nose', 'mouth_left', 'mouth_right')
+
+
+def pad_and_clamp(box, img_shape, padding=0.0):
+    '''
+    Grow a (x, y, width, height) box by padding * its size on every side
+    and clamp it to the image, so crops never start at negative
+    coordinates (MTCNN can return those near the border)
+    '''
+    x, y, width, height = box
+    pad_x, pad_y = int(round(width * padding)), int(round(height * padding))
+    img_height, img_width = img_shape[:2]
+    x0, y0 = max(0, x - pad_x), max(0, y - pad_y)
+    x1, y1 = min(img_width, x + width + pad_x), min(img_height, y + height + pad_y)
+    return x0, y0, max(0, x1 - x0), max(0, y1 - y0)
+
+
+def box_iou(a, b):
+    '''
+    Intersection over union of two (x, y, width, height) boxes
+    '''
+    ax1, ay1, bx1, by1 = a[0] + a[2], a[1] + a[3], b[0] + b[2], b[1] + b[3]
+    inter = max(0, min(ax1, bx1) - max(a[0], b[0])) * max(0, min(ay1, by1) - max(a[1], b[1]))
+    union = a[2] * a[3] + b[2] * b[3] - inter
+    return inter / union if union else 0.0
+
+
+def face_array(img, box, size=224):
+    '''
+    Crop a face box and resize it to the model input, the same way for
+    queries and gallery images so both come from one distribution
+    '''
+    x, y, width, height = box
+    face = Image.fromarray(img[y:y + height, x:x + width]).resize((size, size))
+    return np.asarray(face).astype('float32')
+
+
+class MTCNNDetector:
+    def __init__(self, detection):
+        from mtcnn import MTCNN
+        self.detector = MTCNN()
+
+    def detect(self, img):
+        return [(tuple(r['box']), float(r['confidence']),
+                 np.array([r['keypoints'][name] for name in LANDMARK_NAMES], dtype=np.float32))
+                for r in self.detector.detect_faces(img)]
+
+
+class OpenCVDNNDetector:
+    '''
+    OpenCV's ResNet-10 SSD face detector (Caffe weights from params.yaml).
+    A cv2.dnn Net keeps its input as state, so setInput/forward are
+    serialized for callers on several threads.
+    '''
+
+    def __init__(self, detection):
+        self.net = cv2.dnn.readNetFromCaffe(detection['dnn_prototxt'], detection['dnn_weights'])
+        self._lock = threading.Lock()
+
+    def detect(self, img):
+        height, width = img.shape[:2]
+        blob = cv2.dnn.blobFromImage(cv2.resize(img, (300, 300)), 1.0, (300, 300),
+                                     (104.0, 177.0, 123.0))
+        with self._lock:
+            self.net.setInput(blob)
+            detections = self.net.forward()[0, 0]
+        faces = []
+        for detection in detections:
+            confidence = float(detection[2])
+            x0, y0, x1, y1 = (detection[3:7] * np.array([width, height, width, height])).astype(int)
+            faces.append(((int(x0), int(y0), int(x1 - x0), int(y1 - y0)), confidence, None))
+        return faces
+
+
+class HaarDetector:
+    '''
+    OpenCV Haar cascade; very fast, no confidence scores
+    '''
+
+    def __init__(self, detection):
+        self.cascade = cv2.CascadeClassifier(cv2.data.haarcascades + 'haarcascade_frontalface_default.xml')
+
+    def detect(self, img):
+        gray = cv2.cvtColor(img, cv2.COLOR_BGR2GRAY)
+        boxes = self.cascade.detectMultiScale(gray, scaleFactor=1.1, minNeighbors=5)
+        # Largest face first, standing in for confidence
+        boxes = sorted(boxes, key=lambda b: b[2] * b[3], reverse=True)
+        return [(tuple(int(v) for v in box), 1.0, None) for box in boxes]
+
+
+BACKENDS = {
+    'mtcnn': MTCNNDetector,
+    'opencv_dnn': OpenCVDNNDetector,
+    'haar': HaarDetector,
+}
+
+
+class FaceDetector:
+    '''
+    Face detection front end selected by the detection section of
+    params.yaml. Optionally detects on a copy downscaled to
+    detect_max_side and maps the boxes back to full resolution, so the
+    crop keeps all the original pixels.
+    detect() returns (box, confidence) pairs, most confident first,
+    with boxes padded and clamped to the image. detect_landmarks() adds
+    the five LANDMARK_NAMES points as a (5, 2) array, or None for
+    backends that do not predict them.
+    '''
+
+    def __init__(self, detection : dict):
+        backend = detection['backend']
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown face detector {backend!r}, expected one of {sorted(BACKENDS)}")
+        self.backend = BACKENDS[backend](detection)
+        self.name = backend
+        self.max_side = detection['detect_max_side']
+        self.padding = detection['box_padding']
+        self.min_confidence = detection['min_confidence']
+        logging.info(f"Using {backend} face detector (detect_max_side={self.max_side})")
+
+    def detect_landmarks(self, img):
+        scale = 1.0
+        small = img
+        if self.max_side and max(img.shape[:2]) > self.max_side:
+            scale = self.max_side / max(img.shape[:2])
+            small = cv2.resize(img, (round(img.shape[1] * scale), round(img.shape[0] * scale)),
+                               interpolation=cv2.INTER_AREA)
+
+        faces = []
+        for box, confidence, landmarks in self.backend.detect(small):
+            if confidence < self.min_confidence:
+                continue
+            full_box = tuple(int(round(v / scale)) for v in box)
+            full_box = pad_and_clamp(full_box, img.shape, self.padding)
+            if landmarks is not None:
+                landmarks = landmarks / scale
+            if full_box[2] > 0 and full_box[3] > 0:
+                faces.append((full_box, confidence, landmarks))
+        faces.sort(key=lambda face: face[1], reverse=True)
+        return faces
+
+    def detect(self, img):
+        return [(box, confidence) for box, confidence, _ in self.detect_landmarks(img)]
+
+    def crop(self, img, box):
+        x, y, width, height = box
+        return img[y:y + height, x:x + width]
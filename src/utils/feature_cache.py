@@ -0,0 +1,204 @@
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import numpy as np
+
+HASH_INDEX_FILE = 'file_hashes.json'
+SHARD_PATTERN = 'shard_{:02d}_{:06d}.npz'
+SHARD_NAME_RE = re.compile(r'shard_(\d+)_(\d+)\.npz')
+
+
+def file_content_hash(path : str, chunk_size : int = 1 << 20) -> str :
+    '''
+    sha1 of the file contents, read in chunks
+    '''
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def hash_files(filenames, hash_index_path, merge=False, stats=None):
+    '''
+    Content hash for every file, re-reading only files whose size or
+    mtime changed since the index at hash_index_path was written.
+    Missing files hash to None. The index is rewritten with just these
+    files, or with merge=True updated in place so entries for other
+    files (e.g. images not in the embedding store) are kept.
+    stats optionally gives (size, mtime_ns) per file, e.g. from the
+    gallery manifest, in place of an os.stat call; None entries are
+    still stat-ed.
+    '''
+    hash_index = {}
+    if os.path.exists(hash_index_path):
+        with open(hash_index_path) as f:
+            hash_index = json.load(f)
+    hashes = []
+    rehashed = 0
+    new_index = dict(hash_index) if merge else {}
+    for i, path in enumerate(filenames):
+        known = stats[i] if stats is not None else None
+        if known is None:
+            try:
+                stat = os.stat(path)
+            except OSError:
+                hashes.append(None)
+                continue
+            known = (stat.st_size, stat.st_mtime_ns)
+        size, mtime_ns = known
+        cached = hash_index.get(path)
+        if cached and cached[0] == size and cached[1] == mtime_ns:
+            content_hash = cached[2]
+        else:
+            try:
+                content_hash = file_content_hash(path)
+            except OSError:
+                hashes.append(None)
+                continue
+            rehashed += 1
+        new_index[path] = [size, mtime_ns, content_hash]
+        hashes.append(content_hash)
+
+    tmp_path = hash_index_path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(new_index, f)
+    os.replace(tmp_path, hash_index_path)
+    logging.info(f"Hashed {len(filenames)} files ({rehashed} read from disk)")
+    return hashes
+
+
+class FeatureCache:
+    '''
+    Persistent cache of gallery embeddings keyed by image content hash.
+    Each model/pooling pair gets its own namespace directory holding
+    checkpoint shards (.npz files of hashes + features). Shards are
+    written atomically as extraction progresses, so an interrupted run
+    resumes from the last completed shard.
+    Every writer process gets its own shard sequence (writer_id), so
+    several extraction workers can checkpoint into one cache.
+    A stat-keyed hash index avoids re-reading unchanged files.
+    '''
+
+    def __init__(self, cache_root, model_name, pooling, writer_id=0):
+        self.cache_dir = os.path.join(cache_root, f"{model_name}_{pooling}")
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.hash_index_path = os.path.join(cache_root, HASH_INDEX_FILE)
+        self.writer_id = writer_id
+        self._locations = {}
+        self._next_shard = 0
+        for shard_path in sorted(glob.glob(os.path.join(self.cache_dir, 'shard_*'))):
+            shard_name = os.path.basename(shard_path)
+            match = SHARD_NAME_RE.fullmatch(shard_name)
+            if match is None:
+                # Leftover of a checkpoint interrupted before its rename. Only this
+                # writer's own files are removed, other writers may be mid-checkpoint.
+                if shard_name.startswith(f"shard_{writer_id:02d}_"):
+                    logging.warning(f"Removing incomplete checkpoint {shard_path}")
+                    os.remove(shard_path)
+                continue
+            with np.load(shard_path) as shard:
+                for row, content_hash in enumerate(shard['hashes']):
+                    self._locations[str(content_hash)] = (shard_name, row)
+            if int(match.group(1)) == writer_id:
+                self._next_shard = max(self._next_shard, int(match.group(2)) + 1)
+        self._pending_hashes = []
+        self._pending_features = []
+        self._pending_set = set()
+        logging.info(f"Feature cache at {self.cache_dir} holds {len(self._locations)} embeddings")
+
+    def _shard_path(self, shard_name):
+        return os.path.join(self.cache_dir, shard_name)
+
+    def __contains__(self, content_hash):
+        return content_hash in self._locations
+
+    def hash_files(self, filenames, stats=None):
+        return hash_files(filenames, self.hash_index_path, stats=stats)
+
+    def add(self, content_hashes, features):
+        '''
+        Queue embeddings for the next checkpoint shard
+        '''
+        for content_hash, feature in zip(content_hashes, features):
+            if content_hash not in self._locations and content_hash not in self._pending_set:
+                self._pending_set.add(content_hash)
+                self._pending_hashes.append(content_hash)
+                self._pending_features.append(np.ravel(feature).astype(np.float32))
+
+    @property
+    def pending(self):
+        return len(self._pending_hashes)
+
+    def checkpoint(self):
+        '''
+        Atomically write queued embeddings as a new shard
+        '''
+        if not self._pending_hashes:
+            return
+        shard_name = SHARD_PATTERN.format(self.writer_id, self._next_shard)
+        shard_path = self._shard_path(shard_name)
+        tmp_path = shard_path + '.tmp'
+        with open(tmp_path, 'wb') as f:
+            np.savez(f, hashes=np.array(self._pending_hashes),
+                     features=np.vstack(self._pending_features))
+        os.replace(tmp_path, shard_path)
+        for row, content_hash in enumerate(self._pending_hashes):
+            self._locations[content_hash] = (shard_name, row)
+        logging.info(f"Checkpointed {len(self._pending_hashes)} embeddings to {shard_path}")
+        self._next_shard += 1
+        self._pending_hashes, self._pending_features = [], []
+        self._pending_set = set()
+
+    def gather(self, content_hashes):
+        '''
+        Stack cached embeddings in the order of content_hashes,
+        loading each shard once
+        '''
+        by_shard = {}
+        for out_row, content_hash in enumerate(content_hashes):
+            shard_name, row = self._locations[content_hash]
+            by_shard.setdefault(shard_name, []).append((out_row, row))
+
+        result = None
+        for shard_name, rows in by_shard.items():
+            with np.load(self._shard_path(shard_name)) as shard:
+                features = shard['features']
+            if result is None:
+                result = np.empty((len(content_hashes), features.shape[1]), dtype=np.float32)
+            out_rows, shard_rows = zip(*rows)
+            result[list(out_rows)] = features[list(shard_rows)]
+        return result
+
+    def prune(self, live_hashes):
+        '''
+        Rewrite shards holding embeddings for images no longer in the
+        gallery, dropping the dead rows
+        '''
+        live_hashes = set(live_hashes)
+        dead_by_shard = {}
+        for content_hash, (shard_name, _) in self._locations.items():
+            if content_hash not in live_hashes:
+                dead_by_shard[shard_name] = dead_by_shard.get(shard_name, 0) + 1
+
+        for shard_name in dead_by_shard:
+            shard_path = self._shard_path(shard_name)
+            with np.load(shard_path) as shard:
+                hashes, features = shard['hashes'], shard['features']
+            keep = np.array([str(h) in live_hashes for h in hashes])
+            for content_hash in hashes[~keep]:
+                self._locations.pop(str(content_hash), None)
+            if keep.any():
+                tmp_path = shard_path + '.tmp'
+                with open(tmp_path, 'wb') as f:
+                    np.savez(f, hashes=hashes[keep], features=features[keep])
+                os.replace(tmp_path, shard_path)
+                for row, content_hash in enumerate(hashes[keep]):
+                    self._locations[str(content_hash)] = (shard_name, row)
+            else:
+                os.remove(shard_path)
+        if dead_by_shard:
+            logging.info(f"Pruned {sum(dead_by_shard.values())} stale embeddings from the feature cache")
@@ -0,0 +1,171 @@
+import json
+import logging
+import os
+import pickle
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+from src.utils.embedding_store import label_from_path
+
+EXTENSION_FORMATS = {'.jpg': 'JPEG', '.jpeg': 'JPEG', '.png': 'PNG', '.bmp': 'BMP',
+                     '.gif': 'GIF', '.webp': 'WEBP'}
+
+
+def sniff_format(head : bytes) :
+    '''
+    Image format from the first bytes of a file, or None
+    '''
+    if head.startswith(b'\xff\xd8\xff'):
+        return 'JPEG'
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return 'PNG'
+    if head.startswith(b'BM'):
+        return 'BMP'
+    if head[:6] in (b'GIF87a', b'GIF89a'):
+        return 'GIF'
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'WEBP'
+    return None
+
+
+def _scan_identity(identity_dir, formats):
+    '''
+    Records for the images in one identity folder, and skip counts
+    '''
+    records, skipped = [], Counter()
+    with os.scandir(identity_dir) as entries:
+        entries = sorted(entries, key=lambda entry: entry.name)
+    for entry in entries:
+        if not entry.is_file():
+            skipped['not a file'] += 1
+            continue
+        if EXTENSION_FORMATS.get(os.path.splitext(entry.name)[1].lower()) not in formats:
+            skipped['extension'] += 1
+            continue
+        try:
+            stat = entry.stat()
+            with open(entry.path, 'rb') as f:
+                if sniff_format(f.read(16)) not in formats:
+                    skipped['magic'] += 1
+                    continue
+                f.seek(0)
+                # Image.open only parses the header; no pixels are decoded
+                with Image.open(f) as img:
+                    width, height = img.size
+        except Exception as e:
+            skipped['unreadable'] += 1
+            logging.warning(f"Skipped {entry.path}: {str(e)}")
+            continue
+        records.append({'path': entry.path, 'label': label_from_path(entry.path), 'size': stat.st_size,
+                        'mtime_ns': stat.st_mtime_ns, 'width': width, 'height': height})
+    return records, skipped
+
+
+def scan_gallery(data_path, extensions, num_workers=8, max_in_flight=None):
+    '''
+    Walk data_path/<identity>/<image> with os.scandir, one identity
+    folder per thread, and yield a record per image in a deterministic order
+    (identities and file names sorted). Files are kept when both their
+    extension and their magic bytes are an allowed image format; width
+    and height come from the image header. At most max_in_flight folders
+    are scanned ahead of the consumer, so memory stays bounded.
+    Input : data_path - gallery root with one folder per identity
+            extensions - allowed file extensions, e.g. ['.jpg', '.png']
+    Output : generator of (record, None), ending with (None, skip counts)
+    '''
+    formats = {EXTENSION_FORMATS[ext.lower()] for ext in extensions}
+    with os.scandir(data_path) as entries:
+        identities = sorted(entry.path for entry in entries if entry.is_dir())
+    max_in_flight = max_in_flight or num_workers * 4
+
+    skipped = Counter()
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        pending = deque()
+        identity_iter = iter(identities)
+
+        def refill():
+            for path in identity_iter:
+                pending.append(pool.submit(_scan_identity, path, formats))
+                if len(pending) >= max_in_flight:
+                    break
+
+        refill()
+        while pending:
+            records, identity_skipped = pending.popleft().result()
+            refill()
+            skipped.update(identity_skipped)
+            for record in records:
+                yield record, None
+    yield None, dict(skipped)
+
+
+def write_manifest(records, manifest_path):
+    '''
+    Stream records into a JSON-lines manifest, replaced atomically
+    Output : number of records written
+    '''
+    os.makedirs(os.path.dirname(manifest_path) or '.', exist_ok=True)
+    count = 0
+    with open(manifest_path + '.tmp', 'w', encoding='utf-8') as f:
+        for record in records:
+            f.write(json.dumps(record) + '\n')
+            count += 1
+    os.replace(manifest_path + '.tmp', manifest_path)
+    return count
+
+
+def iter_manifest(manifest_path):
+    '''
+    Lazily yield the records of a manifest written by write_manifest
+    '''
+    with open(manifest_path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+
+def get_manifest_path(config, base_dir=''):
+    artifacts = config['artifacts']
+    return os.path.join(base_dir, artifacts['artifacts_dir'], artifacts['pickle_format_data_dir'],
+                        artifacts['gallery_manifest_name'])
+
+
+def iter_gallery_records(config, base_dir=''):
+    '''
+    Manifest records in gallery order, streamed from the stage 01 manifest.
+    Falls back to an img_pickle_file.pkl left by older runs, whose
+    records only have a path.
+    '''
+    manifest_path = get_manifest_path(config, base_dir)
+    if os.path.exists(manifest_path):
+        yield from iter_manifest(manifest_path)
+        return
+    artifacts = config['artifacts']
+    pickle_file = os.path.join(base_dir, artifacts['artifacts_dir'], artifacts['pickle_format_data_dir'],
+                               artifacts['img_pickle_file_name'])
+    if not os.path.exists(pickle_file):
+        raise FileNotFoundError(f"Gallery manifest not found at {manifest_path}, run stage 01 first")
+    with open(pickle_file, 'rb') as f:
+        for path in pickle.load(f):
+            yield {'path': path}
+
+
+def load_gallery_paths(config, base_dir=''):
+    '''
+    Image paths in gallery order and the (size, mtime_ns) stage 01 saw
+    for each (None for pickle records), so the hash index can skip an
+    os.stat per image
+    '''
+    filenames, stats = [], []
+    for record in iter_gallery_records(config, base_dir):
+        filenames.append(record['path'])
+        stats.append((record['size'], record['mtime_ns']) if 'mtime_ns' in record else None)
+    return filenames, stats
+
+
+def iter_gallery_paths(config, base_dir=''):
+    '''
+    Image paths in gallery order, streamed from the stage 01 manifest
+    '''
+    for record in iter_gallery_records(config, base_dir):
+        yield record['path']
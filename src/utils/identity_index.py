@@ -0,0 +1,90 @@
+import logging
+import os
+import numpy as np
+from src.utils.ann_index import IVFIndex
+from src.utils.search import normalize_rows, top_k_indices
+
+IDENTITIES_FILE = 'identities.npz'
+CHUNK_ROWS = 65536
+
+
+def write_identity_centroids(store_dir, matrix, labels, store_version):
+    '''
+    Per-identity centroids of the normalized gallery embeddings.
+    Input : store_dir - embedding store directory to write into
+            matrix - normalized gallery rows
+            labels - identity label of each row
+            store_version - version of the embedding store the rows come from
+    Output : Save identities.npz with the centroid matrix, image counts,
+             member rows of every identity and its representative image
+    '''
+    names, assignments = np.unique(np.asarray(labels), return_inverse=True)
+    counts = np.bincount(assignments, minlength=len(names))
+    sums = np.zeros((len(names), matrix.shape[1]), dtype=np.float32)
+    for start in range(0, matrix.shape[0], CHUNK_ROWS):
+        # Sort the chunk by identity and sum each run of rows at once
+        chunk_assignments = assignments[start:start + CHUNK_ROWS]
+        order = np.argsort(chunk_assignments, kind='stable')
+        ids, run_starts = np.unique(chunk_assignments[order], return_index=True)
+        chunk = np.asarray(matrix[start:start + CHUNK_ROWS], dtype=np.float32)[order]
+        sums[ids] += np.add.reduceat(chunk, run_starts, axis=0)
+    centroids = normalize_rows(sums)
+
+    list_ids = np.argsort(assignments, kind='stable').astype(np.int64)
+    list_offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    # Representative image: the member closest to its identity centroid
+    member_scores = np.empty(len(list_ids), dtype=np.float32)
+    for start in range(0, len(list_ids), CHUNK_ROWS):
+        rows = list_ids[start:start + CHUNK_ROWS]
+        member_scores[start:start + CHUNK_ROWS] = np.einsum(
+            'ij,ij->i', np.asarray(matrix[rows], dtype=np.float32), centroids[assignments[rows]])
+    representatives = np.array([list_ids[lo + np.argmax(member_scores[lo:hi])]
+                                for lo, hi in zip(list_offsets[:-1], list_offsets[1:])], dtype=np.int64)
+
+    path = os.path.join(store_dir, IDENTITIES_FILE)
+    with open(path + '.tmp', 'wb') as f:
+        np.savez(f, names=names, counts=counts, centroids=centroids, list_offsets=list_offsets,
+                 list_ids=list_ids, representatives=representatives, count=matrix.shape[0],
+                 store_version=np.array(store_version))
+    os.replace(path + '.tmp', path)
+    logging.info(f"Wrote {len(names)} identity centroids "
+                 f"({matrix.shape[0] / max(len(names), 1):.1f} images per identity) to {path}")
+
+
+class IdentityIndex(IVFIndex):
+    '''
+    Two-stage search over identity centroids: rank identities by their
+    centroid, then rerank only the member images of the top_m identities
+    for the representative match. With centroid_only the best identities
+    are answered directly by their representative image and centroid score.
+    '''
+
+    def __init__(self, matrix, centroids, list_offsets, list_ids, representatives,
+                 top_m=5, centroid_only=False):
+        super().__init__(matrix, centroids, list_offsets, list_ids, nprobe=top_m)
+        self.representatives = representatives
+        self.centroid_only = centroid_only
+
+    @classmethod
+    def load(cls, store_dir, matrix, store_version, top_m=5, centroid_only=False):
+        '''
+        Load identities.npz from an embedding store, raising ValueError
+        when it was written for a different build of the store
+        '''
+        with np.load(os.path.join(store_dir, IDENTITIES_FILE)) as data:
+            if 'store_version' not in data.files or str(data['store_version']) != store_version:
+                raise ValueError(f"Identity centroids in {store_dir} were written for another store version")
+            if int(data['count']) != matrix.shape[0]:
+                raise ValueError(f"Identity centroids in {store_dir} do not match the embedding store")
+            return cls(matrix, data['centroids'], data['list_offsets'], data['list_ids'],
+                       data['representatives'], top_m=top_m, centroid_only=centroid_only)
+
+    def search(self, features, k=1, threshold=None, nprobe=None):
+        if not self.centroid_only:
+            return super().search(features, k=k, threshold=threshold, nprobe=nprobe)
+        query = normalize_rows(np.reshape(features, (1, -1)))[0]
+        scores = self.centroids @ query
+        matches = [(int(self.representatives[i]), float(scores[i])) for i in top_k_indices(scores, k)]
+        if threshold is not None:
+            matches = [m for m in matches if m[1] >= threshold]
+        return matches
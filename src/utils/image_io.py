@@ -0,0 +1,108 @@
+import io
+import logging
+import os
+import tarfile
+import uuid
+import zipfile
+import cv2
+import numpy as np
+from PIL import Image
+
+REDUCED_DECODE_FLAGS = ((8, cv2.IMREAD_REDUCED_COLOR_8),
+                        (4, cv2.IMREAD_REDUCED_COLOR_4),
+                        (2, cv2.IMREAD_REDUCED_COLOR_2))
+
+
+class UploadTooLargeError(ValueError):
+    '''
+    Raised when an upload exceeds the configured size cap
+    '''
+
+
+def _decode_flag(data : bytes, max_side) -> int :
+    '''
+    Pick a reduced-resolution decode flag when the header says the image
+    is at least 2x larger than max_side, so huge phone photos are never
+    decoded at full size
+    '''
+    if not max_side:
+        return cv2.IMREAD_COLOR
+    try:
+        width, height = Image.open(io.BytesIO(data)).size
+    except Exception:
+        return cv2.IMREAD_COLOR
+    for factor, flag in REDUCED_DECODE_FLAGS:
+        if max(width, height) // factor >= max_side:
+            return flag
+    return cv2.IMREAD_COLOR
+
+
+def decode_image(image, max_bytes=None, max_side=None) -> np.ndarray :
+    '''
+    Decode an uploaded image in memory into a BGR array, as cv2.imread would.
+    Input : image - raw encoded bytes or an already decoded ndarray
+            max_bytes - reject encoded uploads larger than this
+            max_side - downscale so the longest side is at most this
+    Output : BGR uint8 array
+    '''
+    if isinstance(image, np.ndarray):
+        img = image
+    else:
+        if max_bytes and len(image) > max_bytes:
+            raise UploadTooLargeError(f"Upload of {len(image)} bytes exceeds the {max_bytes} byte limit")
+        img = cv2.imdecode(np.frombuffer(image, dtype=np.uint8), _decode_flag(image, max_side))
+        if img is None:
+            raise ValueError("Could not decode uploaded image")
+
+    if max_side and max(img.shape[:2]) > max_side:
+        scale = max_side / max(img.shape[:2])
+        img = cv2.resize(img, (round(img.shape[1] * scale), round(img.shape[0] * scale)),
+                         interpolation=cv2.INTER_AREA)
+    return img
+
+
+def save_upload(data : bytes, upload_dir : str, filename : str = '') -> str :
+    '''
+    Persist an upload under a unique name so concurrent uploads
+    with the same client filename never overwrite each other
+    '''
+    os.makedirs(upload_dir, exist_ok=True)
+    ext = os.path.splitext(filename)[1] or '.jpg'
+    path = os.path.join(upload_dir, f"{uuid.uuid4().hex}{ext}")
+    with open(path, 'wb') as f:
+        f.write(data)
+    logging.info(f"Saved upload to {path}")
+    return path
+
+
+def iter_archive_images(fileobj, max_bytes=None):
+    '''
+    Lazily yield (name, data) for every file in a zip or tar archive,
+    reading one member at a time so memory stays bounded however large
+    the archive is. Members over max_bytes yield an UploadTooLargeError
+    instead of their data.
+    '''
+    fileobj.seek(0)
+    if zipfile.is_zipfile(fileobj):
+        fileobj.seek(0)
+        with zipfile.ZipFile(fileobj) as archive:
+            for info in archive.infolist():
+                if info.is_dir():
+                    continue
+                if max_bytes and info.file_size > max_bytes:
+                    yield info.filename, UploadTooLargeError(
+                        f"{info.filename} is {info.file_size} bytes, over the {max_bytes} byte limit")
+                    continue
+                yield info.filename, archive.read(info)
+        return
+
+    fileobj.seek(0)
+    with tarfile.open(fileobj=fileobj, mode='r|*') as archive:
+        for member in archive:
+            if not member.isfile():
+                continue
+            if max_bytes and member.size > max_bytes:
+                yield member.name, UploadTooLargeError(
+                    f"{member.name} is {member.size} bytes, over the {max_bytes} byte limit")
+                continue
+            yield member.name, archive.extractfile(member).read()
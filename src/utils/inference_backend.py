@@ -0,0 +1,126 @@
+import logging
+import os
+import threading
+import numpy as np
+
+BACKENDS = ('keras', 'onnx', 'onnx_int8', 'tflite', 'tflite_int8')
+
+
+def export_path(config : dict, params : dict, backend : str, base_dir : str = '') -> str :
+    '''
+    Location of an exported model variant, e.g.
+    artifacts/models/resnet50_avg_int8.onnx
+    '''
+    artifacts = config['artifacts']
+    fmt, _, variant = backend.partition('_')
+    name = f"{params['base']['BASE_MODEL']}_{params['base']['pooling']}"
+    if variant:
+        name += f"_{variant}"
+    return os.path.join(base_dir, artifacts['artifacts_dir'], artifacts['model_export_dir'], f"{name}.{fmt}")
+
+
+def model_tag(params : dict) -> str :
+    '''
+    Model identity for caches and the embedding store header; exported
+    backends produce slightly different embeddings than Keras
+    '''
+    backend = params['inference']['backend']
+    model_name = params['base']['BASE_MODEL']
+    return model_name if backend == 'keras' else f"{model_name}-{backend}"
+
+
+# Per-channel BGR means of the VGGFace training sets
+VGGFACE_MEANS = {
+    1: np.array([93.5940, 104.7624, 129.1863], dtype=np.float32),
+    2: np.array([91.4953, 103.8827, 131.0912], dtype=np.float32),
+}
+
+
+def preprocess_input(x, version=1):
+    '''
+    keras_vggface.utils.preprocess_input in plain numpy, so serving does
+    not import TensorFlow just to normalize faces: RGB -> BGR and
+    subtract the channel means. version=1 is the keras_vggface default
+    the gallery embeddings were built with; version=2 uses the VGGFace2
+    means.
+    Input : x - (..., 3) RGB face batch, channels last
+    Output : float32 copy ready for any inference backend
+    '''
+    return np.asarray(x, dtype=np.float32)[..., ::-1] - VGGFACE_MEANS[version]
+
+
+class KerasBackend:
+    def __init__(self, params, num_threads=None):
+        if num_threads:
+            import tensorflow as tf
+            tf.config.threading.set_intra_op_parallelism_threads(num_threads)
+            tf.config.threading.set_inter_op_parallelism_threads(1)
+        from keras_vggface.vggface import VGGFace
+        self.model = VGGFace(model=params['base']['BASE_MODEL'], include_top=params['base']['include_top'],
+                             input_shape=(224, 224, 3), pooling=params['base']['pooling'])
+
+    def predict(self, batch):
+        return np.asarray(self.model.predict_on_batch(batch)).reshape(len(batch), -1)
+
+
+class ONNXBackend:
+    def __init__(self, path, num_threads=None):
+        try:
+            import onnxruntime as ort
+        except ImportError as e:
+            raise ImportError("The onnx inference backends need onnxruntime (pip install onnxruntime)") from e
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+            options.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(path, options, providers=['CPUExecutionProvider'])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch):
+        output = self.session.run(None, {self.input_name: np.asarray(batch, dtype=np.float32)})[0]
+        return output.reshape(len(batch), -1)
+
+
+class TFLiteBackend:
+    def __init__(self, path, num_threads=None):
+        import tensorflow as tf
+        self.interpreter = tf.lite.Interpreter(model_path=path, num_threads=num_threads)
+        self.input_index = self.interpreter.get_input_details()[0]['index']
+        self.output_index = self.interpreter.get_output_details()[0]['index']
+        self._batch_size = None
+        # An Interpreter is not thread-safe: resize, set, invoke and read
+        # must not interleave between the batcher and request threads
+        self._lock = threading.Lock()
+
+    def predict(self, batch):
+        batch = np.asarray(batch, dtype=np.float32)
+        with self._lock:
+            if self._batch_size != len(batch):
+                self.interpreter.resize_tensor_input(self.input_index, batch.shape)
+                self.interpreter.allocate_tensors()
+                self._batch_size = len(batch)
+            self.interpreter.set_tensor(self.input_index, batch)
+            self.interpreter.invoke()
+            return self.interpreter.get_tensor(self.output_index).reshape(len(batch), -1)
+
+
+def load_backend(config : dict, params : dict, backend : str = None, num_threads : int = None,
+                 base_dir : str = ''):
+    '''
+    Embedding model for the backend selected by inference.backend in
+    params.yaml (or the backend argument). Every backend exposes
+    predict(batch) -> (N, dim) on preprocess_input-ed face batches.
+    '''
+    backend = backend or params['inference']['backend']
+    num_threads = num_threads or params['inference']['threads']
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown inference backend {backend!r}, expected one of {BACKENDS}")
+    if backend == 'keras':
+        model = KerasBackend(params, num_threads)
+    else:
+        path = export_path(config, params, backend, base_dir)
+        if not os.path.exists(path):
+            raise FileNotFoundError(f"No exported model at {path}, run src/05_export_model.py first")
+        model = ONNXBackend(path, num_threads) if backend.startswith('onnx') else TFLiteBackend(path, num_threads)
+    logging.info(f"Loaded {backend} inference backend (threads={num_threads})")
+    return model
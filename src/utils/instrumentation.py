@@ -0,0 +1,282 @@
+import heapq
+import json
+import os
+import sys
+import threading
+import time
+from collections import Counter as StackCounter
+from contextlib import contextmanager
+
+
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+
+def _label_text(labelnames, values, extra=()):
+    pairs = list(zip(labelnames, values)) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') for _, v in pairs)
+    return '{' + ','.join(f'{k}="{v}"' for (k, _), v in zip(pairs, escaped)) + '}'
+
+
+class _Metric:
+    kind = None
+
+    def __init__(self, name, help, labelnames=()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        for key, value in items:
+            lines.extend(self._render_sample(key, value))
+        return lines
+
+    def _render_sample(self, key, value):
+        return [f"{self.name}{_label_text(self.labelnames, key)} {value}"]
+
+
+class Counter(_Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(_Metric):
+    '''
+    Gauge set explicitly, or read from fn at render time when given
+    (fn returns a number, or a dict of label value -> number for one label)
+    '''
+    kind = 'gauge'
+
+    def __init__(self, name, help, labelnames=(), fn=None):
+        super().__init__(name, help, labelnames)
+        self.fn = fn
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def render(self):
+        if self.fn is not None:
+            value = self.fn()
+            with self._lock:
+                self._values = ({(str(k),): v for k, v in value.items()} if isinstance(value, dict)
+                                else {(): value})
+        return super().render()
+
+
+class Histogram(_Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            counts, total, count = self._values.get(key, ([0] * len(self.buckets), 0.0, 0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+            self._values[key] = (counts, total + value, count + 1)
+
+    def _render_sample(self, key, value):
+        counts, total, count = value
+        lines = [f"{self.name}_bucket{_label_text(self.labelnames, key, [('le', bound)])} {bucket_count}"
+                 for bound, bucket_count in zip(self.buckets, counts)]
+        lines.append(f"{self.name}_bucket{_label_text(self.labelnames, key, [('le', '+Inf')])} {count}")
+        lines.append(f"{self.name}_sum{_label_text(self.labelnames, key)} {total}")
+        lines.append(f"{self.name}_count{_label_text(self.labelnames, key)} {count}")
+        return lines
+
+
+class MetricsRegistry:
+    '''
+    In-process metrics rendered in the Prometheus text exposition format.
+    Metrics are per process, so with several server workers each one
+    reports its own counts.
+    '''
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _register(self, cls, name, *args, **kwargs):
+        with self._lock:
+            if name not in self._metrics:
+                self._metrics[name] = cls(name, *args, **kwargs)
+            return self._metrics[name]
+
+    def counter(self, name, help, labelnames=()):
+        return self._register(Counter, name, help, labelnames)
+
+    def gauge(self, name, help, labelnames=(), fn=None):
+        return self._register(Gauge, name, help, labelnames, fn=fn)
+
+    def histogram(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram, name, help, labelnames, buckets=buckets)
+
+    def render(self) -> str :
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return '\n'.join(line for metric in metrics for line in metric.render()) + '\n'
+
+    def write_textfile(self, path : str) :
+        '''
+        Write the metrics for the node exporter textfile collector, atomically
+        '''
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            f.write(self.render())
+        os.replace(path + '.tmp', path)
+
+
+REGISTRY = MetricsRegistry()
+STAGE_SECONDS = REGISTRY.histogram('celeblookalike_stage_seconds',
+                                   'Time spent in each pipeline stage', ('stage',))
+
+
+@contextmanager
+def stage_timer(stage, timings=None, histogram=STAGE_SECONDS):
+    '''
+    Time the enclosed block into histogram and, when a timings dict is
+    given, add the seconds to timings[stage] as well
+    '''
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - start
+        histogram.observe(elapsed, stage=stage)
+        if timings is not None:
+            timings[stage] = timings.get(stage, 0.0) + elapsed
+
+
+def merge_timings(timings : dict, *parts : dict) -> dict :
+    '''
+    Add the stage seconds of per-thread timings dicts into timings, so
+    threads working for one request never update the same dict
+    '''
+    for part in parts:
+        for stage, seconds in part.items():
+            timings[stage] = timings.get(stage, 0.0) + seconds
+    return timings
+
+
+def server_timing(timings : dict) -> str :
+    '''
+    Server-Timing header value for a dict of stage -> seconds
+    '''
+    return ', '.join(f"{stage};dur={seconds * 1000:.1f}" for stage, seconds in timings.items())
+
+
+def log_timings(logger, event, timings, **fields):
+    '''
+    One structured (JSON) log line with the stage timings in milliseconds
+    '''
+    logger.info(json.dumps({'event': event, **fields,
+                            'timings_ms': {stage: round(s * 1000, 2) for stage, s in timings.items()}}))
+
+
+def get_metrics_path(config : dict, stage : str, base_dir : str = '') -> str :
+    '''
+    Textfile the metrics of a pipeline stage script are written to
+    '''
+    artifacts = config['artifacts']
+    return os.path.join(base_dir, artifacts['artifacts_dir'], artifacts['metrics_dir'], f"{stage}.prom")
+
+
+# Leaf frames in these files are threads waiting for work, not doing it
+_IDLE_FILES = ('threading.py', 'selectors.py', 'queue.py', 'thread.py')
+
+
+class SlowRequestProfiler:
+    '''
+    Sampling profiler for the slowest requests. While requests are in
+    flight a daemon thread samples the stack of every busy thread every
+    interval_ms and adds it to each in-flight request; when a request
+    finishes, its collapsed stacks are kept only if it is among the
+    top_n slowest seen so far. Under concurrency a request's samples
+    include its neighbours' work, so the profiles are indicative.
+    '''
+
+    def __init__(self, top_n=10, interval_ms=5, max_depth=40):
+        self.top_n = top_n
+        self.interval = interval_ms / 1000.0
+        self.max_depth = max_depth
+        self._lock = threading.Lock()
+        self._active = {}
+        self._slowest = []
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name='slow-request-profiler', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def begin(self, request_id):
+        with self._lock:
+            self._active[request_id] = StackCounter()
+
+    def end(self, request_id, elapsed, timings=None, **fields):
+        with self._lock:
+            samples = self._active.pop(request_id, None)
+            if samples is None:
+                return
+            entry = (elapsed, request_id, {'request_id': request_id, 'elapsed_ms': round(elapsed * 1000, 2),
+                                           'timings_ms': {k: round(v * 1000, 2) for k, v in (timings or {}).items()},
+                                           **fields, 'samples': sum(samples.values()),
+                                           'stacks': samples.most_common(20)})
+            if len(self._slowest) < self.top_n:
+                heapq.heappush(self._slowest, entry)
+            elif elapsed > self._slowest[0][0]:
+                heapq.heapreplace(self._slowest, entry)
+
+    def report(self):
+        with self._lock:
+            return [entry for _, _, entry in sorted(self._slowest, key=lambda e: e[0], reverse=True)]
+
+    def _collapse(self, frame):
+        names = []
+        while frame is not None and len(names) < self.max_depth:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+            frame = frame.f_back
+        return ';'.join(reversed(names))
+
+    def _run(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            with self._lock:
+                if not self._active:
+                    continue
+            stacks = [self._collapse(frame) for thread_id, frame in sys._current_frames().items()
+                      if thread_id != own_id
+                      and not frame.f_code.co_filename.endswith(_IDLE_FILES)]
+            with self._lock:
+                for samples in self._active.values():
+                    samples.update(stacks)
@@ -0,0 +1,265 @@
+import fcntl
+import gc
+import json
+import logging
+import os
+import threading
+import time
+import numpy as np
+from src.utils.ann_index import load_search_index
+from src.utils.embedding_store import EmbeddingStore, label_from_path
+from src.utils.process_stats import memory_usage
+from src.utils.search import SimilaritySearch, normalize_rows
+from src.utils.sharding import PartialResults
+from src.utils.thumbnails import load_gallery_ids
+
+DELTA_FILE = 'delta.npz'
+
+
+def _file_stamp(path):
+    try:
+        stat = os.stat(path)
+        return stat.st_mtime_ns, stat.st_size
+    except FileNotFoundError:
+        return None
+
+
+def get_release_path(config : dict, base_dir : str = '') -> str :
+    '''
+    Location of the release marker run.py writes once every stage has finished
+    '''
+    artifacts = config['artifacts']
+    return os.path.join(base_dir, artifacts['artifacts_dir'], artifacts['release_name'])
+
+
+def write_release(config, store_version, base_dir=''):
+    '''
+    Publish a finished build: servers only swap to a new store when this
+    marker changes, so they never pick up a store whose ANN index,
+    centroids or thumbnails are still being rebuilt
+    '''
+    path = get_release_path(config, base_dir)
+    with open(path + '.tmp', 'w') as f:
+        json.dump({'store_version': store_version, 'released_at': time.time()}, f)
+    os.replace(path + '.tmp', path)
+
+
+def read_release(path):
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def load_delta(store_dir, base_version):
+    '''
+    Embeddings appended to a live store since its last build, as
+    (matrix, filenames). A delta written on top of an older build is
+    ignored: the rebuild already embedded its images from the data dir.
+    '''
+    path = os.path.join(store_dir, DELTA_FILE)
+    if not os.path.exists(path):
+        return None, []
+    with np.load(path, allow_pickle=False) as data:
+        if str(data['base_version']) != base_version:
+            logging.info(f"Ignoring {path}, it was appended to an older store build")
+            return None, []
+        return data['matrix'], [str(path) for path in data['filenames']]
+
+
+def append_delta(store_dir, base_version, features, filenames):
+    '''
+    Append normalized embeddings to the store's delta file. Workers of one
+    server may append concurrently, so the read-modify-write holds a lock.
+    Output : number of rows in the delta afterwards
+    '''
+    path = os.path.join(store_dir, DELTA_FILE)
+    features = normalize_rows(np.reshape(features, (len(filenames), -1)))
+    with open(path + '.lock', 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        matrix, existing = load_delta(store_dir, base_version)
+        if matrix is not None:
+            features = np.concatenate([matrix, features])
+            filenames = existing + list(filenames)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, matrix=features, filenames=np.array(filenames, dtype=str),
+                     base_version=np.array(base_version))
+        os.replace(path + '.tmp', path)
+    return len(filenames)
+
+
+class DeltaSearch:
+    '''
+    A base search index plus a small exact-search delta of appended rows.
+    Delta rows are numbered after the base rows, so index positions stay
+    valid for filenames = base filenames + delta filenames.
+    '''
+
+    def __init__(self, base, delta_matrix, offset):
+        self.base = base
+        self.delta = SimilaritySearch(delta_matrix, normalized=True)
+        self.offset = offset
+
+    def _merge(self, base_matches, delta_matches, k):
+        matches = base_matches + [(i + self.offset, score) for i, score in delta_matches]
+        return sorted(matches, key=lambda m: m[1], reverse=True)[:k]
+
+    def search(self, features, k=1, threshold=None):
+        return self._merge(self.base.search(features, k=k, threshold=threshold),
+                           self.delta.search(features, k=k, threshold=threshold), k)
+
+    def search_batch(self, queries, k=1, threshold=None):
+        base_results = self.base.search_batch(queries, k=k, threshold=threshold)
+        results = [self._merge(base, delta, k) for base, delta in
+                   zip(base_results, self.delta.search_batch(queries, k=k, threshold=threshold))]
+        if isinstance(base_results, PartialResults):
+            return PartialResults(results, base_results.missing_shards)
+        return results
+
+
+class IndexSnapshot:
+    '''
+    Everything a request needs to search the gallery and describe its
+    matches. Snapshots are never modified: a request keeps using the one
+    it started with while newer snapshots are swapped in.
+    '''
+
+    def __init__(self, store, base_index, gallery_ids, delta_matrix=None, delta_filenames=()):
+        self.store = store
+        self.base_index = base_index
+        self.gallery_ids = gallery_ids
+        self.gallery_id_set = set(gallery_ids or [])
+        self.delta_count = len(delta_filenames)
+        self.filenames = store.filenames + list(delta_filenames)
+        self.labels = store.labels + [label_from_path(path) for path in delta_filenames]
+        self.search_index = (DeltaSearch(base_index, delta_matrix, len(store))
+                             if self.delta_count else base_index)
+
+    @property
+    def version(self):
+        return f"{self.store.version}/{type(self.base_index).__name__}/delta{self.delta_count}"
+
+    def gallery_id(self, index_pos):
+        # Appended rows get thumbnails on the next stage 04 run
+        if self.gallery_ids is None or index_pos >= len(self.gallery_ids):
+            return None
+        return self.gallery_ids[index_pos]
+
+
+class LiveIndex:
+    '''
+    Holds the current IndexSnapshot and replaces it when a new build is
+    released. A background thread polls the release marker written by
+    run.py and the delta file; when either changes it loads a new
+    snapshot off the request path and swaps the reference, which is
+    atomic for readers. A release whose store version does not match the
+    store on disk is not loaded, and every derived artifact (ANN index,
+    identity centroids, codes, gallery IDs) is only used when it carries
+    the store's version. When only the delta changed the loaded base
+    index is reused.
+    '''
+
+    def __init__(self, config, params, store_dir, gallery_dir, poll_seconds=5.0, on_swap=None):
+        self.config = config
+        self.params = params
+        self.store_dir = store_dir
+        self.gallery_dir = gallery_dir
+        self.poll_seconds = poll_seconds
+        self.on_swap = on_swap
+        self.release_path = get_release_path(config)
+        self.current = None
+        self.swaps = 0
+        self._stamp = None
+        self._base_stamp = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _stamps(self):
+        return _file_stamp(self.release_path), _file_stamp(os.path.join(self.store_dir, DELTA_FILE))
+
+    def _load(self, base_stamp):
+        current = self.current
+        if current is not None and base_stamp == self._base_stamp:
+            store, base_index, gallery_ids = current.store, current.base_index, current.gallery_ids
+        else:
+            store = EmbeddingStore.open(self.store_dir)
+            release = read_release(self.release_path)
+            if release is not None and release['store_version'] != store.version:
+                message = (f"Store version {store.version} does not match the released "
+                           f"{release['store_version']}, a rebuild is probably still running")
+                if current is not None:
+                    raise ValueError(message)
+                logging.warning(f"{message}; serving it until the next release")
+            base_index = load_search_index(store, self.config, self.params)
+            gallery_ids = load_gallery_ids(self.gallery_dir, store.version, len(store))
+        delta_matrix, delta_filenames = load_delta(self.store_dir, store.version)
+        return IndexSnapshot(store, base_index, gallery_ids, delta_matrix, delta_filenames)
+
+    def load(self):
+        '''
+        Load the store and swap in a new snapshot if anything changed on
+        disk since the last load, logging how long it took and how much
+        memory the process needed while both snapshots were alive
+        Output : True when a new snapshot was swapped in
+        '''
+        with self._lock:
+            base_stamp, delta_stamp = self._stamps()
+            if self.current is not None and (base_stamp, delta_stamp) == self._stamp:
+                return False
+            before = memory_usage()
+            start = time.perf_counter()
+            snapshot = self._load(base_stamp)
+            loaded = time.perf_counter() - start
+            during = memory_usage()
+
+            previous, self.current = self.current, snapshot
+            self._stamp, self._base_stamp = (base_stamp, delta_stamp), base_stamp
+            self.swaps += 1
+            if self.on_swap is not None:
+                self.on_swap(snapshot)
+            del previous
+            gc.collect()
+            after = memory_usage()
+            logging.info(f"Swapped in index {snapshot.version} with {len(snapshot.filenames)} rows "
+                         f"in {loaded:.2f}s; RSS {before['rss_mb']} -> {during['rss_mb']} MB while loading, "
+                         f"{after['rss_mb']} MB after the swap")
+            return True
+
+    def append(self, features, filenames):
+        '''
+        Append embeddings to the live store without a rebuild and swap
+        them in. Other processes serving the same store pick the rows up
+        from the delta file on their next poll.
+        Output : the new snapshot
+        '''
+        append_delta(self.store_dir, self.current.store.version, features, filenames)
+        self.load()
+        return self.current
+
+    def start(self):
+        if self.current is None:
+            self.load()
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._watch, name='live-index-watcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def _watch(self):
+        failed = None
+        while not self._stop.wait(self.poll_seconds):
+            stamp = None
+            try:
+                stamp = self._stamps()
+                # A release that failed to load is retried once the marker or delta changes again
+                if stamp != self._stamp and stamp != failed:
+                    self.load()
+            except Exception as e:
+                failed = stamp
+                logging.exception(f"Reloading the index failed, still serving {self.current.version}: {e}")
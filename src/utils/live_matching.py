@@ -0,0 +1,203 @@
+import logging
+import threading
+import cv2
+import numpy as np
+from src.utils.face_detection import box_iou, face_array
+from src.utils.inference_backend import preprocess_input
+
+
+class Track:
+    def __init__(self, track_id, box):
+        self.track_id = track_id
+        self.box = box
+        self.missed = 0
+        self.frames_since_embed = None
+        self.embedding = None
+        self.label = None
+        self.score = None
+
+
+class IoUTracker:
+    '''
+    Minimal multi-face tracker: detections are greedily associated to
+    existing tracks by box IoU; unmatched detections start new tracks and
+    tracks unseen for max_missed inference steps are dropped.
+    '''
+
+    def __init__(self, iou_threshold=0.3, max_missed=10):
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.tracks = []
+        self._next_id = 0
+
+    def update(self, boxes):
+        pairs = sorted(((box_iou(track.box, box), t, d)
+                        for t, track in enumerate(self.tracks) for d, box in enumerate(boxes)),
+                       reverse=True)
+        matched_tracks, matched_boxes = set(), set()
+        for iou, t, d in pairs:
+            if iou < self.iou_threshold:
+                break
+            if t in matched_tracks or d in matched_boxes:
+                continue
+            matched_tracks.add(t)
+            matched_boxes.add(d)
+            self.tracks[t].box = boxes[d]
+            self.tracks[t].missed = 0
+
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track.missed += 1
+        self.tracks = [track for track in self.tracks if track.missed <= self.max_missed]
+
+        for d, box in enumerate(boxes):
+            if d not in matched_boxes:
+                self.tracks.append(Track(self._next_id, box))
+                self._next_id += 1
+        return [track for track in self.tracks if track.missed == 0]
+
+
+def preprocess_crop(img, box):
+    # Same crop and normalization as the API queries and the gallery
+    return preprocess_input(face_array(img, box))
+
+
+class LiveMatcher:
+    '''
+    Real-time lookalike matching for a video stream. Frames are handed
+    over with submit_frame(); a background thread always works on the
+    latest one and drops anything older, so the display never waits for
+    the model. A face is embedded only when its track is new or every
+    reembed_every inference steps; track embeddings are smoothed with an
+    exponential moving average before searching. annotate() draws the
+    latest results and is cheap enough to call on every displayed frame.
+    '''
+
+    def __init__(self, detector, embed_fn, preprocess_fn, search_index, labels, live):
+        self.detector = detector
+        self.embed_fn = embed_fn
+        self.preprocess_fn = preprocess_fn
+        self.search_index = search_index
+        self.labels = labels
+        self.reembed_every = live['reembed_every']
+        self.smoothing = live['smoothing']
+        self.max_faces = live['max_faces']
+        self.tracker = IoUTracker(live['iou_threshold'], live['max_missed'])
+
+        self.frames_submitted = 0
+        self.frames_processed = 0
+        self.embeddings_run = 0
+        self._latest = None
+        self._results = []
+        self._condition = threading.Condition()
+        self._running = False
+        self._thread = None
+
+    def start(self):
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='live-matcher', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        with self._condition:
+            self._running = False
+            self._condition.notify()
+        if self._thread is not None:
+            self._thread.join()
+
+    def submit_frame(self, frame):
+        with self._condition:
+            # Overwrite instead of queueing: stale frames are never processed
+            self._latest = frame
+            self.frames_submitted += 1
+            self._condition.notify()
+
+    @property
+    def results(self):
+        with self._condition:
+            return list(self._results)
+
+    def _run(self):
+        while True:
+            with self._condition:
+                while self._running and self._latest is None:
+                    self._condition.wait()
+                if not self._running:
+                    return
+                frame, self._latest = self._latest, None
+            try:
+                self.process_frame(frame)
+            except Exception:
+                logging.exception("Live matching failed on a frame")
+
+    def process_frame(self, frame):
+        faces = self.detector.detect(frame)[:self.max_faces]
+        tracks = self.tracker.update([box for box, _ in faces])
+
+        for track in tracks:
+            if track.frames_since_embed is not None:
+                track.frames_since_embed += 1
+        stale = [track for track in tracks
+                 if track.frames_since_embed is None or track.frames_since_embed >= self.reembed_every]
+
+        if stale:
+            crops = np.stack([self.preprocess_fn(frame, track.box) for track in stale])
+            features = self.embed_fn(crops)
+            self.embeddings_run += len(stale)
+            for track, feature in zip(stale, features):
+                feature = feature / (np.linalg.norm(feature) or 1.0)
+                if track.embedding is None:
+                    track.embedding = feature
+                else:
+                    track.embedding = self.smoothing * track.embedding + (1 - self.smoothing) * feature
+                track.frames_since_embed = 0
+            matches = self.search_index.search_batch(np.stack([track.embedding for track in stale]), k=1)
+            for track, track_matches in zip(stale, matches):
+                if track_matches:
+                    index_pos, score = track_matches[0]
+                    track.label, track.score = self.labels[index_pos], score
+
+        with self._condition:
+            self._results = [(track.track_id, track.box, track.label, track.score) for track in tracks]
+            self.frames_processed += 1
+
+    def annotate(self, frame):
+        frame = frame.copy()
+        for _, (x, y, width, height), label, score in self.results:
+            cv2.rectangle(frame, (x, y), (x + width, y + height), (0, 255, 0), 2)
+            if label is not None:
+                cv2.putText(frame, f"{label} {score * 100:.0f}%", (x, max(0, y - 8)),
+                            cv2.FONT_HERSHEY_SIMPLEX, 0.6, (0, 255, 0), 2)
+        return frame
+
+
+def load_live_gallery(config, params):
+    '''
+    Inference backend and gallery index for live matching, which every
+    stream can share. Heavy imports happen here, not at module import.
+    '''
+    from src.utils.ann_index import load_search_index
+    from src.utils.embedding_store import EmbeddingStore, get_store_dir
+    from src.utils.inference_backend import load_backend
+
+    model = load_backend(config, params)
+    store = EmbeddingStore.open(get_store_dir(config))
+    return {
+        'embed_fn': model.predict,
+        'preprocess_fn': preprocess_crop,
+        'search_index': load_search_index(store, config, params),
+        'labels': store.labels,
+    }
+
+
+def build_live_matcher(config, params, gallery=None):
+    '''
+    LiveMatcher wired to the configured detector and a gallery from
+    load_live_gallery, loaded here when not given. Each matcher has its
+    own detector, tracker and thread, so give every stream its own.
+    '''
+    from src.utils.face_detection import FaceDetector
+
+    return LiveMatcher(detector=FaceDetector(params['detection']), live=params['live'],
+                       **(gallery or load_live_gallery(config, params)))
@@ -0,0 +1,147 @@
+import hashlib
+import json
+import logging
+import os
+import time
+
+
+def _walk_stats(path):
+    if os.path.isfile(path):
+        stat = os.stat(path)
+        yield path, stat.st_size, stat.st_mtime_ns
+        return
+    stack = [path]
+    while stack:
+        with os.scandir(stack.pop()) as entries:
+            for entry in entries:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif entry.is_file():
+                    stat = entry.stat()
+                    yield entry.path, stat.st_size, stat.st_mtime_ns
+
+
+def fingerprint_paths(paths) -> str :
+    '''
+    Fingerprint of files and directory trees from their paths, sizes and
+    modification times, without reading their contents. Missing paths
+    are part of the fingerprint, so creating them changes it too.
+    '''
+    digest = hashlib.sha1()
+    for path in sorted(paths):
+        if not os.path.exists(path):
+            digest.update(f"{path}\0missing\n".encode())
+            continue
+        for file, size, mtime in sorted(_walk_stats(path)):
+            digest.update(f"{file}\0{size}\0{mtime}\n".encode())
+    return digest.hexdigest()
+
+
+def fingerprint_params(params : dict, sections) -> str :
+    '''
+    Fingerprint of the params.yaml sections a stage depends on
+    '''
+    return hashlib.sha1(json.dumps({s: params.get(s) for s in sorted(sections)},
+                                   sort_keys=True, default=str).encode()).hexdigest()
+
+
+def path_size(path) -> int :
+    if not os.path.exists(path):
+        return 0
+    return sum(size for _, size, _ in _walk_stats(path))
+
+
+class Stage:
+    '''
+    One pipeline step. run(results) does the work and may return a value
+    that later stages receive in results[name], so data can be handed
+    over in memory instead of through files. inputs and outputs are the
+    files or directories the stage reads and writes, params the
+    params.yaml sections whose values change its outputs.
+    '''
+
+    def __init__(self, name, run, inputs=(), outputs=(), params=()):
+        self.name = name
+        self.run = run
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = list(params)
+
+
+class PipelineRunner:
+    '''
+    Runs stages in order inside this process. A stage is skipped when the
+    fingerprints of its inputs, params and outputs all match the ones
+    recorded after its last successful run. A stage that runs rewrites
+    the inputs of the stages after it, so those rerun in turn.
+    The first failing stage stops the pipeline. Every run writes a report
+    with each stage's status, time and output size.
+    '''
+
+    def __init__(self, stages, params, state_path, report_path):
+        self.stages = stages
+        self.params = params
+        self.state_path = state_path
+        self.report_path = report_path
+        self.report = []
+
+    def _load_state(self):
+        if not os.path.exists(self.state_path):
+            return {}
+        with open(self.state_path) as f:
+            return json.load(f)
+
+    def _write_json(self, path, content):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        with open(path + '.tmp', 'w') as f:
+            json.dump(content, f, indent=2)
+        os.replace(path + '.tmp', path)
+
+    def _input_fingerprint(self, stage):
+        return f"{fingerprint_paths(stage.inputs)}/{fingerprint_params(self.params, stage.params)}"
+
+    def run(self, force=False, only=None):
+        '''
+        Input : force - run every selected stage regardless of fingerprints
+                only - names of the stages to consider, all of them by default
+        Output : the report, a list of one dict per stage
+        '''
+        state = self._load_state()
+        results, report = {}, []
+        self.report = report
+        try:
+            for stage in self.stages:
+                entry = {'stage': stage.name, 'status': 'skipped', 'seconds': 0.0}
+                report.append(entry)
+                if only is not None and stage.name not in only:
+                    entry['status'] = 'not selected'
+                    continue
+
+                inputs = self._input_fingerprint(stage)
+                previous = state.get(stage.name, {})
+                unchanged = (previous.get('inputs') == inputs
+                             and previous.get('outputs') == fingerprint_paths(stage.outputs))
+                if unchanged and not force:
+                    logging.info(f"Stage {stage.name} is up to date, skipping")
+                else:
+                    logging.info(f">>>>> stage {stage.name} started")
+                    start = time.perf_counter()
+                    try:
+                        results[stage.name] = stage.run(results)
+                    except Exception:
+                        entry['status'] = 'failed'
+                        entry['seconds'] = round(time.perf_counter() - start, 3)
+                        raise
+                    entry['status'] = 'ran'
+                    entry['seconds'] = round(time.perf_counter() - start, 3)
+                    logging.info(f"stage {stage.name} completed in {entry['seconds']}s >>>>>")
+
+                    # Inputs are fingerprinted again, the stage may have created some of them
+                    state[stage.name] = {'inputs': self._input_fingerprint(stage),
+                                         'outputs': fingerprint_paths(stage.outputs)}
+                    self._write_json(self.state_path, state)
+                entry['output_bytes'] = {path: path_size(path) for path in stage.outputs}
+        finally:
+            self._write_json(self.report_path, {'created_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                                                'stages': report})
+        return report
@@ -0,0 +1,64 @@
+import os
+import resource
+import time
+
+
+# Taken at first import of this module, i.e. as early as the server imports it
+PROCESS_STARTED = time.perf_counter()
+
+
+def reset_process_started():
+    '''
+    Restart the cold start clock in a forked child, which would otherwise
+    inherit the parent's import time
+    '''
+    global PROCESS_STARTED
+    PROCESS_STARTED = time.perf_counter()
+
+
+def _read_kb_fields(path, fields):
+    values = {}
+    try:
+        with open(path) as f:
+            for line in f:
+                key, _, rest = line.partition(':')
+                if key in fields:
+                    values[key] = int(rest.split()[0])
+    except OSError:
+        pass
+    return values
+
+
+def memory_usage() -> dict :
+    '''
+    Memory of the current process in MB.
+    rss_mb counts every resident page, shared_mb the part of it backed by
+    pages other processes may map too (the memmapped gallery, copy-on-write
+    pages of a preforked parent) and pss_mb splits shared pages evenly
+    between the processes using them, so summing pss_mb over the workers
+    gives the real footprint of the server.
+    Falls back to peak RSS from getrusage where /proc is not available.
+    '''
+    status = _read_kb_fields('/proc/self/status', {'VmRSS', 'RssFile', 'RssShmem'})
+    rollup = _read_kb_fields('/proc/self/smaps_rollup', {'Pss', 'Shared_Clean', 'Shared_Dirty'})
+    if 'VmRSS' not in status:
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return {'rss_mb': round(peak / 1024, 1), 'shared_mb': None, 'pss_mb': None}
+
+    shared = rollup.get('Shared_Clean', 0) + rollup.get('Shared_Dirty', 0) if rollup else \
+        status.get('RssFile', 0) + status.get('RssShmem', 0)
+    return {
+        'rss_mb': round(status['VmRSS'] / 1024, 1),
+        'shared_mb': round(shared / 1024, 1),
+        'pss_mb': round(rollup['Pss'] / 1024, 1) if 'Pss' in rollup else None,
+    }
+
+
+def startup_report(started : float = None) -> dict :
+    '''
+    Seconds since started (process import or fork time by default) plus memory usage
+    '''
+    started = PROCESS_STARTED if started is None else started
+    return {'pid': os.getpid(),
+            'cold_start_s': round(time.perf_counter() - started, 3),
+            **memory_usage()}
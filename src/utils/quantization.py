@@ -0,0 +1,241 @@
+import logging
+import os
+import numpy as np
+from src.utils.search import normalize_rows, top_k_indices
+
+CODES_FILE = 'codes.npy'
+CODEC_FILE = 'codec.npz'
+CHUNK_ROWS = 65536
+
+
+def _chunked_scores(codes, score_chunk):
+    scores = np.empty(codes.shape[0], dtype=np.float32)
+    for start in range(0, codes.shape[0], CHUNK_ROWS):
+        scores[start:start + CHUNK_ROWS] = score_chunk(np.asarray(codes[start:start + CHUNK_ROWS]))
+    return scores
+
+
+class Float16Codec:
+    '''
+    Half-precision copy of the normalized embeddings (2x smaller)
+    '''
+    method = 'float16'
+
+    def train(self, matrix):
+        return self
+
+    def encode(self, matrix):
+        return np.asarray(matrix, dtype=np.float16)
+
+    def scores(self, codes, query):
+        return _chunked_scores(codes, lambda chunk: chunk.astype(np.float32) @ query)
+
+    def state(self):
+        return {}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls()
+
+
+class ScalarQuantizer:
+    '''
+    Per-dimension 8-bit scalar quantization (4x smaller than float32).
+    Each dimension is mapped linearly from its [min, max] onto 0..255.
+    '''
+    method = 'int8'
+
+    def __init__(self, minimum=None, scale=None):
+        self.minimum = minimum
+        self.scale = scale
+
+    def train(self, matrix):
+        matrix = np.asarray(matrix, dtype=np.float32)
+        self.minimum = matrix.min(axis=0)
+        self.scale = np.maximum(matrix.max(axis=0) - self.minimum, 1e-12) / 255.0
+        return self
+
+    def encode(self, matrix):
+        codes = np.rint((np.asarray(matrix, dtype=np.float32) - self.minimum) / self.scale)
+        return np.clip(codes, 0, 255).astype(np.uint8)
+
+    def scores(self, codes, query):
+        # q . x = q . min + (q * scale) . code
+        offset = float(query @ self.minimum)
+        weights = (query * self.scale).astype(np.float32)
+        return _chunked_scores(codes, lambda chunk: chunk.astype(np.float32) @ weights + offset)
+
+    def state(self):
+        return {'minimum': self.minimum, 'scale': self.scale}
+
+    @classmethod
+    def from_state(cls, state):
+        return cls(state['minimum'], state['scale'])
+
+
+def kmeans(sample, n_clusters, n_iter=20, seed=0):
+    '''
+    Plain euclidean k-means used to train the product quantizer codebooks
+    '''
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, sample.shape[0])
+    centroids = sample[rng.choice(sample.shape[0], n_clusters, replace=False)].copy()
+    for _ in range(n_iter):
+        # argmin ||x - c||^2 == argmax (x . c - ||c||^2 / 2)
+        assignments = np.argmax(sample @ centroids.T - 0.5 * (centroids ** 2).sum(axis=1), axis=1)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, sample)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        if (~filled).any():
+            centroids[~filled] = sample[rng.choice(sample.shape[0], int((~filled).sum()), replace=False)]
+    return centroids
+
+
+class ProductQuantizer:
+    '''
+    Product quantization: the vector is cut into m sub-vectors and each
+    is replaced by the id of its nearest of 256 sub-centroids, so one
+    embedding costs m bytes. Query scores are sums of per-subspace
+    lookup-table entries.
+    '''
+    method = 'pq'
+
+    def __init__(self, n_subspaces=64, codebooks=None, train_sample=50000, n_iter=20):
+        self.n_subspaces = n_subspaces
+        self.codebooks = codebooks
+        self.train_sample = train_sample
+        self.n_iter = n_iter
+
+    def _split(self, matrix):
+        return np.split(np.asarray(matrix, dtype=np.float32), self.n_subspaces, axis=1)
+
+    def train(self, matrix):
+        if matrix.shape[1] % self.n_subspaces:
+            raise ValueError(f"dim {matrix.shape[1]} is not divisible by {self.n_subspaces} subspaces")
+        rng = np.random.default_rng(0)
+        rows = matrix.shape[0]
+        if self.train_sample and self.train_sample < rows:
+            matrix = matrix[np.sort(rng.choice(rows, self.train_sample, replace=False))]
+        self.codebooks = np.stack([kmeans(sub, 256, n_iter=self.n_iter, seed=j)
+                                   for j, sub in enumerate(self._split(matrix))])
+        logging.info(f"Trained product quantizer with {self.n_subspaces} subspaces")
+        return self
+
+    def encode(self, matrix):
+        codes = np.empty((matrix.shape[0], self.n_subspaces), dtype=np.uint8)
+        for start in range(0, matrix.shape[0], CHUNK_ROWS):
+            subs = self._split(matrix[start:start + CHUNK_ROWS])
+            for j, (sub, codebook) in enumerate(zip(subs, self.codebooks)):
+                codes[start:start + CHUNK_ROWS, j] = np.argmax(
+                    sub @ codebook.T - 0.5 * (codebook ** 2).sum(axis=1), axis=1)
+        return codes
+
+    def scores(self, codes, query):
+        sub_queries = np.split(query.astype(np.float32), self.n_subspaces)
+        lut = np.stack([codebook @ q for codebook, q in zip(self.codebooks, sub_queries)])
+        subspace = np.arange(self.n_subspaces)
+        return _chunked_scores(codes, lambda chunk: lut[subspace, chunk].sum(axis=1))
+
+    def state(self):
+        return {'codebooks': self.codebooks}
+
+    @classmethod
+    def from_state(cls, state):
+        codebooks = state['codebooks']
+        return cls(n_subspaces=codebooks.shape[0], codebooks=codebooks)
+
+
+CODECS = {codec.method: codec for codec in (Float16Codec, ScalarQuantizer, ProductQuantizer)}
+
+
+def make_codec(compression : dict):
+    '''
+    Untrained codec for the compression section of params.yaml
+    '''
+    method = compression['method']
+    if method == 'pq':
+        return ProductQuantizer(n_subspaces=compression['pq_subspaces'],
+                                train_sample=compression['pq_train_sample'])
+    if method not in CODECS:
+        raise ValueError(f"Unknown compression method {method!r}")
+    return CODECS[method]()
+
+
+def write_compressed(store_dir, matrix, compression, store_version):
+    '''
+    Train the configured codec on the normalized gallery and write the
+    codes and codec state next to the embedding store, tagged with the
+    store version they encode. Removes stale codes when compression is
+    disabled.
+    '''
+    codes_path = os.path.join(store_dir, CODES_FILE)
+    codec_path = os.path.join(store_dir, CODEC_FILE)
+    if compression['method'] == 'none':
+        for path in (codes_path, codec_path):
+            if os.path.exists(path):
+                os.remove(path)
+        return None
+
+    codec = make_codec(compression).train(matrix)
+    codes = codec.encode(matrix)
+    np.save(codes_path + '.tmp.npy', codes)
+    with open(codec_path + '.tmp', 'wb') as f:
+        np.savez(f, method=codec.method, store_version=np.array(store_version), **codec.state())
+    os.replace(codes_path + '.tmp.npy', codes_path)
+    os.replace(codec_path + '.tmp', codec_path)
+    logging.info(f"Wrote {codec.method} codes ({codes.nbytes / max(len(codes), 1):.0f} bytes/row) to {store_dir}")
+    return codec
+
+
+def load_compressed(store_dir, store_version, mmap_mode='r'):
+    '''
+    (codes, codec) for a store, or (None, None) when it has no codes or
+    they were written for another version of the store
+    '''
+    codec_path = os.path.join(store_dir, CODEC_FILE)
+    if not os.path.exists(codec_path):
+        return None, None
+    with np.load(codec_path) as data:
+        if 'store_version' not in data.files or str(data['store_version']) != store_version:
+            logging.warning(f"Ignoring compressed codes in {store_dir} written for another store version")
+            return None, None
+        state = {key: data[key] for key in data.files if key not in ('method', 'store_version')}
+        codec = CODECS[str(data['method'])].from_state(state)
+    codes = np.load(os.path.join(store_dir, CODES_FILE), mmap_mode=mmap_mode)
+    return codes, codec
+
+
+class CompressedSearch:
+    '''
+    Search over compressed codes with an optional exact-float rerank of
+    the best `rerank` candidates. Same search() interface as
+    SimilaritySearch; the float matrix is only touched for candidates.
+    '''
+
+    def __init__(self, codes, codec, matrix=None, rerank=50):
+        self.codes = codes
+        self.codec = codec
+        self.matrix = matrix
+        self.rerank = rerank if matrix is not None else 0
+
+    def __len__(self):
+        return self.codes.shape[0]
+
+    def search(self, features, k=1, threshold=None):
+        query = normalize_rows(np.reshape(features, (1, -1)))[0]
+        approx = self.codec.scores(self.codes, query)
+        if self.rerank:
+            ids = np.sort(top_k_indices(approx, max(self.rerank, k)))
+            scores = np.asarray(self.matrix[ids], dtype=np.float32) @ query
+        else:
+            ids, scores = np.arange(len(approx)), approx
+        order = top_k_indices(scores, k)
+        matches = [(int(ids[i]), float(scores[i])) for i in order]
+        if threshold is not None:
+            matches = [m for m in matches if m[1] >= threshold]
+        return matches
+
+    def search_batch(self, queries, k=1, threshold=None):
+        return [self.search(query, k=k, threshold=threshold) for query in queries]
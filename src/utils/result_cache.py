@@ -0,0 +1,146 @@
+import hashlib
+import json
+import logging
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import numpy as np
+
+
+def image_key(img : np.ndarray) -> str :
+    '''
+    Hash of the decoded pixels, so re-encoded copies of the same
+    upload (different filename or metadata) share a key
+    '''
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(str(img.shape).encode())
+    digest.update(np.ascontiguousarray(img).tobytes())
+    return digest.hexdigest()
+
+
+class LRUResultCache:
+    '''
+    In-process LRU cache of query results with a TTL.
+    Callers put the index version in every key, so results are never
+    shared between index versions; changing the version only frees the
+    memory of the entries no request can hit any more.
+    '''
+
+    def __init__(self, max_entries=10000, ttl_seconds=3600, version=''):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def set_version(self, version):
+        with self._lock:
+            if version != self.version:
+                self._entries.clear()
+                self.version = version
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or time.time() - entry[0] > self.ttl_seconds:
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        return {'backend': 'memory', 'entries': len(self._entries), 'version': self.version,
+                'hits': self.hits, 'misses': self.misses}
+
+
+class SQLiteResultCache:
+    '''
+    Result cache in a local sqlite file, shared by every worker process
+    on the host. Same interface and eviction rules as LRUResultCache;
+    hit/miss counters are per process. Workers can be on different index
+    versions while they swap one after another, so a version change does
+    not purge other versions' rows (the version is part of every key);
+    they age out through the TTL and LRU eviction instead.
+    '''
+
+    def __init__(self, path, max_entries=10000, ttl_seconds=3600, version=''):
+        self.path = path
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.version = version
+        self.hits = 0
+        self.misses = 0
+        self._local = threading.local()
+        with self._connect() as conn:
+            conn.execute('CREATE TABLE IF NOT EXISTS results (key TEXT PRIMARY KEY, version TEXT, '
+                         'created REAL, used REAL, value TEXT)')
+            conn.execute('CREATE INDEX IF NOT EXISTS results_used ON results (used)')
+        self.set_version(version)
+
+    def _connect(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5)
+            conn.execute('PRAGMA journal_mode=WAL')
+            self._local.conn = conn
+        return conn
+
+    def set_version(self, version):
+        self.version = version
+        with self._connect() as conn:
+            conn.execute('DELETE FROM results WHERE created < ?', (time.time() - self.ttl_seconds,))
+
+    def get(self, key):
+        now = time.time()
+        with self._connect() as conn:
+            row = conn.execute('SELECT created, value FROM results WHERE key = ?', (key,)).fetchone()
+            if row is None or now - row[0] > self.ttl_seconds:
+                if row is not None:
+                    conn.execute('DELETE FROM results WHERE key = ?', (key,))
+                self.misses += 1
+                return None
+            conn.execute('UPDATE results SET used = ? WHERE key = ?', (now, key))
+        self.hits += 1
+        return json.loads(row[1])
+
+    def put(self, key, value):
+        now = time.time()
+        with self._connect() as conn:
+            conn.execute('INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?)',
+                         (key, self.version, now, now, json.dumps(value)))
+            conn.execute('DELETE FROM results WHERE key IN (SELECT key FROM results '
+                         'ORDER BY used DESC LIMIT -1 OFFSET ?)', (self.max_entries,))
+
+    def stats(self):
+        with self._connect() as conn:
+            entries = conn.execute('SELECT COUNT(*) FROM results').fetchone()[0]
+        return {'backend': 'sqlite', 'entries': entries, 'version': self.version,
+                'hits': self.hits, 'misses': self.misses}
+
+
+def make_result_cache(result_cache : dict, sqlite_path : str, version : str) :
+    '''
+    Result cache configured by the result_cache section of params.yaml,
+    or None when caching is disabled
+    '''
+    if not result_cache['enabled']:
+        return None
+    kwargs = dict(max_entries=result_cache['max_entries'],
+                  ttl_seconds=result_cache['ttl_seconds'], version=version)
+    if result_cache['backend'] == 'sqlite':
+        logging.info(f"Using sqlite result cache at {sqlite_path}")
+        return SQLiteResultCache(sqlite_path, **kwargs)
+    return LRUResultCache(**kwargs)
@@ -0,0 +1,82 @@
+import logging
+import numpy as np
+
+
+def normalize_rows(matrix):
+    '''
+    L2-normalize every row of a 2-D array into a contiguous float32 matrix.
+    Zero rows are left as zeros instead of producing NaNs.
+    '''
+    matrix = np.ascontiguousarray(matrix, dtype=np.float32)
+    norms = np.linalg.norm(matrix, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return matrix / norms
+
+
+def top_k_indices(scores, k):
+    '''
+    Return the indices of the k largest scores, best first.
+    Uses argpartition so only the k winners get sorted.
+    '''
+    k = min(k, scores.shape[0])
+    if k <= 0:
+        return np.empty(0, dtype=np.int64)
+    if k < scores.shape[0]:
+        candidates = np.argpartition(-scores, k - 1)[:k]
+    else:
+        candidates = np.arange(scores.shape[0])
+    return candidates[np.argsort(-scores[candidates], kind='stable')]
+
+
+class SimilaritySearch:
+    '''
+    Exact cosine-similarity search over the gallery embeddings.
+    The gallery is normalized once at load time so a query is a
+    single matrix-vector product followed by a top-k selection.
+    Pass normalized=True for an already normalized float32 matrix
+    (e.g. a memory-mapped embedding store) to use it without copying.
+    '''
+
+    def __init__(self, feature_list, normalized=False):
+        if len(feature_list) == 0:
+            raise ValueError("Cannot build a search index from an empty feature list")
+        if normalized:
+            self.matrix = feature_list
+        elif isinstance(feature_list, np.ndarray):
+            self.matrix = normalize_rows(feature_list.reshape(len(feature_list), -1))
+        else:
+            self.matrix = normalize_rows(np.vstack([np.ravel(f) for f in feature_list]))
+        logging.info(f"Search index ready with {self.matrix.shape[0]} rows of dim {self.matrix.shape[1]}")
+
+    def __len__(self):
+        return self.matrix.shape[0]
+
+    def search(self, features, k=1, threshold=None):
+        '''
+        Find the k gallery rows most similar to the query features.
+        Input : features - 1-D query embedding
+                k - number of matches to return
+                threshold - drop matches scoring below this cosine similarity
+        Output : list of (index_pos, score) tuples, best first
+        '''
+        query = normalize_rows(np.reshape(features, (1, -1)))[0]
+        scores = self.matrix @ query
+        indices = top_k_indices(scores, k)
+        matches = [(int(i), float(scores[i])) for i in indices]
+        if threshold is not None:
+            matches = [m for m in matches if m[1] >= threshold]
+        return matches
+
+    def search_batch(self, queries, k=1, threshold=None):
+        '''
+        search() for a (n_queries, dim) matrix of queries at once,
+        scored with one matrix-matrix product
+        '''
+        scores = normalize_rows(np.reshape(queries, (len(queries), -1))) @ self.matrix.T
+        results = []
+        for row in scores:
+            matches = [(int(i), float(row[i])) for i in top_k_indices(row, k)]
+            if threshold is not None:
+                matches = [m for m in matches if m[1] >= threshold]
+            results.append(matches)
+        return results
@@ -0,0 +1,235 @@
+import http.client
+import json
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+import numpy as np
+from src.utils.embedding_store import HEADER_FILE, EmbeddingStore
+from src.utils.search import SimilaritySearch
+
+
+def shard_bounds(count : int, num_shards : int, shard_id : int) -> tuple :
+    '''
+    Row range [start, end) of one of num_shards contiguous, near-equal shards
+    '''
+    size, extra = divmod(count, num_shards)
+    start = shard_id * size + min(shard_id, extra)
+    return start, start + size + (1 if shard_id < extra else 0)
+
+
+def shard_endpoints(sharding : dict) -> list :
+    '''
+    Shard URLs from the sharding section of params.yaml: the explicit
+    endpoints list, or num_shards local ports counting up from base_port
+    '''
+    if sharding.get('endpoints'):
+        return list(sharding['endpoints'])
+    return [f"http://{sharding['host']}:{sharding['base_port'] + i}" for i in range(sharding['num_shards'])]
+
+
+class ShardIndex:
+    '''
+    Exact search over one row range of the embedding store. The matrix is
+    memory-mapped, so a shard process only pages in its own rows. The store
+    is reopened when its header changes, checked at most every poll_seconds.
+    '''
+
+    def __init__(self, store_dir, shard_id, num_shards, poll_seconds=5.0):
+        self.store_dir = store_dir
+        self.shard_id = shard_id
+        self.num_shards = num_shards
+        self.poll_seconds = poll_seconds
+        self._lock = threading.Lock()
+        self._stamp = None
+        self._checked = 0.0
+        self._state = None
+        self._reload()
+
+    def _header_stamp(self):
+        stat = os.stat(os.path.join(self.store_dir, HEADER_FILE))
+        return stat.st_mtime_ns, stat.st_size
+
+    def _reload(self):
+        stamp = self._header_stamp()
+        store = EmbeddingStore.open(self.store_dir)
+        start, end = shard_bounds(len(store), self.num_shards, self.shard_id)
+        self._state = (store.version, start, SimilaritySearch(store.matrix[start:end], normalized=True))
+        self._stamp = stamp
+        logging.info(f"Shard {self.shard_id}/{self.num_shards} serving rows {start}-{end} of {store.version}")
+
+    def state(self):
+        now = time.monotonic()
+        if now - self._checked >= self.poll_seconds:
+            with self._lock:
+                self._checked = now
+                try:
+                    if self._header_stamp() != self._stamp:
+                        self._reload()
+                except (OSError, ValueError) as e:
+                    logging.warning(f"Shard {self.shard_id} keeps serving its last store: {e}")
+        return self._state
+
+    def search_batch(self, queries, k, threshold):
+        version, offset, index = self.state()
+        results = index.search_batch(queries, k=k, threshold=threshold)
+        return version, [[(i + offset, score) for i, score in matches] for matches in results]
+
+
+class _ShardHandler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    # Headers and body go out in separate writes; Nagle would hold the body for a delayed ACK
+    disable_nagle_algorithm = True
+
+    def do_POST(self):
+        url = urlparse(self.path)
+        if url.path != '/search':
+            self.send_error(404)
+            return
+        args = parse_qs(url.query)
+        body = self.rfile.read(int(self.headers['Content-Length']))
+        queries = np.frombuffer(body, dtype='<f4').reshape(int(args['n'][0]), -1)
+        threshold = float(args['threshold'][0]) if 'threshold' in args else None
+        version, results = self.server.index.search_batch(queries, int(args['k'][0]), threshold)
+        payload = json.dumps({'shard': self.server.index.shard_id, 'version': version,
+                              'results': results}).encode()
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def run_shard_server(store_dir, shard_id, num_shards, host='127.0.0.1', port=8100, poll_seconds=5.0):
+    '''
+    Serve one gallery shard over HTTP until interrupted.
+    POST /search?n=<queries>&k=<k>[&threshold=<t>] with the raw little-endian
+    float32 query matrix as body returns the shard's top-k per query as
+    global row positions, plus the store version it searched.
+    '''
+    server = ThreadingHTTPServer((host, port), _ShardHandler)
+    server.daemon_threads = True
+    server.index = ShardIndex(store_dir, shard_id, num_shards, poll_seconds)
+    logging.info(f"Shard {shard_id} listening on {host}:{port}")
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+
+
+class ShardsUnavailableError(RuntimeError):
+    '''
+    Raised when fewer shards than min_shards answered a search
+    '''
+
+
+class PartialResults(list):
+    '''
+    search_batch results, with the shards that did not answer in time
+    '''
+
+    def __init__(self, results, missing_shards):
+        super().__init__(results)
+        self.missing_shards = missing_shards
+
+
+_pool_lock = threading.Lock()
+_pool, _pool_size = None, 0
+
+
+def shard_pool(workers : int) -> ThreadPoolExecutor :
+    '''
+    Thread pool shared by every ShardedSearch in the process, so a live
+    index swap reuses the threads instead of leaving a pool behind. It is
+    only replaced when more workers are needed; the idle threads of the
+    old pool exit once the searches still holding it are gone.
+    '''
+    global _pool, _pool_size
+    with _pool_lock:
+        if _pool is None or _pool_size < workers:
+            _pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='shard')
+            _pool_size = workers
+        return _pool
+
+
+class ShardedSearch:
+    '''
+    Scatter-gather search over shard servers. Every query batch is sent to
+    all shards in parallel and their per-shard top-k merged into a global
+    top-k. Shards that fail, time out or answer for another store version
+    are left out of the merge and listed in missing_shards; fewer than
+    min_shards answers raise ShardsUnavailableError.
+    '''
+
+    def __init__(self, endpoints, version, timeout_ms=200, min_shards=1):
+        self.endpoints = [urlparse(endpoint) for endpoint in endpoints]
+        self.version = version
+        self.timeout = timeout_ms / 1000.0
+        self.min_shards = min(min_shards, len(self.endpoints))
+        self._local = threading.local()
+        self._pool = shard_pool(len(self.endpoints) * 4)
+
+    def _connection(self, shard):
+        connections = self._local.__dict__.setdefault('connections', {})
+        if shard not in connections:
+            endpoint = self.endpoints[shard]
+            connections[shard] = http.client.HTTPConnection(endpoint.hostname, endpoint.port,
+                                                            timeout=self.timeout)
+        return connections[shard]
+
+    def _query_shard(self, shard, body, n, k, threshold):
+        query = f"/search?n={n}&k={k}" + (f"&threshold={threshold}" if threshold is not None else '')
+        connection = self._connection(shard)
+        try:
+            connection.request('POST', query, body=body, headers={'Content-Type': 'application/octet-stream'})
+            response = connection.getresponse()
+            payload = response.read()
+        except Exception:
+            # Drop the connection so the next request starts clean
+            connection.close()
+            self._local.connections.pop(shard, None)
+            raise
+        if response.status != 200:
+            raise RuntimeError(f"shard {shard} answered {response.status}")
+        return json.loads(payload)
+
+    def search_batch(self, queries, k=1, threshold=None):
+        queries = np.ascontiguousarray(np.reshape(queries, (len(queries), -1)), dtype='<f4')
+        body = queries.tobytes()
+        futures = {self._pool.submit(self._query_shard, shard, body, len(queries), k, threshold): shard
+                   for shard in range(len(self.endpoints))}
+        done, _ = wait(futures, timeout=self.timeout)
+
+        merged = [[] for _ in range(len(queries))]
+        missing = []
+        for future, shard in futures.items():
+            if future not in done:
+                missing.append(shard)
+                continue
+            try:
+                answer = future.result()
+            except Exception as e:
+                logging.warning(f"Shard {shard} failed: {e}")
+                missing.append(shard)
+                continue
+            if answer['version'] != self.version:
+                logging.warning(f"Shard {shard} serves {answer['version']}, expected {self.version}")
+                missing.append(shard)
+                continue
+            for matches, shard_matches in zip(merged, answer['results']):
+                matches.extend((int(i), float(score)) for i, score in shard_matches)
+
+        answered = len(self.endpoints) - len(missing)
+        if answered < self.min_shards:
+            raise ShardsUnavailableError(f"Only {answered} of {len(self.endpoints)} shards answered")
+        results = [sorted(matches, key=lambda m: m[1], reverse=True)[:k] for matches in merged]
+        return PartialResults(results, sorted(missing))
+
+    def search(self, features, k=1, threshold=None):
+        return self.search_batch(np.reshape(features, (1, -1)), k=k, threshold=threshold)[0]
@@ -0,0 +1,88 @@
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+from PIL import Image
+
+GALLERY_IDS_FILE = 'gallery_ids.txt'
+VERSION_PREFIX = '# store_version '
+ID_LENGTH = 20
+
+
+def gallery_id(content_hash : str) -> str :
+    '''
+    Stable, content-addressed ID of a gallery image
+    '''
+    return content_hash[:ID_LENGTH]
+
+
+def thumbnail_path(gallery_dir : str, image_id : str, size : int) -> str :
+    return os.path.join(gallery_dir, str(size), f"{image_id}.webp")
+
+
+def _write_thumbnails(src_path, image_id, gallery_dir, sizes, quality):
+    targets = [(size, thumbnail_path(gallery_dir, image_id, size)) for size in sizes]
+    targets = [(size, path) for size, path in targets if not os.path.exists(path)]
+    if not targets:
+        return 0
+    with Image.open(src_path) as img:
+        img = img.convert('RGB')
+        for size, path in sorted(targets, reverse=True):
+            img.thumbnail((size, size))
+            img.save(path + '.tmp', format='WEBP', quality=quality)
+            os.replace(path + '.tmp', path)
+    return len(targets)
+
+
+def build_thumbnails(filenames, content_hashes, gallery_dir, sizes, store_version, quality=80, num_workers=4):
+    '''
+    Write WebP thumbnails for every gallery image under
+    <gallery_dir>/<size>/<id>.webp and the row-aligned ID list.
+    Thumbnails that already exist are kept, so reruns only touch new images.
+    Input : filenames - gallery image paths in embedding store order
+            content_hashes - content hash of each image
+            sizes - longest-side sizes in pixels
+            store_version - version of the embedding store the rows belong to
+    Output : list of gallery IDs aligned with filenames
+    '''
+    for size in sizes:
+        os.makedirs(os.path.join(gallery_dir, str(size)), exist_ok=True)
+    ids = [gallery_id(content_hash) for content_hash in content_hashes]
+
+    written, failed = 0, 0
+    with ThreadPoolExecutor(max_workers=num_workers) as pool:
+        futures = [pool.submit(_write_thumbnails, path, image_id, gallery_dir, sizes, quality)
+                   for path, image_id in zip(filenames, ids)]
+        for path, future in zip(filenames, futures):
+            try:
+                written += future.result()
+            except Exception as e:
+                failed += 1
+                logging.warning(f"Could not thumbnail {path}: {str(e)}")
+
+    ids_path = os.path.join(gallery_dir, GALLERY_IDS_FILE)
+    with open(ids_path + '.tmp', 'w') as f:
+        f.write(f"{VERSION_PREFIX}{store_version}\n")
+        f.write('\n'.join(ids) + '\n')
+    os.replace(ids_path + '.tmp', ids_path)
+    logging.info(f"Wrote {written} thumbnails for {len(ids)} gallery images ({failed} failed)")
+    return ids
+
+
+def load_gallery_ids(gallery_dir, store_version, expected_count):
+    '''
+    Row-aligned gallery IDs, or None when thumbnails have not been
+    built for the current embedding store
+    '''
+    ids_path = os.path.join(gallery_dir, GALLERY_IDS_FILE)
+    if not os.path.exists(ids_path):
+        return None
+    with open(ids_path) as f:
+        header = f.readline().rstrip('\n')
+        ids = f.read().split()
+    if header != f"{VERSION_PREFIX}{store_version}":
+        logging.warning(f"{ids_path} was written for another embedding store version, ignoring it")
+        return None
+    if len(ids) != expected_count:
+        logging.warning(f"{ids_path} has {len(ids)} IDs for {expected_count} gallery rows, ignoring it")
+        return None
+    return ids
@@ -0,0 +1,72 @@
+import numpy as np
+import pytest
+from src.utils.ann_index import IVFIndex, assign_to_centroids, cluster_sums, spherical_kmeans
+from src.utils.search import SimilaritySearch, normalize_rows
+
+
+@pytest.fixture
+def clustered():
+    # 8 well separated clusters of 40 rows on the unit sphere
+    rng = np.random.default_rng(0)
+    centers = normalize_rows(rng.standard_normal((8, 32)))
+    rows = np.repeat(centers, 40, axis=0) + 0.05 * rng.standard_normal((320, 32))
+    return normalize_rows(rows), centers
+
+
+def test_cluster_sums_matches_add_at():
+    rng = np.random.default_rng(1)
+    rows = rng.standard_normal((100, 6)).astype(np.float32)
+    assignments = rng.integers(0, 7, 100)
+    assignments[assignments == 3] = 4
+    expected = np.zeros((7, 6), dtype=np.float32)
+    np.add.at(expected, assignments, rows)
+    np.testing.assert_allclose(cluster_sums(rows, assignments, 7), expected, rtol=1e-5, atol=1e-5)
+    assert not cluster_sums(rows[:0], assignments[:0], 7).any()
+
+
+def test_spherical_kmeans_recovers_clusters(clustered):
+    rows, centers = clustered
+    centroids = spherical_kmeans(rows, 8, n_iter=10, seed=0)
+    np.testing.assert_allclose(np.linalg.norm(centroids, axis=1), 1.0, rtol=1e-5)
+    # Every true cluster ends up in a cluster of its own
+    assignments = assign_to_centroids(rows, centroids)
+    assert len({tuple(np.unique(assignments[i:i + 40])) for i in range(0, 320, 40)}) == 8
+    assert all(len(np.unique(assignments[i:i + 40])) == 1 for i in range(0, 320, 40))
+
+
+def test_ivf_lists_partition_the_rows(clustered):
+    rows, _ = clustered
+    index = IVFIndex.build(rows, nlist=8, n_iter=10)
+    assert index.list_offsets[-1] == len(rows)
+    assert sorted(index.list_ids) == list(range(len(rows)))
+
+
+def test_ivf_search_matches_exact_search_when_probing_every_list(clustered):
+    rows, _ = clustered
+    index = IVFIndex.build(rows, nlist=8, n_iter=10, nprobe=8)
+    exact = SimilaritySearch(rows, normalized=True)
+    queries = np.random.default_rng(2).standard_normal((5, 32)).astype(np.float32)
+    for query, matches in zip(queries, index.search_batch(queries, k=5)):
+        assert [i for i, _ in matches] == [i for i, _ in exact.search(query, k=5)]
+
+
+def test_ivf_search_finds_near_duplicates_with_one_probe(clustered):
+    rows, _ = clustered
+    index = IVFIndex.build(rows, nlist=8, n_iter=10, nprobe=1)
+    assert [index.search(rows[i], k=1)[0][0] for i in range(0, 320, 37)] == list(range(0, 320, 37))
+    assert index.search(rows[0], k=3, threshold=2.0) == []
+
+
+def test_save_and_load_check_the_store_version(clustered, tmp_path):
+    rows, _ = clustered
+    path = str(tmp_path / 'ann_index.npz')
+    index = IVFIndex.build(rows, nlist=8, n_iter=5)
+    index.save(path, 'resnet50/avg/1')
+
+    loaded = IVFIndex.load(path, rows, 'resnet50/avg/1', nprobe=2)
+    np.testing.assert_array_equal(loaded.list_ids, index.list_ids)
+    assert loaded.search(rows[5], k=1) == index.search(rows[5], k=1, nprobe=2)
+    with pytest.raises(ValueError):
+        IVFIndex.load(path, rows, 'resnet50/avg/2')
+    with pytest.raises(ValueError):
+        IVFIndex.load(path, rows[:-1], 'resnet50/avg/1')
@@ -0,0 +1,75 @@
+import asyncio
+import numpy as np
+import pytest
+from src.utils.batching import InferenceBatcher
+
+
+def run_with_batcher(batcher, body):
+    async def main():
+        batcher.start()
+        try:
+            return await body()
+        finally:
+            await batcher.stop()
+    return asyncio.run(main())
+
+
+def test_concurrent_submits_share_one_batch():
+    calls = []
+
+    def predict(batch):
+        calls.append(batch.shape)
+        return batch * 2
+
+    batcher = InferenceBatcher(predict, max_batch_size=8, max_wait_ms=50)
+    inputs = [np.full(3, i, dtype=np.float32) for i in range(5)]
+    outputs = run_with_batcher(batcher, lambda: asyncio.gather(*[batcher.submit(x) for x in inputs]))
+    assert calls == [(5, 3)]
+    for x, y in zip(inputs, outputs):
+        np.testing.assert_array_equal(y, x * 2)
+    assert batcher.stats()['batch_size_distribution'] == {5: 1}
+
+
+def test_batches_are_capped_at_max_batch_size():
+    sizes = []
+
+    def predict(batch):
+        sizes.append(len(batch))
+        return batch
+
+    batcher = InferenceBatcher(predict, max_batch_size=4, max_wait_ms=50)
+    outputs = run_with_batcher(batcher, lambda: asyncio.gather(*[batcher.submit(np.array([i])) for i in range(10)]))
+    assert sizes == [4, 4, 2]
+    assert [int(y[0]) for y in outputs] == list(range(10))
+    assert batcher.batches_run == 3
+
+
+def test_a_lone_request_waits_at_most_max_wait():
+    batcher = InferenceBatcher(lambda batch: batch, max_batch_size=16, max_wait_ms=20)
+
+    async def body():
+        loop = asyncio.get_running_loop()
+        start = loop.time()
+        await batcher.submit(np.zeros(2))
+        return loop.time() - start
+
+    assert run_with_batcher(batcher, body) < 1.0
+    assert batcher.batch_sizes == {1: 1}
+
+
+def test_a_failing_batch_fails_its_requests_only():
+    def predict(batch):
+        if (batch < 0).any():
+            raise RuntimeError("bad input")
+        return batch
+
+    batcher = InferenceBatcher(predict, max_batch_size=2, max_wait_ms=50)
+
+    async def body():
+        failed = await asyncio.gather(batcher.submit(np.array([-1.0])), batcher.submit(np.array([1.0])),
+                                      return_exceptions=True)
+        return failed, await batcher.submit(np.array([3.0]))
+
+    failed, later = run_with_batcher(batcher, body)
+    assert all(isinstance(result, RuntimeError) for result in failed)
+    assert later[0] == pytest.approx(3.0)
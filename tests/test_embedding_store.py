@@ -0,0 +1,73 @@
+import json
+import os
+import numpy as np
+import pytest
+from src.utils.embedding_store import (EMBEDDINGS_FILE, HEADER_FILE, MANIFEST_FILE, EmbeddingStore, label_from_path,
+                                       store_version, write_embedding_store)
+
+
+def write(store_dir, rows, seed=0):
+    features = np.random.default_rng(seed).standard_normal((rows, 8)).astype(np.float32)
+    filenames = [f"data/Star_{i % 3}/{i}.jpg" for i in range(rows)]
+    return features, filenames, write_embedding_store(store_dir, features, filenames, 'resnet50', 'avg')
+
+
+def test_round_trip(tmp_path):
+    features, filenames, header = write(str(tmp_path), 6)
+    store = EmbeddingStore.open(str(tmp_path))
+    assert len(store) == 6 and store.filenames == filenames
+    assert store.labels[4] == 'Star 1' == label_from_path(filenames[4])
+    assert isinstance(store.matrix, np.memmap)
+    np.testing.assert_allclose(np.linalg.norm(store.matrix, axis=1), 1.0, rtol=1e-5)
+    np.testing.assert_allclose(store.matrix, features / np.linalg.norm(features, axis=1, keepdims=True),
+                               rtol=1e-5)
+    assert store.version == store_version(header)
+
+
+def test_mismatched_filenames_are_rejected(tmp_path):
+    with pytest.raises(ValueError):
+        write_embedding_store(str(tmp_path), np.ones((3, 8)), ['a/b.jpg'], 'resnet50', 'avg')
+
+
+def test_reader_of_the_previous_header_still_opens_its_build(tmp_path):
+    store_dir = str(tmp_path)
+    _, old_files, _ = write(store_dir, 4)
+    with open(os.path.join(store_dir, HEADER_FILE)) as f:
+        old_header = f.read()
+
+    # A rebuild lands between a reader loading the header and opening the data
+    write(store_dir, 7, seed=1)
+    assert len(EmbeddingStore.open(store_dir)) == 7
+    with open(os.path.join(store_dir, HEADER_FILE), 'w') as f:
+        f.write(old_header)
+    store = EmbeddingStore.open(store_dir)
+    assert len(store) == 4 and store.filenames == old_files
+
+
+def test_builds_older_than_the_previous_one_are_deleted(tmp_path):
+    store_dir = str(tmp_path)
+    for seed in range(4):
+        write(store_dir, 3 + seed, seed=seed)
+    data_files = [name for name in os.listdir(store_dir) if name != HEADER_FILE]
+    assert len(data_files) == 4
+    with open(os.path.join(store_dir, HEADER_FILE)) as f:
+        header = json.load(f)
+    assert {header['embeddings_file'], header['manifest_file']} <= set(data_files)
+
+
+def test_stores_written_with_fixed_file_names_still_open(tmp_path):
+    store_dir = str(tmp_path)
+    write(store_dir, 5)
+    with open(os.path.join(store_dir, HEADER_FILE)) as f:
+        header = json.load(f)
+    os.replace(os.path.join(store_dir, header.pop('embeddings_file')), os.path.join(store_dir, EMBEDDINGS_FILE))
+    os.replace(os.path.join(store_dir, header.pop('manifest_file')), os.path.join(store_dir, MANIFEST_FILE))
+    with open(os.path.join(store_dir, HEADER_FILE), 'w') as f:
+        json.dump(header, f)
+    assert len(EmbeddingStore.open(store_dir)) == 5
+
+    # The first rebuild keeps them as the previous build, the next one deletes them
+    write(store_dir, 6)
+    assert os.path.exists(os.path.join(store_dir, EMBEDDINGS_FILE))
+    write(store_dir, 6)
+    assert not os.path.exists(os.path.join(store_dir, EMBEDDINGS_FILE))
@@ -0,0 +1,69 @@
+import os
+import numpy as np
+from src.utils.face_cache import (STATUS_MULTIPLE, STATUS_NO_FACE, STATUS_OK, FaceCache, detector_tag,
+                                  get_face_cache_dir)
+
+DETECTION = {'backend': 'mtcnn', 'detect_max_side': 640, 'box_padding': 0.0, 'min_confidence': 0.5}
+
+
+def test_add_get_and_pending(tmp_path):
+    cache = FaceCache(str(tmp_path / 'faces'))
+    landmarks = np.arange(10, dtype=np.float32).reshape(5, 2)
+    cache.add('a' * 40, STATUS_OK, 1, (1, 2, 3, 4), 0.9, landmarks)
+    cache.add('b' * 40, STATUS_NO_FACE)
+    cache.add('a' * 40, STATUS_MULTIPLE, 2)
+    assert cache.pending == 2 and len(cache) == 2 and 'a' * 40 in cache
+
+    status, num_faces, box, confidence, got_landmarks = cache.get('a' * 40)
+    assert (status, num_faces, box, confidence) == (STATUS_OK, 1, (1, 2, 3, 4), 0.9)
+    np.testing.assert_array_equal(got_landmarks, landmarks)
+    assert cache.get('b' * 40)[:3] == (STATUS_NO_FACE, 0, (0, 0, 0, 0))
+    assert np.isnan(cache.get('b' * 40)[4]).all()
+    assert cache.get('c' * 40) is None
+
+
+def test_checkpoint_and_resume(tmp_path):
+    cache_dir = str(tmp_path / 'faces')
+    cache = FaceCache(cache_dir)
+    cache.add('a' * 40, STATUS_OK, 1, (1, 2, 3, 4), 0.9)
+    cache.checkpoint()
+    assert cache.pending == 0
+    cache.add('b' * 40, STATUS_MULTIPLE, 3, (5, 6, 7, 8), 0.8)
+    cache.checkpoint()
+    # Lost with an interrupted run
+    cache.add('c' * 40, STATUS_OK, 1, (0, 0, 1, 1), 0.7)
+
+    resumed = FaceCache(cache_dir)
+    assert len(resumed) == 2 and 'c' * 40 not in resumed
+    assert resumed.get('a' * 40)[:4] == (STATUS_OK, 1, (1, 2, 3, 4), np.float32(0.9))
+    assert resumed.get('b' * 40)[:3] == (STATUS_MULTIPLE, 3, (5, 6, 7, 8))
+    resumed.add('c' * 40, STATUS_OK, 1, (0, 0, 1, 1), 0.7)
+    resumed.checkpoint()
+    assert sorted(os.listdir(cache_dir)) == ['detections_000000.npz', 'detections_000001.npz',
+                                             'detections_000002.npz']
+
+
+def test_leftover_temporary_files_are_ignored(tmp_path):
+    cache_dir = str(tmp_path / 'faces')
+    cache = FaceCache(cache_dir)
+    cache.add('a' * 40, STATUS_OK, 1, (1, 2, 3, 4), 0.9)
+    cache.checkpoint()
+    with open(os.path.join(cache_dir, 'detections_000001.npz.tmp'), 'wb') as f:
+        f.write(b'partial')
+
+    resumed = FaceCache(cache_dir)
+    assert len(resumed) == 1
+    resumed.add('b' * 40, STATUS_NO_FACE)
+    resumed.checkpoint()
+    assert len(FaceCache(cache_dir)) == 2
+
+
+def test_detector_settings_get_their_own_namespace():
+    config = {'artifacts': {'artifacts_dir': 'artifacts', 'feature_extraction_dir': 'features',
+                            'feature_cache_dir': 'cache'}}
+    moved = dict(DETECTION, box_padding=0.1)
+    assert detector_tag(DETECTION) == detector_tag(dict(DETECTION))
+    assert detector_tag(DETECTION) != detector_tag(moved)
+    assert detector_tag(DETECTION).startswith('faces_mtcnn_')
+    path = get_face_cache_dir(config, {'detection': DETECTION})
+    assert os.path.dirname(path) == os.path.join('artifacts', 'features', 'cache')
@@ -0,0 +1,81 @@
+import numpy as np
+import pytest
+from src.utils import face_detection
+from src.utils.face_detection import FaceDetector, face_array, pad_and_clamp
+
+
+@pytest.mark.parametrize('box, padding, expected', [
+    ((10, 20, 30, 40), 0.0, (10, 20, 30, 40)),
+    ((10, 10, 30, 20), 0.1, (7, 8, 36, 24)),
+    # MTCNN can return negative coordinates near the border
+    ((-5, -8, 30, 40), 0.0, (0, 0, 25, 32)),
+    ((80, 40, 30, 40), 0.0, (80, 40, 20, 20)),
+    ((10, 20, 30, 40), 0.1, (7, 16, 36, 44)),
+    ((120, 70, 10, 10), 0.0, (120, 70, 0, 0)),
+])
+def test_pad_and_clamp(box, padding, expected):
+    assert pad_and_clamp(box, (60, 100, 3), padding) == expected
+
+
+def test_face_array_crops_and_resizes():
+    img = np.zeros((60, 100, 3), dtype=np.uint8)
+    img[10:30, 20:50] = 255
+    face = face_array(img, (20, 10, 30, 20), size=32)
+    assert face.shape == (32, 32, 3) and face.dtype == np.float32
+    assert face.min() == 255
+
+
+class FakeBackend:
+    '''
+    Returns fixed boxes in the coordinates of the image it was given
+    '''
+    seen_shapes = []
+
+    def __init__(self, detection):
+        pass
+
+    def detect(self, img):
+        FakeBackend.seen_shapes.append(img.shape)
+        return [((10, 5, 20, 25), 0.6, np.array([[15.0, 10.0]] * 5, dtype=np.float32)),
+                ((40, 30, 10, 10), 0.9, None),
+                ((0, 0, 5, 5), 0.1, None)]
+
+
+@pytest.fixture
+def make_detector(monkeypatch):
+    monkeypatch.setitem(face_detection.BACKENDS, 'fake', FakeBackend)
+    FakeBackend.seen_shapes = []
+
+    def make(detect_max_side=0, box_padding=0.0, min_confidence=0.5):
+        return FaceDetector({'backend': 'fake', 'detect_max_side': detect_max_side,
+                             'box_padding': box_padding, 'min_confidence': min_confidence})
+    return make
+
+
+def test_boxes_are_filtered_and_sorted(make_detector):
+    detector = make_detector()
+    img = np.zeros((50, 60, 3), dtype=np.uint8)
+    assert detector.detect(img) == [((40, 30, 10, 10), 0.9), ((10, 5, 20, 25), 0.6)]
+    assert FakeBackend.seen_shapes == [img.shape]
+
+
+def test_boxes_from_the_downscaled_image_map_to_full_resolution(make_detector):
+    detector = make_detector(detect_max_side=100)
+    img = np.zeros((200, 400, 3), dtype=np.uint8)
+    faces = detector.detect_landmarks(img)
+    # Detection ran at a quarter of the size; boxes and landmarks scale back by 4
+    assert FakeBackend.seen_shapes == [(50, 100, 3)]
+    assert [box for box, _, _ in faces] == [(160, 120, 40, 40), (40, 20, 80, 100)]
+    np.testing.assert_allclose(faces[1][2], [[60.0, 40.0]] * 5)
+
+
+def test_mapped_boxes_are_padded_and_clamped(make_detector):
+    detector = make_detector(detect_max_side=100, box_padding=0.5)
+    img = np.zeros((200, 400, 3), dtype=np.uint8)
+    assert detector.detect(img)[0][0] == (140, 100, 80, 80)
+    assert detector.detect(img)[1][0] == (0, 0, 160, 170)
+
+
+def test_unknown_backend_is_rejected():
+    with pytest.raises(ValueError):
+        FaceDetector({'backend': 'nope', 'detect_max_side': 0, 'box_padding': 0, 'min_confidence': 0})
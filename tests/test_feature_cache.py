@@ -0,0 +1,136 @@
+import json
+import os
+import numpy as np
+from src.utils.feature_cache import FeatureCache, file_content_hash, hash_files
+
+
+def make_features(n, dim=8, seed=0):
+    return np.random.default_rng(seed).standard_normal((n, dim)).astype(np.float32)
+
+
+def test_interrupted_checkpoint_is_ignored_and_removed(tmp_path):
+    cache = FeatureCache(str(tmp_path), 'model', 'avg')
+    cache.add(['a', 'b'], make_features(2))
+    cache.checkpoint()
+
+    # A crash between writing the temporary file and renaming it, by this
+    # version and by the earlier one that used a .tmp.npz suffix
+    stale = [os.path.join(cache.cache_dir, 'shard_00_000001.npz.tmp'),
+             os.path.join(cache.cache_dir, 'shard_00_000002.npz.tmp.npz')]
+    for path in stale:
+        with open(path, 'wb') as f:
+            f.write(b'partial')
+
+    resumed = FeatureCache(str(tmp_path), 'model', 'avg')
+    assert 'a' in resumed and 'b' in resumed
+    assert not any(os.path.exists(path) for path in stale)
+
+    resumed.add(['c'], make_features(1, seed=1))
+    resumed.checkpoint()
+    assert sorted(os.listdir(resumed.cache_dir)) == ['shard_00_000000.npz', 'shard_00_000001.npz']
+
+
+def test_other_writers_temporary_files_are_left_alone(tmp_path):
+    cache = FeatureCache(str(tmp_path), 'model', 'avg', writer_id=1)
+    in_progress = os.path.join(cache.cache_dir, 'shard_02_000000.npz.tmp')
+    with open(in_progress, 'wb') as f:
+        f.write(b'partial')
+
+    FeatureCache(str(tmp_path), 'model', 'avg', writer_id=1)
+    assert os.path.exists(in_progress)
+
+
+def test_prune_with_a_hash_in_two_shards(tmp_path):
+    # Two concurrent writers can embed the same image content, one shard each
+    writers = [FeatureCache(str(tmp_path), 'model', 'avg', writer_id=writer_id) for writer_id in (0, 1)]
+    for writer_id, cache in enumerate(writers):
+        cache.add(['dup', f'gone_{writer_id}', f'own_{writer_id}'], make_features(3, seed=writer_id))
+        cache.checkpoint()
+
+    cache = FeatureCache(str(tmp_path), 'model', 'avg')
+    cache.prune(['own_0', 'own_1'])
+    assert 'dup' not in cache and 'gone_0' not in cache
+    assert 'own_0' in cache and 'own_1' in cache
+    assert FeatureCache(str(tmp_path), 'model', 'avg').gather(['own_0', 'own_1']).shape == (2, 8)
+
+
+def test_checkpoint_and_resume(tmp_path):
+    features = make_features(5)
+    cache = FeatureCache(str(tmp_path), 'model', 'avg')
+    cache.add(['a', 'b', 'c'], features[:3])
+    assert cache.pending == 3 and 'a' not in cache
+    cache.checkpoint()
+    assert cache.pending == 0 and 'a' in cache
+    # An interrupted run keeps every completed checkpoint and drops the rest
+    cache.add(['d', 'e'], features[3:])
+
+    resumed = FeatureCache(str(tmp_path), 'model', 'avg')
+    assert all(h in resumed for h in 'abc') and 'd' not in resumed
+    resumed.add(['a', 'd', 'e'], [features[0] + 1, features[3], features[4]])
+    assert resumed.pending == 2
+    resumed.checkpoint()
+
+    np.testing.assert_array_equal(FeatureCache(str(tmp_path), 'model', 'avg').gather(list('edcba')),
+                                  features[::-1])
+
+
+def test_namespaces_are_separate(tmp_path):
+    cache = FeatureCache(str(tmp_path), 'model', 'avg')
+    cache.add(['a'], make_features(1))
+    cache.checkpoint()
+    assert 'a' not in FeatureCache(str(tmp_path), 'model', 'max')
+
+
+def test_prune_drops_dead_rows(tmp_path):
+    features = make_features(4)
+    cache = FeatureCache(str(tmp_path), 'model', 'avg')
+    cache.add(['a', 'b'], features[:2])
+    cache.checkpoint()
+    cache.add(['c', 'd'], features[2:])
+    cache.checkpoint()
+
+    cache.prune(['a', 'c', 'd'])
+    assert 'b' not in cache
+    assert len(os.listdir(cache.cache_dir)) == 2
+    cache.prune(['a'])
+    assert len(os.listdir(cache.cache_dir)) == 1
+
+    resumed = FeatureCache(str(tmp_path), 'model', 'avg')
+    assert [h for h in 'abcd' if h in resumed] == ['a']
+    np.testing.assert_array_equal(resumed.gather(['a']), features[:1])
+
+
+def test_hash_files_replace_or_merge_the_index(tmp_path):
+    paths = []
+    for name in ('a', 'b', 'c'):
+        paths.append(str(tmp_path / f"{name}.jpg"))
+        with open(paths[-1], 'wb') as f:
+            f.write(name.encode())
+    index_path = str(tmp_path / 'file_hashes.json')
+
+    assert hash_files(paths + [str(tmp_path / 'missing.jpg')], index_path)[:3] == \
+        [file_content_hash(path) for path in paths]
+    hash_files(paths[:1], index_path, merge=True)
+    with open(index_path) as f:
+        assert sorted(json.load(f)) == paths
+    hash_files(paths[:1], index_path)
+    with open(index_path) as f:
+        assert sorted(json.load(f)) == paths[:1]
+
+
+def test_hash_files_trusts_given_stats(tmp_path):
+    path = str(tmp_path / 'a.jpg')
+    with open(path, 'wb') as f:
+        f.write(b'first')
+    index_path = str(tmp_path / 'file_hashes.json')
+    stat = os.stat(path)
+    first = hash_files([path], index_path, stats=[(stat.st_size, stat.st_mtime_ns)])
+    assert first == [file_content_hash(path)]
+
+    with open(path, 'wb') as f:
+        f.write(b'second')
+    os.utime(path, ns=(stat.st_mtime_ns + 10 ** 9, stat.st_mtime_ns + 10 ** 9))
+    # The stats of the scan are trusted over the file, a None entry is stat-ed
+    assert hash_files([path], index_path, stats=[(stat.st_size, stat.st_mtime_ns)]) == first
+    assert hash_files([path], index_path, stats=[None]) == [file_content_hash(path)]
+    assert hash_files([str(tmp_path / 'gone.jpg')], index_path, stats=[(1, 1)]) == [None]
@@ -0,0 +1,71 @@
+import io
+import os
+import pickle
+import pytest
+from PIL import Image
+from src.utils.gallery_scan import (get_manifest_path, iter_gallery_paths, iter_manifest, load_gallery_paths,
+                                    scan_gallery, sniff_format, write_manifest)
+
+
+def image_bytes(fmt, size=(4, 3)):
+    buffer = io.BytesIO()
+    Image.new('RGB', size).save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+@pytest.mark.parametrize('fmt', ['JPEG', 'PNG', 'BMP', 'GIF', 'WEBP'])
+def test_sniff_format(fmt):
+    assert sniff_format(image_bytes(fmt)[:16]) == fmt
+
+
+@pytest.mark.parametrize('head', [b'', b'hello world', b'RIFF\0\0\0\0WAVE', b'<html>'])
+def test_sniff_format_rejects_other_files(head):
+    assert sniff_format(head) is None
+
+
+def make_gallery(root):
+    files = {
+        'alice/1.jpg': image_bytes('JPEG', (8, 6)),
+        'alice/2.png': image_bytes('PNG'),
+        'alice/notes.txt': b'text',
+        'bob/fake.jpg': b'not really a jpeg',
+        'bob/3.jpeg': image_bytes('JPEG'),
+        'bob/4.webp': image_bytes('WEBP'),
+    }
+    for name, data in files.items():
+        os.makedirs(os.path.join(root, os.path.dirname(name)), exist_ok=True)
+        with open(os.path.join(root, name), 'wb') as f:
+            f.write(data)
+    os.makedirs(os.path.join(root, 'bob', 'nested'))
+
+
+def test_scan_gallery_keeps_real_images_in_order(tmp_path):
+    make_gallery(str(tmp_path))
+    results = list(scan_gallery(str(tmp_path), ['.jpg', '.jpeg', '.png'], num_workers=2, max_in_flight=1))
+    records = [record for record, _ in results[:-1]]
+    assert [os.path.relpath(r['path'], tmp_path) for r in records] == \
+        [os.path.join('alice', '1.jpg'), os.path.join('alice', '2.png'), os.path.join('bob', '3.jpeg')]
+    assert (records[0]['width'], records[0]['height']) == (8, 6)
+    assert records[0]['size'] == os.path.getsize(records[0]['path'])
+    assert results[-1] == (None, {'extension': 2, 'magic': 1, 'not a file': 1})
+
+
+def test_manifest_round_trip(tmp_path):
+    config = {'artifacts': {'artifacts_dir': str(tmp_path / 'artifacts'), 'pickle_format_data_dir': 'data',
+                            'gallery_manifest_name': 'manifest.jsonl', 'img_pickle_file_name': 'img.pkl'}}
+    records = [{'path': f"data/p/{i}.jpg", 'label': 'p', 'size': i, 'mtime_ns': 10 * i} for i in range(3)]
+    assert write_manifest(iter(records), get_manifest_path(config)) == 3
+    assert list(iter_manifest(get_manifest_path(config))) == records
+    assert list(iter_gallery_paths(config)) == [r['path'] for r in records]
+    assert load_gallery_paths(config) == ([r['path'] for r in records], [(0, 0), (1, 10), (2, 20)])
+
+
+def test_gallery_paths_fall_back_to_the_pickle(tmp_path):
+    config = {'artifacts': {'artifacts_dir': str(tmp_path), 'pickle_format_data_dir': 'data',
+                            'gallery_manifest_name': 'manifest.jsonl', 'img_pickle_file_name': 'img.pkl'}}
+    with pytest.raises(FileNotFoundError):
+        load_gallery_paths(config)
+    os.makedirs(tmp_path / 'data')
+    with open(tmp_path / 'data' / 'img.pkl', 'wb') as f:
+        pickle.dump(['a.jpg', 'b.jpg'], f)
+    assert load_gallery_paths(config) == (['a.jpg', 'b.jpg'], [None, None])
@@ -0,0 +1,58 @@
+import numpy as np
+import pytest
+from src.utils.identity_index import IdentityIndex, write_identity_centroids
+from src.utils.search import SimilaritySearch, normalize_rows
+
+
+def make_identities(n_identities=6, per_identity=5, dim=16, seed=0):
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_identities, dim))
+    labels = np.repeat([f"person_{i}" for i in range(n_identities)], per_identity)
+    rows = np.repeat(centers, per_identity, axis=0) + 0.1 * rng.standard_normal((len(labels), dim))
+    order = rng.permutation(len(labels))
+    return normalize_rows(rows[order].astype(np.float32)), labels[order]
+
+
+def test_centroids_and_representatives(tmp_path):
+    matrix, labels = make_identities()
+    write_identity_centroids(str(tmp_path), matrix, labels, 'v1')
+    index = IdentityIndex.load(str(tmp_path), matrix, 'v1')
+
+    assert index.centroids.shape == (6, 16)
+    np.testing.assert_allclose(np.linalg.norm(index.centroids, axis=1), 1.0, rtol=1e-5)
+    for i, representative in enumerate(index.representatives):
+        members = np.flatnonzero(labels == f"person_{i}")
+        assert representative in members
+        scores = matrix[members] @ index.centroids[i]
+        assert representative == members[np.argmax(scores)]
+
+
+def test_reranked_search_matches_exact_search(tmp_path):
+    matrix, labels = make_identities()
+    write_identity_centroids(str(tmp_path), matrix, labels, 'v1')
+    index = IdentityIndex.load(str(tmp_path), matrix, 'v1', top_m=2)
+    exact = SimilaritySearch(matrix)
+    queries = matrix[:10] + 0.05 * np.random.default_rng(1).standard_normal((10, 16)).astype(np.float32)
+    for query in queries:
+        assert index.search(query, k=3)[0][0] == exact.search(query, k=3)[0][0]
+
+
+def test_centroid_only_answers_with_representatives(tmp_path):
+    matrix, labels = make_identities()
+    write_identity_centroids(str(tmp_path), matrix, labels, 'v1')
+    index = IdentityIndex.load(str(tmp_path), matrix, 'v1', centroid_only=True)
+    query = matrix[0]
+    matches = index.search(query, k=2)
+    identity = int(labels[0].split('_')[1])
+    assert matches[0][0] == index.representatives[identity]
+    assert matches[0][1] == pytest.approx(float(index.centroids[identity] @ query), abs=1e-5)
+    assert index.search(query, k=2, threshold=2.0) == []
+
+
+def test_load_rejects_another_store(tmp_path):
+    matrix, labels = make_identities()
+    write_identity_centroids(str(tmp_path), matrix, labels, 'v1')
+    with pytest.raises(ValueError):
+        IdentityIndex.load(str(tmp_path), matrix, 'v2')
+    with pytest.raises(ValueError):
+        IdentityIndex.load(str(tmp_path), matrix[:-1], 'v1')
@@ -0,0 +1,97 @@
+import io
+import os
+import tarfile
+import zipfile
+import cv2
+import numpy as np
+import pytest
+from src.utils.image_io import UploadTooLargeError, decode_image, iter_archive_images, save_upload
+
+
+def encode(width, height, ext='.png'):
+    img = np.zeros((height, width, 3), dtype=np.uint8)
+    img[:, :width // 2] = (255, 0, 0)
+    ok, data = cv2.imencode(ext, img)
+    assert ok
+    return img, data.tobytes()
+
+
+def test_decode_matches_imread(tmp_path):
+    img, data = encode(64, 48)
+    path = str(tmp_path / 'img.png')
+    with open(path, 'wb') as f:
+        f.write(data)
+    decoded = decode_image(data)
+    np.testing.assert_array_equal(decoded, cv2.imread(path))
+    np.testing.assert_array_equal(decoded, img)
+
+
+def test_decoded_arrays_pass_through():
+    img, _ = encode(10, 10)
+    assert decode_image(img) is img
+
+
+@pytest.mark.parametrize('size,max_side,expected', [
+    ((64, 48), None, (48, 64)),
+    ((64, 48), 100, (48, 64)),
+    ((400, 200), 100, (50, 100)),
+    ((2000, 1000), 300, (150, 300)),
+    ((500, 1500), 300, (300, 100)),
+])
+def test_downscale_keeps_aspect_and_caps_the_longest_side(size, max_side, expected):
+    _, data = encode(*size, ext='.jpg')
+    assert decode_image(data, max_side=max_side).shape[:2] == expected
+
+
+def test_size_cap_and_garbage_are_rejected():
+    _, data = encode(64, 48)
+    assert decode_image(data, max_bytes=len(data)).shape == (48, 64, 3)
+    with pytest.raises(UploadTooLargeError):
+        decode_image(data, max_bytes=len(data) - 1)
+    with pytest.raises(ValueError):
+        decode_image(b'not an image')
+
+
+def test_save_upload_never_overwrites(tmp_path):
+    paths = [save_upload(b'x', str(tmp_path / 'upload'), 'me.png') for _ in range(3)]
+    assert len(set(paths)) == 3
+    assert all(path.endswith('.png') and os.path.exists(path) for path in paths)
+    assert save_upload(b'x', str(tmp_path / 'upload')).endswith('.jpg')
+
+
+def make_zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, 'w') as archive:
+        archive.writestr('folder/', '')
+        for name, data in members:
+            archive.writestr(name, data)
+    return buffer
+
+
+def make_tar(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode='w:gz') as archive:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer
+
+
+@pytest.mark.parametrize('make_archive', [make_zip, make_tar])
+def test_archive_members_stream_with_the_size_cap(make_archive):
+    members = [('folder/a.png', encode(8, 8)[1]), ('b.jpg', b'x' * 5000), ('c.txt', b'small')]
+    results = list(iter_archive_images(make_archive(members), max_bytes=1000))
+    assert [name for name, _ in results] == ['folder/a.png', 'b.jpg', 'c.txt']
+    assert results[0][1] == members[0][1] and results[2][1] == b'small'
+    assert isinstance(results[1][1], UploadTooLargeError)
+
+
+def test_archive_iteration_is_lazy():
+    members = iter_archive_images(make_zip([(f"{i}.png", b'data') for i in range(3)]))
+    assert next(members) == ('0.png', b'data')
+
+
+def test_unknown_archive_is_rejected():
+    with pytest.raises(tarfile.TarError):
+        list(iter_archive_images(io.BytesIO(b'plain bytes, not an archive')))
@@ -0,0 +1,27 @@
+import numpy as np
+import pytest
+from src.utils.inference_backend import VGGFACE_MEANS, preprocess_input
+
+
+def reference_preprocess(x, means):
+    # keras_vggface.utils.preprocess_input for channels-last input
+    x_temp = np.copy(x)[..., ::-1]
+    for channel, mean in enumerate(means):
+        x_temp[..., channel] -= mean
+    return x_temp
+
+
+@pytest.mark.parametrize('version', [1, 2])
+def test_preprocess_input_matches_keras_vggface(version):
+    faces = np.random.default_rng(0).uniform(0, 255, (2, 8, 8, 3)).astype(np.float32)
+    expected = reference_preprocess(faces, [float(v) for v in VGGFACE_MEANS[version]])
+    result = preprocess_input(faces, version=version)
+    assert result.dtype == np.float32
+    np.testing.assert_allclose(result, expected, rtol=1e-6, atol=1e-4)
+
+
+def test_preprocess_input_leaves_its_input_alone():
+    faces = np.full((1, 2, 2, 3), [10, 20, 30], dtype=np.uint8)
+    result = preprocess_input(faces)
+    np.testing.assert_allclose(result[0, 0, 0], [30 - 93.5940, 20 - 104.7624, 10 - 129.1863], rtol=1e-5)
+    assert (faces[0, 0, 0] == [10, 20, 30]).all()
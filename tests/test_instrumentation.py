@@ -0,0 +1,71 @@
+import json
+import logging
+import pytest
+from src.utils.instrumentation import (MetricsRegistry, log_timings, merge_timings, server_timing,
+                                       stage_timer)
+
+
+def test_histogram_buckets_are_cumulative():
+    registry = MetricsRegistry()
+    histogram = registry.histogram('latency_seconds', 'Latency', ('handler',), buckets=(0.1, 1.0))
+    for value in (0.05, 0.5, 0.5, 3.0):
+        histogram.observe(value, handler='predict')
+    lines = registry.render().splitlines()
+    assert lines[:2] == ['# HELP latency_seconds Latency', '# TYPE latency_seconds histogram']
+    assert lines[2:] == [
+        'latency_seconds_bucket{handler="predict",le="0.1"} 1',
+        'latency_seconds_bucket{handler="predict",le="1.0"} 3',
+        'latency_seconds_bucket{handler="predict",le="+Inf"} 4',
+        'latency_seconds_sum{handler="predict"} 4.05',
+        'latency_seconds_count{handler="predict"} 4',
+    ]
+
+
+def test_counters_gauges_and_label_escaping():
+    registry = MetricsRegistry()
+    counter = registry.counter('errors_total', 'Errors', ('kind',))
+    counter.inc(kind='a"b')
+    counter.inc(2, kind='a"b')
+    registry.gauge('entries', 'Entries', fn=lambda: 7)
+    registry.gauge('hits', 'Hits', ('cache',), fn=lambda: {'memory': 3})
+    text = registry.render()
+    assert 'errors_total{kind="a\\"b"} 3' in text
+    assert '\nentries 7\n' in text
+    assert 'hits{cache="memory"} 3' in text
+    assert registry.counter('errors_total', 'Errors', ('kind',)) is counter
+    with pytest.raises(ValueError):
+        counter.inc(other='x')
+
+
+def test_stage_timer_and_timings():
+    registry = MetricsRegistry()
+    histogram = registry.histogram('stage_seconds', 'Stages', ('stage',))
+    timings = {}
+    with stage_timer('detect', timings, histogram=histogram):
+        pass
+    with stage_timer('detect', timings, histogram=histogram):
+        pass
+    assert list(timings) == ['detect'] and timings['detect'] >= 0
+    assert 'stage_seconds_count{stage="detect"} 2' in registry.render()
+
+
+def test_merge_timings_and_server_timing():
+    timings = merge_timings({'decode': 0.001}, {'detect': 0.02}, {'detect': 0.03, 'embed': 0.1})
+    assert timings == pytest.approx({'decode': 0.001, 'detect': 0.05, 'embed': 0.1})
+    assert server_timing(timings) == 'decode;dur=1.0, detect;dur=50.0, embed;dur=100.0'
+
+
+def test_log_timings_is_one_json_line(caplog):
+    with caplog.at_level(logging.INFO):
+        log_timings(logging.getLogger('test'), 'predict', {'embed': 0.0123}, faces=2)
+    assert json.loads(caplog.records[-1].getMessage()) == \
+        {'event': 'predict', 'faces': 2, 'timings_ms': {'embed': 12.3}}
+
+
+def test_write_textfile(tmp_path):
+    registry = MetricsRegistry()
+    registry.counter('runs_total', 'Runs').inc()
+    path = str(tmp_path / 'metrics' / 'stage_02.prom')
+    registry.write_textfile(path)
+    with open(path) as f:
+        assert 'runs_total 1' in f.read()
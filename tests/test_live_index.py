@@ -0,0 +1,37 @@
+import numpy as np
+from src.utils.live_index import DeltaSearch
+from src.utils.search import SimilaritySearch, normalize_rows
+from src.utils.sharding import PartialResults
+
+
+def make_rows(n, seed):
+    return normalize_rows(np.random.default_rng(seed).standard_normal((n, 16)))
+
+
+def test_merge_offsets_delta_rows_and_keeps_the_best():
+    delta = DeltaSearch(SimilaritySearch(make_rows(4, 0)), make_rows(2, 1), offset=4)
+    merged = delta._merge([(0, 0.9), (3, 0.5)], [(0, 0.7), (1, 0.95)], k=3)
+    assert merged == [(5, 0.95), (0, 0.9), (4, 0.7)]
+    assert delta._merge([], [(1, 0.2)], k=2) == [(5, 0.2)]
+
+
+def test_search_batch_equals_search_over_all_rows():
+    base_rows, delta_rows = make_rows(30, 0), make_rows(5, 1)
+    delta = DeltaSearch(SimilaritySearch(base_rows, normalized=True), delta_rows, offset=30)
+    exact = SimilaritySearch(np.vstack([base_rows, delta_rows]), normalized=True)
+    queries = np.vstack([delta_rows[[2]], base_rows[[7]], make_rows(3, 2)])
+    results = delta.search_batch(queries, k=4)
+    assert [matches[0][0] for matches in results[:2]] == [32, 7]
+    for matches, expected in zip(results, exact.search_batch(queries, k=4)):
+        assert [i for i, _ in matches] == [i for i, _ in expected]
+    assert [i for i, _ in delta.search(queries[0], k=4)] == [i for i, _ in results[0]]
+
+
+def test_search_batch_keeps_missing_shards():
+    class PartialBase:
+        def search_batch(self, queries, k=1, threshold=None):
+            return PartialResults([[(0, 0.1)] for _ in queries], [2])
+
+    results = DeltaSearch(PartialBase(), make_rows(2, 1), offset=1).search_batch(make_rows(2, 1), k=1)
+    assert results.missing_shards == [2]
+    assert [matches[0][0] for matches in results] == [1, 2]
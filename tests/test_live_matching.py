@@ -0,0 +1,98 @@
+import time
+import numpy as np
+import pytest
+from src.utils.face_detection import box_iou
+from src.utils.live_matching import IoUTracker, LiveMatcher, preprocess_crop
+from src.utils.search import SimilaritySearch
+
+LIVE = {'reembed_every': 2, 'smoothing': 0.5, 'max_faces': 5, 'iou_threshold': 0.3, 'max_missed': 1}
+
+
+@pytest.mark.parametrize('a, b, expected', [
+    ((0, 0, 10, 10), (0, 0, 10, 10), 1.0),
+    ((0, 0, 10, 10), (5, 0, 10, 10), 50 / 150),
+    ((0, 0, 10, 10), (20, 20, 5, 5), 0.0),
+    ((0, 0, 0, 0), (0, 0, 0, 0), 0.0),
+])
+def test_box_iou(a, b, expected):
+    assert box_iou(a, b) == pytest.approx(expected)
+
+
+def test_tracker_keeps_ids_across_frames():
+    tracker = IoUTracker(iou_threshold=0.3, max_missed=1)
+    first = tracker.update([(0, 0, 10, 10), (50, 50, 10, 10)])
+    assert [t.track_id for t in first] == [0, 1]
+    moved = tracker.update([(52, 51, 10, 10), (1, 1, 10, 10)])
+    assert {t.track_id: t.box for t in moved} == {0: (1, 1, 10, 10), 1: (52, 51, 10, 10)}
+
+
+def test_tracker_drops_tracks_after_max_missed():
+    tracker = IoUTracker(iou_threshold=0.3, max_missed=1)
+    tracker.update([(0, 0, 10, 10)])
+    assert tracker.update([]) == [] and len(tracker.tracks) == 1
+    # Seen again within max_missed: same track
+    assert [t.track_id for t in tracker.update([(0, 0, 10, 10)])] == [0]
+    tracker.update([])
+    tracker.update([])
+    assert tracker.tracks == []
+    assert [t.track_id for t in tracker.update([(0, 0, 10, 10)])] == [1]
+
+
+def test_preprocess_crop_is_a_model_input():
+    frame = np.random.default_rng(0).integers(0, 255, (120, 160, 3), dtype=np.uint8)
+    crop = preprocess_crop(frame, (10, 20, 40, 50))
+    assert crop.shape == (224, 224, 3) and crop.dtype == np.float32
+
+
+class FixedDetector:
+    def __init__(self, boxes):
+        self.boxes = boxes
+
+    def detect(self, frame):
+        return [(box, 0.9) for box in self.boxes]
+
+
+def make_matcher(boxes, gallery):
+    calls = []
+
+    def embed_fn(crops):
+        calls.append(len(crops))
+        return np.stack([gallery[int(crop[0, 0])] for crop in crops])
+
+    matcher = LiveMatcher(detector=FixedDetector(boxes), embed_fn=embed_fn,
+                          # Every crop carries the gallery row of its box in pixel (0, 0)
+                          preprocess_fn=lambda frame, box: np.full((2, 2), box[0] // 100, dtype=np.float32),
+                          search_index=SimilaritySearch(gallery), labels=['ann', 'bob', 'cid'], live=LIVE)
+    return matcher, calls
+
+
+def test_matcher_labels_tracks_and_reembeds_periodically():
+    gallery = np.eye(3, dtype=np.float32)
+    matcher, calls = make_matcher([(0, 0, 50, 50), (200, 0, 50, 50)], gallery)
+    frame = np.zeros((10, 10, 3), dtype=np.uint8)
+
+    for _ in range(5):
+        matcher.process_frame(frame)
+    # Both faces embedded on the first step, then every reembed_every steps
+    assert calls == [2, 2, 2]
+    assert matcher.embeddings_run == 6 and matcher.frames_processed == 5
+    assert sorted((label, round(score, 5)) for _, _, label, score in matcher.results) == \
+        [('ann', 1.0), ('cid', 1.0)]
+
+
+def test_matcher_thread_processes_the_latest_frame():
+    gallery = np.eye(3, dtype=np.float32)
+    matcher, _ = make_matcher([(100, 0, 50, 50)], gallery)
+    frame = np.zeros((10, 10, 3), dtype=np.uint8)
+    matcher.start()
+    try:
+        matcher.submit_frame(frame)
+        for _ in range(200):
+            if matcher.frames_processed:
+                break
+            time.sleep(0.01)
+    finally:
+        matcher.stop()
+    assert matcher.results[0][2] == 'bob'
+    annotated = matcher.annotate(frame)
+    assert annotated.shape == frame.shape and not frame.any()
@@ -0,0 +1,82 @@
+import json
+import os
+import pytest
+from src.utils.pipeline import PipelineRunner, Stage
+
+
+@pytest.fixture
+def workdir(tmp_path):
+    (tmp_path / 'data').mkdir()
+    (tmp_path / 'data' / 'a.txt').write_text('a')
+    return tmp_path
+
+
+def make_runner(workdir, calls, params=None, fail=()):
+    data, middle, final = (str(workdir / name) for name in ('data', 'middle.txt', 'final.txt'))
+
+    def write(name, path):
+        def run(results):
+            calls.append(name)
+            if name in fail:
+                raise RuntimeError(f"{name} failed")
+            with open(path, 'w') as f:
+                f.write(f"{name} {sorted(os.listdir(data))}")
+            return name
+        return run
+
+    stages = [Stage('01', write('01', middle), inputs=[data], outputs=[middle], params=['scan']),
+              Stage('02', write('02', final), inputs=[middle], outputs=[final], params=['extraction'])]
+    params = params or {'scan': {'workers': 1}, 'extraction': {'batch_size': 8}}
+    return PipelineRunner(stages, params, str(workdir / 'state.json'), str(workdir / 'report.json'))
+
+
+def statuses(report):
+    return [entry['status'] for entry in report]
+
+
+def test_unchanged_stages_are_skipped(workdir):
+    calls = []
+    assert statuses(make_runner(workdir, calls).run()) == ['ran', 'ran']
+    assert statuses(make_runner(workdir, calls).run()) == ['skipped', 'skipped']
+    assert calls == ['01', '02']
+    with open(workdir / 'report.json') as f:
+        assert statuses(json.load(f)['stages']) == ['skipped', 'skipped']
+
+
+def test_changed_input_reruns_the_stage_and_the_ones_after_it(workdir):
+    calls = []
+    make_runner(workdir, calls).run()
+    (workdir / 'data' / 'b.txt').write_text('b')
+    assert statuses(make_runner(workdir, calls).run()) == ['ran', 'ran']
+    assert calls == ['01', '02', '01', '02']
+
+
+def test_changed_params_rerun_only_the_stages_using_them(workdir):
+    calls = []
+    make_runner(workdir, calls).run()
+    params = {'scan': {'workers': 1}, 'extraction': {'batch_size': 16}}
+    assert statuses(make_runner(workdir, calls, params).run()) == ['skipped', 'ran']
+
+
+def test_deleted_output_reruns_the_stage(workdir):
+    calls = []
+    make_runner(workdir, calls).run()
+    os.remove(workdir / 'final.txt')
+    assert statuses(make_runner(workdir, calls).run()) == ['skipped', 'ran']
+
+
+def test_force_and_only(workdir):
+    calls = []
+    make_runner(workdir, calls).run()
+    assert statuses(make_runner(workdir, calls).run(force=True, only=['02'])) == ['not selected', 'ran']
+    assert calls == ['01', '02', '02']
+
+
+def test_failing_stage_stops_the_pipeline_and_reruns_next_time(workdir):
+    calls = []
+    with pytest.raises(RuntimeError):
+        make_runner(workdir, calls, fail=['01']).run()
+    with open(workdir / 'report.json') as f:
+        assert statuses(json.load(f)['stages']) == ['failed']
+    assert statuses(make_runner(workdir, calls).run()) == ['ran', 'ran']
+    assert calls == ['01', '01', '02']
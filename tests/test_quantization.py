@@ -0,0 +1,81 @@
+import os
+import numpy as np
+import pytest
+from src.utils.quantization import (CODEC_FILE, CODES_FILE, CompressedSearch, Float16Codec, ProductQuantizer,
+                                    ScalarQuantizer, load_compressed, make_codec, write_compressed)
+from src.utils.search import SimilaritySearch, normalize_rows
+
+
+@pytest.fixture
+def matrix():
+    return normalize_rows(np.random.default_rng(0).standard_normal((300, 16)))
+
+
+@pytest.fixture
+def query():
+    return normalize_rows(np.random.default_rng(1).standard_normal((1, 16)))[0]
+
+
+@pytest.mark.parametrize('codec,bytes_per_row,tolerance', [
+    (Float16Codec(), 32, 1e-3),
+    (ScalarQuantizer(), 16, 0.05),
+    (ProductQuantizer(n_subspaces=4, n_iter=5), 4, 0.35),
+])
+def test_scores_approximate_exact_scores(matrix, query, codec, bytes_per_row, tolerance):
+    codec.train(matrix)
+    codes = codec.encode(matrix)
+    assert codes.nbytes == bytes_per_row * len(matrix)
+    np.testing.assert_allclose(codec.scores(codes, query), matrix @ query, atol=tolerance)
+
+
+def test_scalar_quantizer_state_round_trip(matrix, query):
+    codec = ScalarQuantizer().train(matrix)
+    restored = ScalarQuantizer.from_state(codec.state())
+    codes = codec.encode(matrix)
+    np.testing.assert_array_equal(restored.encode(matrix), codes)
+    np.testing.assert_allclose(restored.scores(codes, query), codec.scores(codes, query))
+
+
+def test_product_quantizer_needs_divisible_dim(matrix):
+    with pytest.raises(ValueError):
+        ProductQuantizer(n_subspaces=5).train(matrix)
+
+
+def test_make_codec():
+    assert make_codec({'method': 'int8'}).method == 'int8'
+    pq = make_codec({'method': 'pq', 'pq_subspaces': 8, 'pq_train_sample': 100})
+    assert (pq.n_subspaces, pq.train_sample) == (8, 100)
+    with pytest.raises(ValueError):
+        make_codec({'method': 'int4'})
+
+
+def test_compressed_search_with_rerank_is_exact_on_top_k(matrix):
+    codec = ScalarQuantizer().train(matrix)
+    search = CompressedSearch(codec.encode(matrix), codec, matrix, rerank=50)
+    exact = SimilaritySearch(matrix, normalized=True)
+    for row in (0, 17, 123):
+        matches = search.search(matrix[row], k=5)
+        assert matches[0][0] == row
+        assert [i for i, _ in matches] == [i for i, _ in exact.search(matrix[row], k=5)]
+    assert search.search_batch(matrix[:2], k=1, threshold=2.0) == [[], []]
+
+
+def test_compressed_search_without_matrix_uses_approximate_scores(matrix):
+    codec = Float16Codec().train(matrix)
+    search = CompressedSearch(codec.encode(matrix), codec, rerank=50)
+    assert search.rerank == 0 and len(search) == len(matrix)
+    assert search.search(matrix[9], k=1)[0][0] == 9
+
+
+def test_write_and_load_check_the_store_version(matrix, tmp_path):
+    store_dir = str(tmp_path)
+    write_compressed(store_dir, matrix, {'method': 'int8'}, 'resnet50/avg/1')
+    codes, codec = load_compressed(store_dir, 'resnet50/avg/1')
+    assert codec.method == 'int8' and codes.shape == (300, 16)
+    assert load_compressed(store_dir, 'resnet50/avg/2') == (None, None)
+
+    # Turning compression off removes the stale codes
+    write_compressed(store_dir, matrix, {'method': 'none'}, 'resnet50/avg/1')
+    assert not os.path.exists(os.path.join(store_dir, CODES_FILE))
+    assert not os.path.exists(os.path.join(store_dir, CODEC_FILE))
+    assert load_compressed(store_dir, 'resnet50/avg/1') == (None, None)
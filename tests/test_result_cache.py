@@ -0,0 +1,68 @@
+import pytest
+from src.utils.result_cache import LRUResultCache, SQLiteResultCache, make_result_cache
+
+
+@pytest.fixture(params=['memory', 'sqlite'])
+def make_cache(request, tmp_path):
+    def make(**kwargs):
+        if request.param == 'memory':
+            return LRUResultCache(**kwargs)
+        return SQLiteResultCache(str(tmp_path / 'results.sqlite'), **kwargs)
+    return make
+
+
+def test_get_and_put(make_cache):
+    cache = make_cache(version='v1')
+    assert cache.get('a') is None
+    cache.put('a', [[1, 0.9]])
+    assert cache.get('a') == [[1, 0.9]]
+    assert (cache.hits, cache.misses) == (1, 1)
+
+
+def test_least_recently_used_is_evicted(make_cache):
+    cache = make_cache(max_entries=2)
+    cache.put('a', 1)
+    cache.put('b', 2)
+    assert cache.get('a') == 1
+    cache.put('c', 3)
+    assert cache.get('b') is None
+    assert cache.get('a') == 1 and cache.get('c') == 3
+
+
+def test_expired_entries_miss(make_cache, monkeypatch):
+    cache = make_cache(ttl_seconds=10)
+    now = [1000.0]
+    monkeypatch.setattr('src.utils.result_cache.time.time', lambda: now[0])
+    cache.put('a', 1)
+    now[0] += 5
+    assert cache.get('a') == 1
+    now[0] += 10
+    assert cache.get('a') is None
+
+
+def test_memory_cache_drops_entries_on_version_change():
+    cache = LRUResultCache(version='v1')
+    cache.put('v1:a', 1)
+    cache.set_version('v1')
+    assert cache.get('v1:a') == 1
+    cache.set_version('v2')
+    assert cache.get('v1:a') is None
+
+
+def test_sqlite_workers_on_other_versions_keep_their_entries(tmp_path):
+    path = str(tmp_path / 'results.sqlite')
+    old = SQLiteResultCache(path, version='v1')
+    old.put('v1:a', 1)
+    new = SQLiteResultCache(path, version='v2')
+    new.put('v2:a', 2)
+    new.set_version('v2')
+    assert old.get('v1:a') == 1
+    assert new.get('v2:a') == 2
+
+
+def test_make_result_cache(tmp_path):
+    settings = {'enabled': True, 'backend': 'memory', 'max_entries': 5, 'ttl_seconds': 60}
+    assert isinstance(make_result_cache(settings, str(tmp_path / 'r.sqlite'), 'v1'), LRUResultCache)
+    settings['backend'] = 'sqlite'
+    assert isinstance(make_result_cache(settings, str(tmp_path / 'r.sqlite'), 'v1'), SQLiteResultCache)
+    assert make_result_cache(dict(settings, enabled=False), str(tmp_path / 'r.sqlite'), 'v1') is None
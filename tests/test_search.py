@@ -0,0 +1,87 @@
+import numpy as np
+import pytest
+from src.utils.search import SimilaritySearch, normalize_rows, top_k_indices
+
+
+@pytest.fixture
+def gallery():
+    return np.random.default_rng(0).standard_normal((50, 16)).astype(np.float32)
+
+
+def test_normalize_rows_leaves_zero_rows_alone():
+    rows = normalize_rows(np.array([[3.0, 4.0], [0.0, 0.0]]))
+    assert rows.dtype == np.float32
+    np.testing.assert_allclose(rows, [[0.6, 0.8], [0.0, 0.0]])
+
+
+def test_top_k_indices_best_first():
+    scores = np.array([0.1, 0.9, 0.5, 0.7, 0.3], dtype=np.float32)
+    assert list(top_k_indices(scores, 3)) == [1, 3, 2]
+    assert list(top_k_indices(scores, 10)) == [1, 3, 2, 4, 0]
+    assert len(top_k_indices(scores, 0)) == 0
+
+
+def test_search_matches_brute_force_cosine(gallery):
+    index = SimilaritySearch(gallery)
+    query = np.random.default_rng(1).standard_normal(16).astype(np.float32)
+    scores = normalize_rows(gallery) @ (query / np.linalg.norm(query))
+    matches = index.search(query, k=5)
+    assert [i for i, _ in matches] == list(np.argsort(-scores)[:5])
+    np.testing.assert_allclose([s for _, s in matches], np.sort(scores)[::-1][:5], rtol=1e-5)
+
+
+def test_search_finds_a_scaled_gallery_row(gallery):
+    index, score = SimilaritySearch(list(gallery)).search(gallery[12] * 3.0)[0]
+    assert index == 12
+    assert score == pytest.approx(1.0, abs=1e-5)
+
+
+def test_search_threshold(gallery):
+    index = SimilaritySearch(gallery)
+    matches = index.search(gallery[0], k=len(gallery), threshold=0.2)
+    assert matches and all(score >= 0.2 for _, score in matches)
+    assert matches == [m for m in index.search(gallery[0], k=len(gallery)) if m[1] >= 0.2]
+
+
+def test_empty_gallery_is_rejected():
+    with pytest.raises(ValueError):
+        SimilaritySearch(np.empty((0, 16), dtype=np.float32))
+
+
+def test_search_batch_matches_search(gallery):
+    index = SimilaritySearch(gallery)
+    queries = np.random.default_rng(1).standard_normal((7, 16)).astype(np.float32)
+    batch = index.search_batch(queries, k=5)
+    assert len(batch) == len(queries)
+    for query, matches in zip(queries, batch):
+        expected = index.search(query, k=5)
+        assert [i for i, _ in matches] == [i for i, _ in expected]
+        np.testing.assert_allclose([s for _, s in matches], [s for _, s in expected], rtol=1e-5)
+
+
+def test_search_batch_is_exact(gallery):
+    index = SimilaritySearch(gallery)
+    queries = gallery[[3, 17]] * 2.5
+    batch = index.search_batch(queries, k=3)
+    assert [matches[0][0] for matches in batch] == [3, 17]
+    assert batch[0][0][1] == pytest.approx(1.0, abs=1e-5)
+    scores = normalize_rows(queries) @ normalize_rows(gallery).T
+    for row, matches in zip(scores, batch):
+        assert [i for i, _ in matches] == list(top_k_indices(row, 3))
+
+
+def test_search_batch_threshold_and_large_k(gallery):
+    index = SimilaritySearch(gallery)
+    queries = gallery[:2]
+    everything = index.search_batch(queries, k=100)
+    assert all(len(matches) == len(gallery) for matches in everything)
+    assert all([s for _, s in matches] == sorted((s for _, s in matches), reverse=True)
+               for matches in everything)
+    filtered = index.search_batch(queries, k=100, threshold=0.2)
+    for matches, full in zip(filtered, everything):
+        assert matches == [m for m in full if m[1] >= 0.2]
+
+
+def test_empty_gallery_is_rejected():
+    with pytest.raises(ValueError):
+        SimilaritySearch(np.empty((0, 16), dtype=np.float32))
@@ -0,0 +1,81 @@
+import socket
+import threading
+from http.server import ThreadingHTTPServer
+import numpy as np
+import pytest
+from src.utils.embedding_store import store_version, write_embedding_store
+from src.utils.search import SimilaritySearch
+from src.utils.sharding import (ShardedSearch, ShardIndex, ShardsUnavailableError, _ShardHandler,
+                                shard_bounds)
+
+
+@pytest.mark.parametrize('count,num_shards', [(10, 3), (7, 7), (3, 5), (1000, 8), (0, 2)])
+def test_shard_bounds_cover_every_row_once(count, num_shards):
+    bounds = [shard_bounds(count, num_shards, shard_id) for shard_id in range(num_shards)]
+    assert bounds[0][0] == 0 and bounds[-1][1] == count
+    assert all(end == next_start for (_, end), (next_start, _) in zip(bounds, bounds[1:]))
+    sizes = [end - start for start, end in bounds]
+    assert max(sizes) - min(sizes) <= 1
+
+
+@pytest.fixture
+def store(tmp_path):
+    features = np.random.default_rng(0).standard_normal((40, 16)).astype(np.float32)
+    filenames = [f"data/person_{i % 8}/{i}.jpg" for i in range(len(features))]
+    store_dir = str(tmp_path / 'store')
+    header = write_embedding_store(store_dir, features, filenames, 'resnet50', 'avg')
+    return store_dir, features, store_version(header)
+
+
+@pytest.fixture
+def shard_servers(store):
+    store_dir = store[0]
+    servers = []
+    for shard_id in range(3):
+        server = ThreadingHTTPServer(('127.0.0.1', 0), _ShardHandler)
+        server.daemon_threads = True
+        server.index = ShardIndex(store_dir, shard_id, 3)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+    yield [f"http://127.0.0.1:{server.server_address[1]}" for server in servers]
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def unused_endpoint():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return f"http://127.0.0.1:{sock.getsockname()[1]}"
+
+
+def test_merged_results_match_exact_search(store, shard_servers):
+    _, features, version = store
+    queries = np.random.default_rng(1).standard_normal((5, 16)).astype(np.float32)
+    sharded = ShardedSearch(shard_servers, version, timeout_ms=5000)
+    results = sharded.search_batch(queries, k=6)
+    assert results.missing_shards == []
+
+    expected = SimilaritySearch(features).search_batch(queries, k=6)
+    for matches, exact in zip(results, expected):
+        assert [i for i, _ in matches] == [i for i, _ in exact]
+        np.testing.assert_allclose([s for _, s in matches], [s for _, s in exact], rtol=1e-5)
+    single = sharded.search(queries[0], k=6)
+    assert [i for i, _ in single] == [i for i, _ in results[0]]
+
+
+def test_missing_shards_are_left_out(store, shard_servers):
+    _, features, version = store
+    sharded = ShardedSearch(shard_servers + [unused_endpoint()], version, timeout_ms=5000)
+    results = sharded.search_batch(features[:2], k=1)
+    assert results.missing_shards == [3]
+    assert [matches[0][0] for matches in results] == [0, 1]
+
+
+def test_shards_of_another_store_version_are_missing(store, shard_servers):
+    _, features, _ = store
+    with pytest.raises(ShardsUnavailableError):
+        ShardedSearch(shard_servers, 'other/version', timeout_ms=5000).search_batch(features[:1], k=1)
+    results = ShardedSearch(shard_servers, 'other/version', timeout_ms=5000,
+                            min_shards=0).search_batch(features[:1], k=1)
+    assert results.missing_shards == [0, 1, 2] and results == [[]]
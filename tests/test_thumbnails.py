@@ -0,0 +1,57 @@
+import os
+import numpy as np
+from PIL import Image
+from src.utils.thumbnails import (GALLERY_IDS_FILE, build_thumbnails, gallery_id,
+                                  load_gallery_ids, thumbnail_path)
+
+
+def make_gallery(tmp_path, n=3):
+    paths = []
+    for i in range(n):
+        paths.append(str(tmp_path / f"img_{i}.jpg"))
+        Image.fromarray(np.full((120, 80, 3), 40 * i, dtype=np.uint8)).save(paths[-1])
+    return paths, [f"{i:x}" * 40 for i in range(n)]
+
+
+def test_build_thumbnails_and_load_ids(tmp_path):
+    paths, hashes = make_gallery(tmp_path)
+    gallery_dir = str(tmp_path / 'gallery')
+    ids = build_thumbnails(paths, hashes, gallery_dir, sizes=[64, 32], store_version='v1')
+
+    assert ids == [gallery_id(h) for h in hashes] and len(set(ids)) == 3
+    for image_id in ids:
+        for size in (64, 32):
+            with Image.open(thumbnail_path(gallery_dir, image_id, size)) as img:
+                assert img.format == 'WEBP' and max(img.size) == size
+    assert load_gallery_ids(gallery_dir, 'v1', expected_count=3) == ids
+
+
+def test_existing_thumbnails_are_kept(tmp_path):
+    paths, hashes = make_gallery(tmp_path, n=1)
+    gallery_dir = str(tmp_path / 'gallery')
+    ids = build_thumbnails(paths, hashes, gallery_dir, sizes=[32], store_version='v1')
+    path = thumbnail_path(gallery_dir, ids[0], 32)
+    os.utime(path, (0, 0))
+    build_thumbnails(paths, hashes, gallery_dir, sizes=[32], store_version='v2')
+    assert os.stat(path).st_mtime == 0
+
+
+def test_unreadable_image_does_not_stop_the_build(tmp_path):
+    paths, hashes = make_gallery(tmp_path, n=2)
+    with open(paths[0], 'wb') as f:
+        f.write(b'not an image')
+    gallery_dir = str(tmp_path / 'gallery')
+    ids = build_thumbnails(paths, hashes, gallery_dir, sizes=[32], store_version='v1')
+    assert len(ids) == 2
+    assert not os.path.exists(thumbnail_path(gallery_dir, ids[0], 32))
+    assert os.path.exists(thumbnail_path(gallery_dir, ids[1], 32))
+
+
+def test_stale_or_misaligned_ids_are_ignored(tmp_path):
+    paths, hashes = make_gallery(tmp_path)
+    gallery_dir = str(tmp_path / 'gallery')
+    assert load_gallery_ids(gallery_dir, 'v1', expected_count=3) is None
+    build_thumbnails(paths, hashes, gallery_dir, sizes=[32], store_version='v1')
+    assert os.path.exists(os.path.join(gallery_dir, GALLERY_IDS_FILE))
+    assert load_gallery_ids(gallery_dir, 'v2', expected_count=3) is None
+    assert load_gallery_ids(gallery_dir, 'v1', expected_count=4) is None
@@ -6,17 +6,34 @@ import numpy as np
 from PIL import Image
 import tempfile
 import os
+from src.utils.all_utils import read_yaml
+from src.utils.live_matching import build_live_matcher, load_live_gallery
 
 captured_image = None  # Will hold the latest captured frame
+config = read_yaml('config/config.yaml')
+params = read_yaml('params.yaml')
+
+@st.experimental_singleton
+def get_live_gallery():
+    # Model and gallery are loaded once and shared by every stream
+    return load_live_gallery(config, params)
 
 class VideoTransformer(VideoTransformerBase):
     def __init__(self):
         self.latest_frame = None
+        # Tracks belong to one camera, so every stream gets its own matcher
+        self.matcher = build_live_matcher(config, params, get_live_gallery()).start()
+
+    def on_ended(self):
+        self.matcher.stop()
 
     def transform(self, frame: av.VideoFrame) -> np.ndarray:
         img = frame.to_ndarray(format="bgr24")
         self.latest_frame = img
-        return img
+        # Inference runs in the background on the newest frame only;
+        # every frame is drawn with the latest results
+        self.matcher.submit_frame(img)
+        return self.matcher.annotate(img)
 
 
 st.title("📸 Live Camera Face Capture")